@@ -6,31 +6,38 @@
 
 import os
 import json
+import math
+import random
 
 import subprocess
 import re
+import time
+import struct
+import zlib
+import mmap
+import asyncio
+import sqlite3
+import hashlib
+import threading
 import util
 import fire
 import cluster
 import psycopg
-from psycopg import sql
+import numpy as np
+from psycopg import sql, pq
+from psycopg.adapt import Transformer
 from psycopg.rows import dict_row
 from datetime import datetime
-from multiprocessing import Manager, cpu_count, Value, Lock
+from multiprocessing import cpu_count, Value
 from ordered_set import OrderedSet
 from itertools import combinations
+from bisect import bisect_right
+from fnmatch import fnmatchcase
 from mpire import WorkerPool
 from concurrent.futures import ThreadPoolExecutor
 
 l_dir = "/tmp"
 
-# Shared variables needed by multiprocessing
-queue = Manager().list()
-result_queue = Manager().list()
-diff_dict = Manager().dict()
-row_diff_count = Value("I", 0)
-lock = Lock()
-
 # Set max number of rows up to which
 # diff-tables will work
 MAX_DIFF_ROWS = 10000
@@ -39,6 +46,202 @@ MAX_ALLOWED_BLOCK_SIZE = 100000
 BLOCK_ROWS_DEFAULT = os.environ.get("ACE_BLOCK_ROWS", 10000)
 MAX_CPU_RATIO_DEFAULT = os.environ.get("ACE_MAX_CPU_RATIO", 0.6)
 
+# Block boundaries are planned on the server by default. The stats planner
+# derives them from pg_stats instead, and falls back to the exact planner once
+# more than STATS_STALE_RATIO of the table has been modified since it was last
+# analyzed, and to the server planner if any block it plans is estimated to
+# hold more than STATS_MAX_BLOCK_RATIO times block_rows rows
+RANGE_PLANNERS = ["stats", "server", "exact"]
+RANGE_PLANNER_DEFAULT = os.environ.get("ACE_RANGE_PLANNER", "server")
+STATS_STALE_RATIO = 0.1
+STATS_MAX_BLOCK_RATIO = 2
+
+# Local store for the persistent Merkle trees of block hashes
+MTREE_DIR = os.environ.get("ACE_MTREE_DIR", "mtree")
+MTREE_DB = "ace_mtree.db"
+MTREE_SCHEMA_VERSION = 2
+
+# Schema the change logs of Merkle tree tables are kept in on every node
+MTREE_LOG_SCHEMA = "ace_mtree"
+
+# Block hash functions. md5 hashes the whole block as one sorted text value,
+# so its block size is capped. stream combines per-row hashes in constant
+# memory without a sort, which allows much larger blocks.
+HASH_MODES = ["md5", "stream"]
+HASH_MODE_DEFAULT = os.environ.get("ACE_HASH_MODE", "md5")
+MAX_ALLOWED_BLOCK_SIZE_STREAM = 10000000
+
+# Mismatched blocks can be bisected into this many sub-ranges at a time
+# until a differing sub-range holds no more than BISECT_LEAF_ROWS_DEFAULT rows
+BISECT_FACTOR_DEFAULT = os.environ.get("ACE_BISECT_FACTOR", 4)
+BISECT_LEAF_ROWS_DEFAULT = os.environ.get("ACE_BISECT_LEAF_ROWS", 500)
+
+# Each worker pipelines up to this many block hash queries at a time on its
+# connection to each node
+MAX_INFLIGHT_DEFAULT = os.environ.get("ACE_MAX_INFLIGHT", 8)
+
+# In consistent mode, how long to wait for the nodes to reach the LSN fence
+# and how often to poll spock.lag_tracker meanwhile (seconds)
+FENCE_TIMEOUT_DEFAULT = os.environ.get("ACE_FENCE_TIMEOUT", 300)
+FENCE_POLL_INTERVAL = 1
+
+# With --use_replicas, how long to wait for the sub-node replicas of every
+# node to replay its WAL up to where it was when the diff started, and how
+# often to poll them meanwhile (seconds)
+REPLICA_TIMEOUT_DEFAULT = os.environ.get("ACE_REPLICA_TIMEOUT", 300)
+REPLICA_POLL_INTERVAL = 1
+
+# Engines for comparing the rows of mismatched blocks. text compares rows as
+# sets of stringified tuples; columnar merge-joins typed column arrays on the
+# primary key and names the columns that changed.
+COMPARE_ENGINES = ["text", "columnar"]
+COMPARE_ENGINE_DEFAULT = os.environ.get("ACE_COMPARE_ENGINE", "text")
+
+# How the rows of mismatched blocks are fetched. select uses a regular query;
+# copy streams the rows with a binary COPY and compares them undecoded. Tables
+# with columns of types whose binary form is not comparable across nodes are
+# fetched with select instead.
+FETCH_MODES = ["select", "copy"]
+FETCH_MODE_DEFAULT = os.environ.get("ACE_FETCH_MODE", "select")
+COPY_BINARY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+COPY_BINARY_TRAILER = b"\xff\xff"
+COPY_INT2 = struct.Struct("!h")
+COPY_INT4 = struct.Struct("!i")
+
+# Differing keys are looked up in batches of this size by table-rerun
+RERUN_BATCH_SIZE_DEFAULT = os.environ.get("ACE_RERUN_BATCH_SIZE", 1000)
+
+# How table-repair applies fixes. row upserts and deletes one row at a time,
+# with the values recorded in the diff file; bulk copies the rows the source
+# of truth holds at repair time into staging tables and applies them
+# set-based.
+REPAIR_MODES = ["row", "bulk"]
+REPAIR_MODE_DEFAULT = os.environ.get("ACE_REPAIR_MODE", "row")
+
+# table-repair commits every chunk_rows rows, and pauses before a chunk while
+# replication lag or active sessions on any node exceed these limits (0 means
+# no limit)
+REPAIR_CHUNK_ROWS_DEFAULT = os.environ.get("ACE_REPAIR_CHUNK_ROWS", 10000)
+REPAIR_MAX_LAG_BYTES_DEFAULT = os.environ.get("ACE_REPAIR_MAX_LAG_BYTES", 104857600)
+REPAIR_MAX_ACTIVE_DEFAULT = os.environ.get("ACE_REPAIR_MAX_ACTIVE", 0)
+REPAIR_GOVERNOR_POLL_INTERVAL = 1
+
+# How schema-diff compares schemas. catalog hashes normalized object
+# definitions read from pg_catalog; dump diffs the text of pg_dump -s.
+SCHEMA_DIFF_ENGINES = ["catalog", "dump"]
+SCHEMA_DIFF_ENGINE_DEFAULT = os.environ.get("ACE_SCHEMA_DIFF_ENGINE", "catalog")
+SCHEMA_DIFF_MAX_PRINT = 50
+CATALOG_CACHE_DIR = os.environ.get("ACE_CATALOG_CACHE_DIR", "catalog_cache")
+CATALOG_CACHE_DB = "ace_catalog.db"
+
+# Incremental diffs (--incremental) only compare the rows committed after a
+# table's watermark, which advances to the start of every run that matches.
+# Deletes are caught by comparing the key counts and largest keys of the
+# nodes first, but a value that diverged before the watermark, or a row
+# deleted on a node that has had another added since, is only seen by the
+# next full diff, which is run again once the last one is older than
+# full_interval seconds.
+WATERMARK_DIR = os.environ.get("ACE_WATERMARK_DIR", "watermarks")
+WATERMARK_DB = "ace_watermarks.db"
+INCREMENTAL_FULL_INTERVAL_DEFAULT = os.environ.get(
+    "ACE_INCREMENTAL_FULL_INTERVAL", 86400
+)
+
+# With --precheck, which is on by default, a table or partition that matched
+# is skipped by later diffs of a table glob or partitioned table for as long
+# as the statistics of every node show no writes to it: the same relfilenode,
+# which TRUNCATE and table rewrites change, and the same inserted, updated
+# and deleted tuple counts. Backends report their counters with a delay, so
+# a write committed just before a run may only be seen by the next one.
+PRECHECK_DIR = os.environ.get("ACE_PRECHECK_DIR", "precheck")
+PRECHECK_DB = "ace_precheck.db"
+
+# table-diff journals the block plan of a job and the outcome of every block
+# as it completes, so that an interrupted job can be resumed (--resume) from
+# the blocks that did not complete. Blocks that fail are retried up to
+# block_retries times, waiting BLOCK_RETRY_BACKOFF seconds, then twice as
+# long before every further retry.
+JOURNAL_DIR = os.environ.get("ACE_JOURNAL_DIR", "jobs")
+JOURNAL_DB = "ace_jobs.db"
+BLOCK_RETRIES_DEFAULT = os.environ.get("ACE_BLOCK_RETRIES", 3)
+BLOCK_RETRY_BACKOFF = 1
+
+# Sampling (--sample) compares a seeded random share of each table's blocks
+# and estimates the share of divergent blocks with a 95% confidence interval
+SAMPLE_SEED_DEFAULT = os.environ.get("ACE_SAMPLE_SEED", 0)
+SAMPLE_CONFIDENCE_Z = 1.96
+
+# With --block_rows=auto, blocks are sized from a calibration sample of
+# about ADAPTIVE_CALIBRATION_BYTES so that hashing one takes the target time
+# on the slowest node, and are resized as block latencies drift. Blocks are
+# planned ADAPTIVE_SPLIT times finer than the calibrated size, so that they
+# can be coalesced or split during the run, and fewer workers are let
+# through at once while rows hash ADAPTIVE_SLOWDOWN times slower than
+# during calibration.
+TARGET_BLOCK_MS_DEFAULT = os.environ.get("ACE_TARGET_BLOCK_MS", 200)
+ADAPTIVE_CALIBRATION_BYTES = 8388608
+ADAPTIVE_SPLIT = 4
+ADAPTIVE_SLOWDOWN = 2.0
+ADAPTIVE_SPEEDUP = 1.25
+ADAPTIVE_GATE_POLL_INTERVAL = 0.05
+
+# The table-diff governor samples every node while blocks are compared, and
+# slows the diff down while any node is over one of these budgets (0 means no
+# limit): active ACE queries, active sessions, replication lag and MB/s read.
+# A node is also over budget while more than GOVERNOR_IO_WAIT_RATIO of its
+# (at least GOVERNOR_IO_WAIT_MIN_SESSIONS) active sessions wait on I/O. The
+# node's in-flight queries are halved, then fewer workers are let through at
+# once and a pause of up to GOVERNOR_MAX_PACE_MS is added between batches.
+# All of it is restored step by step once every node is back under budget.
+GOVERNOR_MAX_QUERIES_DEFAULT = os.environ.get("ACE_GOVERNOR_MAX_QUERIES", 0)
+GOVERNOR_MAX_ACTIVE_DEFAULT = os.environ.get("ACE_GOVERNOR_MAX_ACTIVE", 0)
+GOVERNOR_MAX_LAG_BYTES_DEFAULT = os.environ.get("ACE_GOVERNOR_MAX_LAG_BYTES", 0)
+GOVERNOR_MAX_READ_MBPS_DEFAULT = os.environ.get("ACE_GOVERNOR_MAX_READ_MBPS", 0)
+GOVERNOR_IO_WAIT_RATIO = 0.5
+GOVERNOR_IO_WAIT_MIN_SESSIONS = 4
+GOVERNOR_MAX_PACE_MS = 5000
+GOVERNOR_POLL_INTERVAL = 1
+
+# Every ACE session identifies itself with this application_name, so that its
+# load can be told apart from (and deprioritized against) the applications',
+# and runs with this statement_timeout in ms (0 keeps the server's setting)
+SESSION_APPLICATION_NAME = os.environ.get("ACE_APPLICATION_NAME", "ace_low_priority")
+SESSION_STATEMENT_TIMEOUT = os.environ.get("ACE_STATEMENT_TIMEOUT", 0)
+
+SPOCK_LAG_SQL = (
+    "SELECT coalesce(max(replication_lag_bytes), 0) FROM spock.lag_tracker"
+)
+
+"""
+Tables without a primary key or usable unique index are compared as multisets
+of rows. Rows are hashed into buckets of about block_rows rows each, and the
+buckets are summed over ranges of KEYLESS_RANGE_PAGES heap pages in parallel.
+The rows of all mismatched buckets are then fetched in one more pass, and
+only the rows whose counts differ between nodes are kept.
+"""
+KEYLESS_RANGE_PAGES = 8192
+
+# Diff files carry their metadata (hash mode, block size, etc.) under this key
+DIFF_META_KEY = "_meta"
+
+"""
+Binary diff files start with DIFF_BINARY_MAGIC and the id of the codec their
+chunks are compressed with. Each chunk holds at most DIFF_CHUNK_ROWS rows of
+one node of a node pair, column by column, and is followed by a chunk of just
+their keys. A footer indexes the chunks so that readers can map the file and
+stream it one chunk at a time, or read only the keys of the diffs.
+
+Columns are stored by the type of their values: bools, 64-bit ints and floats
+as fixed-width arrays, and text, or json for arrays and objects, as lengths
+followed by UTF-8 data. Each column starts with one null flag byte per row.
+"""
+DIFF_BINARY_MAGIC = b"ACEDIFF1"
+DIFF_CHUNK_FORMAT = "typed"
+DIFF_CODEC_ZSTD = 1
+DIFF_CODEC_ZLIB = 2
+DIFF_CHUNK_ROWS = 10000
+DIFF_OUTPUTS = ["csv", "json", "binary"]
+
 # Return codes for compare_checksums
 BLOCK_OK = 0
 MAX_DIFF_EXCEEDED = 1
@@ -139,6 +342,29 @@ def get_row_count(p_con, p_schema, p_table):
     return rows
 
 
+def get_row_estimate(p_con, p_schema, p_table):
+    """
+    Returns the planner's estimate of the row count of a table, which costs
+    nothing to read, or counts the rows if the table has no estimate yet
+    """
+    cur = p_con.cursor()
+    cur.execute(
+        """
+        SELECT c.reltuples FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relname = %s
+        """,
+        [p_schema, p_table],
+    )
+    r = cur.fetchone()
+    cur.close()
+
+    if not r or r[0] <= 0:
+        return get_row_count(p_con, p_schema, p_table)
+
+    return int(r[0])
+
+
 def get_cols(p_con, p_schema, p_table):
     sql = """
     SELECT ordinal_position, column_name
@@ -171,7 +397,140 @@ def get_cols(p_con, p_schema, p_table):
     return ",".join(col_lst)
 
 
-def get_key(p_con, p_schema, p_table):
+def get_col_types(p_con, p_schema, p_table, cols=None):
+    """
+    Returns the type OIDs of the columns of a SELECT * on the table, or of
+    the given columns only
+    """
+    cur = p_con.cursor()
+    cur.execute(
+        sql.SQL("SELECT {select_list} FROM {table_name} LIMIT 0").format(
+            select_list=get_select_list(cols),
+            table_name=sql.SQL("{}.{}").format(
+                sql.Identifier(p_schema), sql.Identifier(p_table)
+            ),
+        )
+    )
+    col_types = [col.type_code for col in cur.description]
+    cur.close()
+    return col_types
+
+
+def get_copy_col_types(p_con, p_schema, p_table, cols=None):
+    """
+    Returns the type OIDs of the columns for binary COPY fetches, or None if
+    the rows cannot be compared that way. Rows are compared on their raw
+    COPY bytes, so only built-in types with a binary loader are allowed: the
+    binary form of arrays and composites of other types embeds type OIDs
+    that differ between nodes, and a type without a binary loader would be
+    reported as bytes rather than the value select mode reports.
+    """
+    col_types = get_col_types(p_con, p_schema, p_table, cols)
+
+    cur = p_con.cursor()
+    cur.execute(
+        "SELECT count(*) FROM pg_type WHERE oid = ANY(%s)"
+        " AND typnamespace <> 'pg_catalog'::regnamespace",
+        (col_types,),
+    )
+    other_types = cur.fetchone()[0]
+    cur.close()
+
+    if other_types or any(
+        p_con.adapters.get_loader(oid, pq.Format.BINARY) is None
+        for oid in col_types
+    ):
+        return None
+
+    return col_types
+
+
+def set_copy_col_types(table_objects, p_con, p_schema, p_table, cols=None):
+    """
+    Sets up a table for binary COPY fetches, or falls back to select mode
+    for it if its rows cannot be compared that way
+    """
+    col_types = get_copy_col_types(p_con, p_schema, p_table, cols)
+
+    if col_types is None:
+        util.message(
+            f"{p_schema}.{p_table} has columns whose binary COPY form cannot be "
+            "compared across nodes: fetching its rows with select",
+            p_state="warning",
+        )
+        table_objects["fetch_mode"] = "select"
+    else:
+        table_objects["col_types"] = col_types
+
+
+def get_col_type_names(p_con, p_schema, p_table):
+    """Returns the SQL type of every column of the table, by column name"""
+    sql = """
+    SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+    FROM pg_attribute a
+    JOIN pg_class c ON c.oid = a.attrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = %s AND c.relname = %s
+    AND a.attnum > 0 AND NOT a.attisdropped
+    ORDER BY a.attnum
+    """
+
+    try:
+        cur = p_con.cursor()
+        cur.execute(sql, [p_schema, p_table])
+        rows = cur.fetchall()
+        cur.close()
+    except Exception as e:
+        util.exit_message("Error in get_col_type_names():\n" + str(e), 1)
+
+    return {row[0]: row[1] for row in rows}
+
+
+def get_unique_key(p_con, p_schema, p_table):
+    """
+    Returns the columns and name of the unique index that can stand in for a
+    missing primary key, or (None, None). The index must cover only NOT NULL
+    columns, with no expressions or predicate; the table's REPLICA IDENTITY
+    index is preferred, then the index with the fewest columns.
+    """
+    sql = """
+    SELECT i.indexrelid::regclass::text,
+        array_agg(a.attname::text ORDER BY k.ord)
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    CROSS JOIN LATERAL unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, ord)
+    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+    WHERE n.nspname = %s AND c.relname = %s
+    AND i.indisunique AND i.indisvalid AND i.indimmediate
+    AND i.indpred IS NULL AND i.indexprs IS NULL
+    AND k.ord <= i.indnkeyatts
+    GROUP BY i.indexrelid, i.indisreplident
+    HAVING bool_and(a.attnotnull)
+    ORDER BY i.indisreplident DESC, count(*), 1
+    LIMIT 1
+    """
+
+    try:
+        cur = p_con.cursor()
+        cur.execute(sql, [p_schema, p_table])
+        row = cur.fetchone()
+        cur.close()
+    except Exception as e:
+        util.exit_message("Error in get_unique_key():\n" + str(e), 1)
+
+    if not row:
+        return None, None
+
+    return ",".join(row[1]), row[0]
+
+
+def get_key(p_con, p_schema, p_table, unique_fallback=True):
+    """
+    Returns the primary key columns of a table. Tables without one are keyed
+    on a suitable unique index, if they have one, unless unique_fallback is
+    False.
+    """
     sql = """
     SELECT C.COLUMN_NAME
     FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS T,
@@ -196,7 +555,9 @@ def get_key(p_con, p_schema, p_table):
     except Exception as e:
         util.exit_message("Error in get_key():\n" + str(e), 1)
 
-    if not rows:
+    if not rows and unique_fallback:
+        return get_unique_key(p_con, p_schema, p_table)[0]
+    elif not rows:
         return None
 
     key_lst = []
@@ -206,6 +567,72 @@ def get_key(p_con, p_schema, p_table):
     return ",".join(key_lst)
 
 
+def check_bool_param(value, param_name):
+    if type(value) is int:
+        if value < 0 or value > 1:
+            util.exit_message(f"{param_name} should be True (1) or False (0)")
+        value = bool(value)
+
+    if type(value) is not bool:
+        util.exit_message(f"{param_name} should be True (1) or False (0)")
+
+    return value
+
+
+def get_max_block_size(hash_mode):
+    # Capping max block size here to prevent the hash function from taking forever
+    if hash_mode == "stream":
+        return MAX_ALLOWED_BLOCK_SIZE_STREAM
+
+    return MAX_ALLOWED_BLOCK_SIZE
+
+
+def check_block_rows(block_rows, hash_mode):
+    """
+    Validates --block_rows, which is either "auto" or a block size within
+    the bounds allowed for the hash mode, and returns it
+    """
+    if hash_mode not in HASH_MODES:
+        util.exit_message(
+            f"Invalid hash mode '{hash_mode}'. "
+            f"Valid values are {', '.join(HASH_MODES)}"
+        )
+
+    # With "auto", the block size is calibrated against the nodes
+    if block_rows == "auto":
+        return block_rows
+
+    if type(block_rows) is str:
+        try:
+            block_rows = int(block_rows)
+        except Exception:
+            util.exit_message("Invalid values for ACE_BLOCK_ROWS or --block_rows")
+    elif type(block_rows) is not int:
+        util.exit_message("Invalid value type for ACE_BLOCK_ROWS or --block_rows")
+
+    max_block_size = get_max_block_size(hash_mode)
+    if block_rows > max_block_size:
+        util.exit_message(f"Block row size should be <= {max_block_size}")
+    if block_rows < MIN_ALLOWED_BLOCK_SIZE:
+        util.exit_message(f"Block row size should be >= {MIN_ALLOWED_BLOCK_SIZE}")
+
+    return block_rows
+
+
+def get_session_params():
+    """Connection parameters that every ACE session is opened with"""
+    try:
+        statement_timeout = int(SESSION_STATEMENT_TIMEOUT)
+    except Exception:
+        util.exit_message("Invalid values for ACE_STATEMENT_TIMEOUT")
+
+    params = {"application_name": SESSION_APPLICATION_NAME}
+    if statement_timeout:
+        params["options"] = f"-c statement_timeout={statement_timeout}"
+
+    return params
+
+
 def parse_nodes(nodes) -> list:
     node_list = []
     if type(nodes) is str and nodes != "all":
@@ -225,9 +652,354 @@ def parse_nodes(nodes) -> list:
     return node_list
 
 
-def schema_diff(cluster_name, nodes, schema_name):
+def parse_columns(columns) -> list:
+    if type(columns) is str:
+        return [s.strip() for s in columns.split(",") if s.strip()]
+
+    return [str(col) for col in columns]
+
+
+def get_projection(cols_list, p_key, columns=None, exclude_columns=None):
+    """
+    Returns the columns selected for comparison by --columns and
+    --exclude_columns, in table order, or None if whole rows are compared.
+    Key columns are always compared, as rows are matched on them.
+    """
+    if not columns and not exclude_columns:
+        return None
+
+    key_cols = p_key.split(",")
+    selected = parse_columns(columns) if columns else list(cols_list)
+    excluded = parse_columns(exclude_columns) if exclude_columns else []
+
+    unknown = [col for col in selected + excluded if col not in cols_list]
+    if unknown:
+        util.exit_message(f"Column(s) {', '.join(unknown)} not found in table")
+
+    if any(col in key_cols for col in excluded):
+        util.exit_message("Primary key columns cannot be excluded")
+
+    projection = [
+        col
+        for col in cols_list
+        if (col in selected or col in key_cols) and col not in excluded
+    ]
+
+    return None if projection == cols_list else projection
+
+
+def get_select_list(cols, alias=None):
+    """Returns the select list for the given columns, or * for whole rows"""
+    if not cols:
+        return sql.SQL("{}.*").format(sql.Identifier(alias)) if alias else sql.SQL("*")
+
+    return sql.SQL(", ").join(
+        [sql.Identifier(alias, col) if alias else sql.Identifier(col) for col in cols]
+    )
+
+
+# Normalized definitions of the objects in a schema, one row per object. Names
+# are unqualified and nothing depends on OIDs or physical ordering, so the
+# same schema yields the same rows on every node.
+CATALOG_OBJECTS_SQL = """
+WITH ns AS (SELECT oid FROM pg_namespace WHERE nspname = %(schema)s)
+SELECT 'table ' || c.relname,
+    concat_ws(' ',
+        CASE c.relkind WHEN 'p' THEN 'PARTITIONED' END,
+        CASE c.relpersistence WHEN 'u' THEN 'UNLOGGED' END,
+        '(' || (
+            SELECT string_agg(quote_ident(a.attname), ', ' ORDER BY a.attnum)
+            FROM pg_attribute a
+            WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+        ) || ')')
+FROM pg_class c
+WHERE c.relnamespace = (SELECT oid FROM ns) AND c.relkind IN ('r', 'p')
+UNION ALL
+SELECT 'column ' || c.relname || '.' || a.attname,
+    concat_ws(' ',
+        format_type(a.atttypid, a.atttypmod),
+        CASE WHEN a.attcollation <> t.typcollation
+            THEN 'COLLATE ' || quote_ident(co.collname) END,
+        CASE WHEN a.attnotnull THEN 'NOT NULL' END,
+        'DEFAULT ' || pg_get_expr(d.adbin, d.adrelid),
+        CASE a.attidentity
+            WHEN 'a' THEN 'GENERATED ALWAYS AS IDENTITY'
+            WHEN 'd' THEN 'GENERATED BY DEFAULT AS IDENTITY' END)
+FROM pg_attribute a
+JOIN pg_class c ON c.oid = a.attrelid
+JOIN pg_type t ON t.oid = a.atttypid
+LEFT JOIN pg_collation co ON co.oid = a.attcollation
+LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+WHERE c.relnamespace = (SELECT oid FROM ns) AND c.relkind IN ('r', 'p')
+    AND a.attnum > 0 AND NOT a.attisdropped
+UNION ALL
+SELECT 'index ' || c.relname, pg_get_indexdef(c.oid)
+FROM pg_index i
+JOIN pg_class c ON c.oid = i.indexrelid
+WHERE c.relnamespace = (SELECT oid FROM ns)
+UNION ALL
+SELECT 'constraint ' || c.relname || '.' || con.conname,
+    pg_get_constraintdef(con.oid)
+FROM pg_constraint con
+JOIN pg_class c ON c.oid = con.conrelid
+WHERE con.connamespace = (SELECT oid FROM ns)
+UNION ALL
+SELECT 'view ' || c.relname, pg_get_viewdef(c.oid)
+FROM pg_class c
+WHERE c.relnamespace = (SELECT oid FROM ns) AND c.relkind IN ('v', 'm')
+UNION ALL
+SELECT 'sequence ' || c.relname,
+    concat_ws(' ',
+        format_type(s.seqtypid, NULL),
+        'START', s.seqstart, 'INCREMENT', s.seqincrement,
+        'MINVALUE', s.seqmin, 'MAXVALUE', s.seqmax, 'CACHE', s.seqcache,
+        CASE WHEN s.seqcycle THEN 'CYCLE' END)
+FROM pg_sequence s
+JOIN pg_class c ON c.oid = s.seqrelid
+WHERE c.relnamespace = (SELECT oid FROM ns)
+UNION ALL
+SELECT 'function ' || p.proname
+        || '(' || pg_get_function_identity_arguments(p.oid) || ')',
+    CASE WHEN p.prokind IN ('f', 'p') THEN pg_get_functiondef(p.oid)
+        ELSE 'AGGREGATE RETURNS ' || pg_get_function_result(p.oid) END
+FROM pg_proc p
+WHERE p.pronamespace = (SELECT oid FROM ns)
+"""
+
+# Cheap probe of a schema's catalog rows. Any DDL on an object in the schema
+# writes new versions of its catalog rows, which changes their count or xmins,
+# so an unchanged probe means a cached fingerprint is still valid.
+CATALOG_PROBE_SQL = """
+WITH ns AS (SELECT oid FROM pg_namespace WHERE nspname = %(schema)s),
+rels AS (SELECT oid, xmin FROM pg_class WHERE relnamespace = (SELECT oid FROM ns))
+SELECT count(*)::text || ':' || coalesce(sum(x::text::bigint), 0)::text
+FROM (
+    SELECT xmin AS x FROM pg_namespace WHERE oid = (SELECT oid FROM ns)
+    UNION ALL SELECT xmin FROM rels
+    UNION ALL SELECT a.xmin FROM pg_attribute a JOIN rels r ON r.oid = a.attrelid
+    UNION ALL SELECT d.xmin FROM pg_attrdef d JOIN rels r ON r.oid = d.adrelid
+    UNION ALL SELECT i.xmin FROM pg_index i JOIN rels r ON r.oid = i.indexrelid
+    UNION ALL SELECT s.xmin FROM pg_sequence s JOIN rels r ON r.oid = s.seqrelid
+    UNION ALL SELECT xmin FROM pg_constraint
+        WHERE connamespace = (SELECT oid FROM ns)
+    UNION ALL SELECT xmin FROM pg_proc WHERE pronamespace = (SELECT oid FROM ns)
+    UNION ALL SELECT w.xmin FROM pg_rewrite w JOIN rels r ON r.oid = w.ev_class
+) catalog_rows
+"""
+
+
+def get_catalog_cache():
+    """Opens the local cache of catalog fingerprints, creating it if needed"""
+    if not os.path.exists(CATALOG_CACHE_DIR):
+        os.makedirs(CATALOG_CACHE_DIR)
+
+    store = sqlite3.connect(os.path.join(CATALOG_CACHE_DIR, CATALOG_CACHE_DB))
+    store.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS catalog_fingerprints (
+            cluster     TEXT NOT NULL,
+            node        TEXT NOT NULL,
+            schema_name TEXT NOT NULL,
+            probe       TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            objects     TEXT NOT NULL,
+            built_at    TEXT NOT NULL,
+            PRIMARY KEY (cluster, node, schema_name)
+        );
+        """
+    )
+    return store
+
+
+def get_catalog_fingerprint(objects):
+    """Hashes every object's definition, and the whole schema from those"""
+    object_hashes = {
+        name: hashlib.md5(definition.encode()).hexdigest()
+        for name, definition in objects.items()
+    }
+    fingerprint = hashlib.md5(
+        "\n".join(f"{name}\0{object_hashes[name]}" for name in sorted(objects)).encode()
+    ).hexdigest()
+
+    return fingerprint, object_hashes
+
+
+def fetch_catalog(nd, schema_name, cached=None):
+    """
+    Fetches the normalized object definitions of a schema from a node.
+    cached holds the probe and objects recorded for the node on an earlier
+    run, which are reused if the schema's catalog rows have not changed.
+
+    Returns the probe and the objects, or None if the schema does not exist.
+    """
+    conn = connect_node(nd, autocommit=True)
+
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT 1 FROM pg_namespace WHERE nspname = %s", [schema_name]
+        )
+        if not cur.fetchone():
+            return None
+
+        cur.execute(CATALOG_PROBE_SQL, {"schema": schema_name})
+        probe = cur.fetchone()[0]
+
+        if cached and cached["probe"] == probe:
+            return probe, cached["objects"]
+
+        cur.execute(CATALOG_OBJECTS_SQL, {"schema": schema_name})
+        objects = {name: definition or "" for name, definition in cur.fetchall()}
+        cur.close()
+    finally:
+        conn.close()
+
+    return probe, objects
+
+
+def schema_diff_catalog(cluster_name, cluster_nodes, node_list, schema_name, use_cache):
+    """
+    Compares a schema across any number of nodes from their catalogs. Object
+    definitions are fetched from all nodes concurrently and hashed per
+    object; each node is then compared with the first one, object by
+    object, and the differing objects are written out with their
+    definitions on every node.
+    """
+    nodes = [nd for nd in cluster_nodes if nd["name"] in node_list]
+    node_list = [nd["name"] for nd in nodes]
+
+    cache = get_catalog_cache() if use_cache else None
+    cached = {}
+
+    if cache:
+        for node, probe, objects in cache.execute(
+            "SELECT node, probe, objects FROM catalog_fingerprints"
+            " WHERE cluster = ? AND schema_name = ?",
+            (cluster_name, schema_name),
+        ):
+            cached[node] = {"probe": probe, "objects": json.loads(objects)}
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+            futures = {
+                nd["name"]: executor.submit(
+                    fetch_catalog, nd, schema_name, cached.get(nd["name"])
+                )
+                for nd in nodes
+            }
+            catalogs = {node: future.result() for node, future in futures.items()}
+    except Exception as e:
+        util.exit_message(f"Error in schema_diff() reading catalogs: {e}")
+
+    for node in node_list:
+        if catalogs[node] is None:
+            util.exit_message(f"Schema {schema_name} does not exist on node {node}")
+
+    fingerprints = {}
+    object_hashes = {}
+    for node in node_list:
+        probe, objects = catalogs[node]
+        fingerprints[node], object_hashes[node] = get_catalog_fingerprint(objects)
+
+        if cache and cached.get(node, {}).get("probe") != probe:
+            with cache:
+                cache.execute(
+                    "INSERT OR REPLACE INTO catalog_fingerprints"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        cluster_name,
+                        node,
+                        schema_name,
+                        probe,
+                        fingerprints[node],
+                        json.dumps(objects),
+                        datetime.now().astimezone(None).isoformat(),
+                    ),
+                )
+
+    ref_node = node_list[0]
+    diff_objects = set()
+
+    for node in node_list[1:]:
+        if fingerprints[node] == fingerprints[ref_node]:
+            util.message(
+                f"SCHEMAS ARE THE SAME- between {ref_node} and {node} !!",
+                p_state="success",
+            )
+            continue
+
+        prRed(
+            f"\u2718   SCHEMAS ARE NOT THE SAME- between {ref_node} and {node}!!"
+        )
+
+        ref_hashes = object_hashes[ref_node]
+        node_hashes = object_hashes[node]
+        differences = []
+
+        for name in sorted(set(ref_hashes) | set(node_hashes)):
+            if name not in node_hashes:
+                differences.append(f"{name}: missing on {node}")
+            elif name not in ref_hashes:
+                differences.append(f"{name}: missing on {ref_node}")
+            elif ref_hashes[name] != node_hashes[name]:
+                differences.append(f"{name}: definitions differ")
+            else:
+                continue
+            diff_objects.add(name)
+
+        for difference in differences[:SCHEMA_DIFF_MAX_PRINT]:
+            util.message(f"  {difference}", p_state="warning")
+        if len(differences) > SCHEMA_DIFF_MAX_PRINT:
+            util.message(
+                f"  ... and {len(differences) - SCHEMA_DIFF_MAX_PRINT} more",
+                p_state="warning",
+            )
+
+    if not diff_objects:
+        return
+
+    diff_out = {
+        "schema": schema_name,
+        "nodes": node_list,
+        "objects": {
+            name: {node: catalogs[node][1].get(name) for node in node_list}
+            for name in sorted(diff_objects)
+        },
+    }
+
+    dirname = os.path.join(
+        "diffs", datetime.now().astimezone(None).strftime("%Y-%m-%d_%H:%M:%S")
+    )
+    os.makedirs(dirname)
+    filename = os.path.join(dirname, "schema_diff.json")
+
+    with open(filename, "w") as f:
+        f.write(json.dumps(diff_out, indent=2))
+
+    print()
+    util.message(
+        f"Schema diffs written out to {util.set_colour(filename, 'blue')}",
+        p_state="info",
+    )
+
+
+def schema_diff(
+    cluster_name,
+    nodes,
+    schema_name,
+    engine=SCHEMA_DIFF_ENGINE_DEFAULT,
+    use_cache=False,
+):
     """Compare Postgres schemas on different cluster nodes"""
 
+    if engine not in SCHEMA_DIFF_ENGINES:
+        util.exit_message(
+            f"Invalid schema-diff engine '{engine}'. "
+            f"Valid values are {', '.join(SCHEMA_DIFF_ENGINES)}"
+        )
+
+    use_cache = check_bool_param(use_cache, "use_cache")
+
     util.message(f"## Validating cluster {cluster_name} exists")
     node_list = []
     try:
@@ -238,11 +1010,6 @@ def schema_diff(cluster_name, nodes, schema_name):
                 E.g., --nodes="n1,n2". Error: {e}'
         )
 
-    if len(node_list) > 3:
-        util.exit_message(
-            "schema-diff currently supports up to a three-way table comparison"
-        )
-
     if nodes != "all" and len(node_list) == 1:
         util.exit_message("schema-diff needs at least two nodes to compare")
 
@@ -269,6 +1036,12 @@ def schema_diff(cluster_name, nodes, schema_name):
         if nodes == "all":
             node_list.append(nd["name"])
 
+    if engine == "catalog":
+        schema_diff_catalog(
+            cluster_name, cluster_nodes, node_list, schema_name, use_cache
+        )
+        return
+
     sql1, sql2 = "", ""
     l_schema = schema_name
     file_list = []
@@ -353,6 +1126,7 @@ def spock_diff(cluster_name, nodes):
                 password=nd["password"],
                 host=nd["ip_address"],
                 port=nd.get("port", 5432),
+                **get_session_params(),
                 row_factory=dict_row,
             )
             conn_list[nd["name"]] = psql_conn
@@ -457,47 +1231,216 @@ def spock_diff(cluster_name, nodes):
             )
 
 
-def run_query(worker_state, host, query):
-    cur = worker_state[host]
-    cur.execute(query)
-    results = cur.fetchall()
+async def run_query_async(conn, query):
+    async with conn.cursor() as cur:
+        await cur.execute(query)
+        return await cur.fetchall()
+
+
+async def run_pipeline(conn, queries, max_inflight):
+    """
+    Sends the queries over one connection in pipeline mode, keeping up to
+    max_inflight of them in flight at a time, and returns their results in
+    order. Each window costs a single round trip to the node.
+    """
+    results = []
+
+    async with conn.pipeline() as pipeline:
+        for i in range(0, len(queries), max_inflight):
+            cursors = []
+            for query in queries[i : i + max_inflight]:
+                # Queries may come with their parameters
+                query, params = query if isinstance(query, tuple) else (query, None)
+                cur = conn.cursor()
+                await cur.execute(query, params)
+                cursors.append(cur)
+
+            await pipeline.sync()
+
+            for cur in cursors:
+                results.append(await cur.fetchall())
+                await cur.close()
+
     return results
 
 
+async def copy_query_async(conn, query):
+    """
+    Runs the query as a binary COPY and returns the raw bytes of each row,
+    without decoding them.
+
+    libpq hands COPY data over one row at a time, so the chunks read are
+    the rows, with the file header in front of the first one and the
+    trailer in a chunk of its own.
+    """
+    copy_sql = sql.SQL("COPY ({query}) TO STDOUT (FORMAT binary)").format(
+        query=query
+    )
+
+    async with conn.cursor() as cur:
+        async with cur.copy(copy_sql) as copy:
+            rows = [bytes(chunk) async for chunk in copy]
+
+    if not rows or not rows[0].startswith(COPY_BINARY_SIGNATURE):
+        raise ValueError("Unexpected binary COPY header")
+
+    # Signature, flags, and the header extension area
+    header_len = len(COPY_BINARY_SIGNATURE) + 4
+    header_len += 4 + COPY_INT4.unpack_from(rows[0], header_len)[0]
+    rows[0] = rows[0][header_len:]
+
+    return [row for row in rows if row and row != COPY_BINARY_TRAILER]
+
+
+def decode_copy_row(row, tx):
+    """
+    Decodes the raw bytes of one binary COPY row with the loaders set up on
+    the transformer tx.
+    """
+    nfields = COPY_INT2.unpack_from(row, 0)[0]
+    pos = 2
+    fields = []
+
+    for _ in range(nfields):
+        length = COPY_INT4.unpack_from(row, pos)[0]
+        pos += 4
+        if length < 0:
+            fields.append(None)
+        else:
+            fields.append(row[pos : pos + length])
+            pos += length
+
+    return tx.load_sequence(fields)
+
+
+def get_copy_transformer(conn, col_types):
+    tx = Transformer(conn)
+    tx.set_loader_types(col_types, pq.Format.BINARY)
+    return tx
+
+
+def run_query(worker_state, host, query):
+    return worker_state["loop"].run_until_complete(
+        run_query_async(worker_state[host], query)
+    )
+
+
+def run_queries(worker_state, node_queries, runner=run_query_async):
+    """
+    Runs one query per node, concurrently across the nodes, and returns the
+    results keyed by node. runner is the coroutine that runs a query on a
+    connection.
+    """
+
+    async def run_all():
+        results = await asyncio.gather(
+            *[
+                runner(worker_state[node], query)
+                for node, query in node_queries.items()
+            ]
+        )
+        return dict(zip(node_queries.keys(), results))
+
+    return worker_state["loop"].run_until_complete(run_all())
+
+
+def run_pipelines(worker_state, node_queries, max_inflight):
+    """
+    Pipelines a list of queries on each node, concurrently across the nodes,
+    and returns the lists of results keyed by node. max_inflight is either
+    one limit for every node or a limit per node.
+    """
+    if not isinstance(max_inflight, dict):
+        max_inflight = {node: max_inflight for node in node_queries}
+
+    async def run_all():
+        results = await asyncio.gather(
+            *[
+                run_pipeline(worker_state[node], queries, max_inflight[node])
+                for node, queries in node_queries.items()
+            ]
+        )
+        return dict(zip(node_queries.keys(), results))
+
+    return worker_state["loop"].run_until_complete(run_all())
+
+
 def init_db_connection(shared_objects, worker_state):
+    """
+    Gives each worker its own event loop and one persistent asynchronous
+    connection to every node being compared. The connections are in
+    autocommit mode, so no transaction is held open between queries, unless
+    the nodes are being compared at exported snapshots.
+    """
     db, pg, node_info = cluster.load_json(shared_objects["cluster_name"])
 
     cluster_nodes = []
     database = shared_objects["database"]
 
-    # Combine db and cluster_nodes into a single json
+    replicas = shared_objects.get("replicas")
+
+    # Combine db and cluster_nodes into a single json. With replicas, each
+    # worker reads a node from one of its replicas, picked at random so
+    # that the workers are spread across them.
     for node in node_info:
-        combined_json = {**database, **node}
-        cluster_nodes.append(combined_json)
+        if node["name"] in shared_objects["node_list"]:
+            combined_json = {**database, **node}
+            if replicas:
+                combined_json.update(random.choice(replicas[node["name"]]))
+            cluster_nodes.append(combined_json)
+
+    loop = asyncio.new_event_loop()
+    worker_state["loop"] = loop
+
+    snapshots = shared_objects.get("snapshots")
+
+    async def connect(node):
+        conn = await psycopg.AsyncConnection.connect(
+            dbname=node["db_name"],
+            user=node["username"],
+            password=node["password"],
+            host=node["ip_address"],
+            port=node.get("port", 5432),
+            **get_session_params(),
+            autocommit=not snapshots,
+        )
 
-    for node in cluster_nodes:
-        conn_str = f"dbname = {node['db_name']}      \
-                    user={node['username']}          \
-                    password={node['password']}   \
-                    host={node['ip_address']}   \
-                    port={node.get('port', 5432)}"
+        if snapshots:
+            # Every query of this worker runs in one transaction that sees
+            # the snapshot exported for the node
+            await conn.set_isolation_level(psycopg.IsolationLevel.REPEATABLE_READ)
+            await conn.set_read_only(True)
+            await conn.execute(
+                sql.SQL("SET TRANSACTION SNAPSHOT {}").format(
+                    sql.Literal(snapshots[node["name"]])
+                )
+            )
 
-        worker_state[node["name"]] = psycopg.connect(conn_str).cursor()
+        return conn
 
+    async def connect_all():
+        return await asyncio.gather(*[connect(node) for node in cluster_nodes])
 
-def compare_checksums(shared_objects, worker_state, pkey1, pkey2):
-    global row_diff_count
+    for node, conn in zip(cluster_nodes, loop.run_until_complete(connect_all())):
+        worker_state[node["name"]] = conn
 
-    if row_diff_count.value >= MAX_DIFF_ROWS:
-        return
 
-    p_key = shared_objects["p_key"]
-    schema_name = shared_objects["schema_name"]
-    table_name = shared_objects["table_name"]
-    node_list = shared_objects["node_list"]
-    cols = shared_objects["cols_list"]
-    simple_primary_key = shared_objects["simple_primary_key"]
+def close_db_connection(shared_objects, worker_state):
+    loop = worker_state.pop("loop")
 
+    for conn in worker_state.values():
+        loop.run_until_complete(conn.close())
+
+    loop.close()
+
+
+def get_range_clause(p_key, simple_primary_key, pkey1, pkey2, row_filter=None):
+    """
+    Returns the WHERE clause that selects the block of rows between pkey1
+    (inclusive) and pkey2 (exclusive). Either bound may be None, in which case
+    the block is open on that side. A row filter (--where) further limits the
+    rows of the block.
+    """
     where_clause = []
 
     if simple_primary_key:
@@ -516,14 +1459,19 @@ def compare_checksums(shared_objects, worker_state, pkey1, pkey2):
     else:
         """
         This is a slightly more complicated case since we have to split up
-        the primary key and compare them with split values of pkey1 and pkey2
+        the primary key and compare them with split values of pkey1 and pkey2.
+        Bounds planned from statistics only carry the leading key column(s),
+        so we compare as many columns as the bound has values.
         """
 
         if pkey1 is not None:
             where_clause.append(
                 sql.SQL("({p_key}) >= ({pkey1})").format(
                     p_key=sql.SQL(", ").join(
-                        [sql.Identifier(col.strip()) for col in p_key.split(",")]
+                        [
+                            sql.Identifier(col.strip())
+                            for col in p_key.split(",")[: len(pkey1)]
+                        ]
                     ),
                     pkey1=sql.SQL(", ").join([sql.Literal(val) for val in pkey1]),
                 )
@@ -533,145 +1481,4001 @@ def compare_checksums(shared_objects, worker_state, pkey1, pkey2):
             where_clause.append(
                 sql.SQL("({p_key}) < ({pkey2})").format(
                     p_key=sql.SQL(", ").join(
-                        [sql.Identifier(col.strip()) for col in p_key.split(",")]
+                        [
+                            sql.Identifier(col.strip())
+                            for col in p_key.split(",")[: len(pkey2)]
+                        ]
                     ),
                     pkey2=sql.SQL(", ").join([sql.Literal(val) for val in pkey2]),
                 )
             )
-    
-    if simple_primary_key:
-        hash_sql = sql.SQL(
-            "SELECT md5(cast(array_agg(t.* ORDER BY {p_key}) AS text)) FROM"
-            "(SELECT * FROM {table_name} WHERE {where_clause}) t"
+
+    if row_filter:
+        where_clause.append(sql.SQL("({})").format(sql.SQL(row_filter)))
+
+    if not where_clause:
+        return sql.SQL("TRUE")
+
+    return sql.SQL(" AND ").join(where_clause)
+
+
+def get_hash_sql(
+    schema_name,
+    table_name,
+    p_key,
+    where_clause,
+    hash_mode="md5",
+    block_stats=False,
+    cols=None,
+):
+    """
+    Returns the block hash query. With block_stats, the row count and the
+    on-disk size of the rows in the block are returned ahead of the hash.
+    Only the given columns are hashed if cols is set.
+    """
+    stats = sql.SQL("")
+    if block_stats:
+        stats = sql.SQL("count(*), coalesce(sum(pg_column_size(t.*)), 0)::bigint, ")
+
+    if hash_mode == "stream":
+        """
+        Order-independent block hash: the row count and two differently
+        seeded sums of the per-row hashes. The aggregates run in constant
+        memory and need no sort, whatever the size of the block.
+        """
+        return sql.SQL(
+            "SELECT {stats}count(*) || ':'"
+            " || coalesce(sum(hashtextextended(t::text, 0)), 0) || ':'"
+            " || coalesce(sum(hashtextextended(t::text, 1)), 0)"
+            " FROM (SELECT {select_list} FROM {table_name} WHERE {where_clause}) t"
         ).format(
-            p_key=sql.Identifier(p_key),
+            stats=stats,
+            select_list=get_select_list(cols),
             table_name=sql.SQL("{}.{}").format(
                 sql.Identifier(schema_name),
                 sql.Identifier(table_name),
             ),
-            where_clause=sql.SQL(" AND ").join(where_clause),
+            where_clause=where_clause,
         )
-    else:
-        hash_sql = sql.SQL(
-            "SELECT md5(cast(array_agg(t.* ORDER BY {p_key}) AS text)) FROM"
-            "(SELECT * FROM {table_name} WHERE {where_clause}) t"
+
+    return sql.SQL(
+        "SELECT {stats}md5(cast(array_agg(t.* ORDER BY {p_key}) AS text)) FROM"
+        "(SELECT {select_list} FROM {table_name} WHERE {where_clause}) t"
+    ).format(
+        stats=stats,
+        select_list=get_select_list(cols),
+        p_key=sql.SQL(", ").join(
+            [sql.Identifier(col.strip()) for col in p_key.split(",")]
+        ),
+        table_name=sql.SQL("{}.{}").format(
+            sql.Identifier(schema_name),
+            sql.Identifier(table_name),
+        ),
+        where_clause=where_clause,
+    )
+
+
+def get_block_sql(schema_name, table_name, where_clause, cols=None):
+    return sql.SQL("SELECT {select_list} FROM {table_name} WHERE {where_clause}").format(
+        select_list=get_select_list(cols),
+        table_name=sql.SQL("{}.{}").format(
+            sql.Identifier(schema_name),
+            sql.Identifier(table_name),
+        ),
+        where_clause=where_clause,
+    )
+
+
+def get_key_lookup_sql(
+    schema_name, table_name, p_key, key_types, cols=None, row_filter=None
+):
+    """
+    Returns the query that fetches the rows of a batch of primary keys. A
+    simple key is matched with = ANY of one array parameter. A composite key
+    is joined against the unnested arrays passed for each key column, which
+    works like a join against a VALUES list of the keys.
+
+    Only the given columns are fetched if cols is set, and only the rows
+    that also match row_filter (--where).
+    """
+    key_cols = [col.strip() for col in p_key.split(",")]
+    table = sql.SQL("{}.{}").format(
+        sql.Identifier(schema_name), sql.Identifier(table_name)
+    )
+
+    if len(key_cols) == 1:
+        return sql.SQL(
+            "SELECT {select_list} FROM {table}"
+            " WHERE {key} = ANY(%s::{key_type}[]){filter_clause}"
         ).format(
-            p_key=sql.SQL(", ").join(
-                [sql.Identifier(col.strip()) for col in p_key.split(",")]
-            ),
-            table_name=sql.SQL("{}.{}").format(
-                sql.Identifier(schema_name),
-                sql.Identifier(table_name),
+            select_list=get_select_list(cols),
+            table=table,
+            key=sql.Identifier(key_cols[0]),
+            key_type=sql.SQL(key_types[0]),
+            filter_clause=(
+                sql.SQL(" AND ({})").format(sql.SQL(row_filter))
+                if row_filter
+                else sql.SQL("")
             ),
-            where_clause=sql.SQL(" AND ").join(where_clause),
         )
 
-    block_sql = sql.SQL("SELECT * FROM {table_name} WHERE {where_clause}").format(
+    # The filter is applied before the join, where its columns are unambiguous
+    if row_filter:
+        table = sql.SQL("(SELECT * FROM {table} WHERE ({row_filter}))").format(
+            table=table, row_filter=sql.SQL(row_filter)
+        )
+
+    return sql.SQL(
+        "SELECT {select_list} FROM {table} t"
+        " JOIN unnest({key_arrays}) AS k({keys}) ON ({t_keys}) = ({k_keys})"
+    ).format(
+        select_list=get_select_list(cols, "t"),
+        table=table,
+        key_arrays=sql.SQL(", ").join(
+            [sql.SQL("%s::{}[]").format(sql.SQL(key_type)) for key_type in key_types]
+        ),
+        keys=sql.SQL(", ").join([sql.Identifier(col) for col in key_cols]),
+        t_keys=sql.SQL(", ").join([sql.Identifier("t", col) for col in key_cols]),
+        k_keys=sql.SQL(", ").join([sql.Identifier("k", col) for col in key_cols]),
+    )
+
+
+def get_pkey_sql(schema_name, table_name, p_key, row_filter=None):
+    return sql.SQL(
+        "SELECT {key} FROM {table_name} WHERE {where_clause} ORDER BY {key}"
+    ).format(
+        key=sql.SQL(", ").join([sql.Identifier(col) for col in p_key.split(",")]),
+        table_name=sql.SQL("{}.{}").format(
+            sql.Identifier(schema_name), sql.Identifier(table_name)
+        ),
+        where_clause=(
+            sql.SQL("({})").format(sql.SQL(row_filter))
+            if row_filter
+            else sql.SQL("TRUE")
+        ),
+    )
+
+
+def get_pkey_offsets(conn, pkey_sql, block_rows, simple_primary_key):
+    """
+    Exact planner: reads every primary key in order and cuts a block
+    boundary every block_rows keys.
+    """
+    pkey_offsets = []
+    cur = conn.cursor()
+    cur.execute(pkey_sql)
+    rows = cur.fetchmany(block_rows)
+
+    # No rows match the row filter on this node
+    if not rows:
+        cur.close()
+        return [(None, None)]
+
+    if simple_primary_key:
+        rows[:] = [str(x[0]) for x in rows]
+        pkey_offsets.append((None, str(rows[0])))
+        prev_min_offset = str(rows[0])
+        prev_max_offset = str(rows[-1])
+    else:
+        rows[:] = [tuple(str(i) for i in x) for x in rows]
+        pkey_offsets.append((None, rows[0]))
+        prev_min_offset = rows[0]
+        prev_max_offset = rows[-1]
+
+    while rows:
+        rows = cur.fetchmany(block_rows)
+        if simple_primary_key:
+            rows[:] = [str(x[0]) for x in rows]
+        else:
+            rows[:] = [tuple(str(i) for i in x) for x in rows]
+
+        if not rows:
+            if prev_max_offset != prev_min_offset:
+                pkey_offsets.append((prev_min_offset, prev_max_offset))
+            pkey_offsets.append((prev_max_offset, None))
+            break
+
+        curr_min_offset = rows[0]
+        pkey_offsets.append((prev_min_offset, curr_min_offset))
+        prev_min_offset = curr_min_offset
+        prev_max_offset = rows[-1]
+
+    cur.close()
+    return pkey_offsets
+
+
+def get_offsets_from_bounds(bounds):
+    """
+    Turns an ordered list of block boundaries into (start, end) ranges. The
+    first and last ranges are left open so that rows lying outside the
+    planned key space on other nodes are still compared.
+    """
+    if not bounds:
+        return [(None, None)]
+
+    pkey_offsets = [(None, bounds[0])]
+    pkey_offsets += [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+    pkey_offsets.append((bounds[-1], None))
+
+    return pkey_offsets
+
+
+def get_pkey_offsets_server(
+    conn, schema_name, table_name, p_key, block_rows, row_filter=None
+):
+    """
+    Server-side planner: the node numbers the keys in order and only returns
+    every block_rows-th one, so just the block boundaries cross the network.
+    """
+    key_cols = [sql.Identifier(col) for col in p_key.split(",")]
+
+    bounds_sql = sql.SQL(
+        "SELECT {key} FROM ("
+        "SELECT {key}, row_number() OVER (ORDER BY {key}) AS _ace_rn"
+        " FROM {table_name} WHERE {where_clause}) s"
+        " WHERE (_ace_rn - 1) % {block_rows} = 0"
+        " ORDER BY {key}"
+    ).format(
+        key=sql.SQL(", ").join(key_cols),
+        table_name=sql.SQL("{}.{}").format(
+            sql.Identifier(schema_name), sql.Identifier(table_name)
+        ),
+        where_clause=(
+            sql.SQL("({})").format(sql.SQL(row_filter))
+            if row_filter
+            else sql.SQL("TRUE")
+        ),
+        block_rows=sql.Literal(block_rows),
+    )
+
+    cur = conn.cursor()
+    cur.execute(bounds_sql)
+
+    if len(key_cols) == 1:
+        bounds = [str(row[0]) for row in cur.fetchall()]
+    else:
+        bounds = [tuple(str(i) for i in row) for row in cur.fetchall()]
+
+    cur.close()
+    return get_offsets_from_bounds(bounds)
+
+
+def estimate_block_rows(bounds, hist, hist_rows, mcvs, numeric):
+    """
+    Estimates the rows of every block between consecutive bounds (and of the
+    open blocks before the first and after the last) from a histogram of
+    hist_rows rows and the (value, rows) of the most common values, which
+    the histogram leaves out.
+    """
+    bucket_rows = hist_rows / (len(hist) - 1)
+
+    def rows_below(value):
+        if value <= hist[0]:
+            return 0
+        if value >= hist[-1]:
+            return hist_rows
+
+        i = bisect_right(hist, value) - 1
+        fraction = 0
+        if numeric and hist[i + 1] != hist[i]:
+            fraction = (value - hist[i]) / (hist[i + 1] - hist[i])
+
+        return (i + fraction) * bucket_rows
+
+    edges = [None] + list(bounds) + [None]
+    estimates = []
+
+    for lo, hi in zip(edges, edges[1:]):
+        rows = (hist_rows if hi is None else rows_below(hi)) - (
+            0 if lo is None else rows_below(lo)
+        )
+        rows += sum(
+            mcv_rows
+            for value, mcv_rows in mcvs
+            if (lo is None or value >= lo) and (hi is None or value < hi)
+        )
+        estimates.append(rows)
+
+    return estimates
+
+
+def get_pkey_offsets_stats(conn, schema_name, table_name, p_key, block_rows):
+    """
+    Statistics planner: derives block boundaries from the pg_stats histogram
+    of the (first) key column without reading the table at all.
+
+    Returns "stale" if the table has not been analyzed or has changed too
+    much since, and "unusable" if there is no histogram, its buckets are
+    too coarse and cannot be split, or a planned block is estimated to be
+    too large. Composite keys are ranged on their leading column only, so
+    a common leading value can make a block much larger than block_rows;
+    the most common values and their frequencies are counted in the
+    estimates for that reason.
+    """
+    lead_col = p_key.split(",")[0]
+
+    stats_sql = """
+    SELECT c.reltuples,
+        coalesce(st.last_analyze, st.last_autoanalyze) IS NOT NULL,
+        coalesce(st.n_mod_since_analyze, 0),
+        format_type(a.atttypid, a.atttypmod),
+        a.atttypid::regtype::text
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attname = %s
+    LEFT JOIN pg_stat_all_tables st ON st.relid = c.oid
+    WHERE n.nspname = %s AND c.relname = %s
+    """
+
+    cur = conn.cursor()
+    cur.execute(stats_sql, [lead_col, schema_name, table_name])
+    row = cur.fetchone()
+
+    if not row:
+        cur.close()
+        return "unusable"
+
+    reltuples, analyzed, n_mod, col_type, base_type = row
+
+    if not analyzed or reltuples <= 0 or n_mod > reltuples * STATS_STALE_RATIO:
+        cur.close()
+        return "stale"
+
+    bounds_sql = sql.SQL(
+        "SELECT unnest(histogram_bounds::text::{col_type}[]) FROM pg_stats"
+        " WHERE schemaname = %s AND tablename = %s AND attname = %s"
+    ).format(col_type=sql.SQL(col_type))
+
+    cur.execute(bounds_sql, [schema_name, table_name, lead_col])
+    hist = sorted(set(row[0] for row in cur.fetchall()))
+
+    mcv_sql = sql.SQL(
+        "SELECT unnest(most_common_vals::text::{col_type}[]),"
+        " unnest(most_common_freqs), null_frac FROM pg_stats"
+        " WHERE schemaname = %s AND tablename = %s AND attname = %s"
+    ).format(col_type=sql.SQL(col_type))
+
+    cur.execute(mcv_sql, [schema_name, table_name, lead_col])
+    mcv_rows = cur.fetchall()
+    cur.close()
+
+    if len(hist) < 2:
+        return "unusable"
+
+    mcvs = [(value, freq * reltuples) for value, freq, _ in mcv_rows]
+    null_frac = mcv_rows[0][2] if mcv_rows else 0
+
+    # The histogram only covers the rows that are neither null nor an MCV
+    hist_rows = max(reltuples * (1 - null_frac) - sum(rows for _, rows in mcvs), 0)
+    bucket_rows = hist_rows / (len(hist) - 1)
+    numeric = base_type in ("smallint", "integer", "bigint")
+    bounds = []
+
+    if bucket_rows <= block_rows:
+        # Buckets are finer than our blocks: keep every step-th bound
+        step = max(1, round(block_rows / bucket_rows)) if bucket_rows else 1
+        bounds = hist[::step]
+        if bounds[-1] != hist[-1]:
+            bounds.append(hist[-1])
+    elif numeric:
+        # Buckets are too coarse: split them evenly across the key space
+        splits = int(-(-bucket_rows // block_rows))
+        for lo, hi in zip(hist, hist[1:]):
+            step = (hi - lo) / splits
+            bounds.append(lo)
+            bounds += sorted({lo + int(step * k) for k in range(1, splits)} - {lo})
+        bounds.append(hist[-1])
+    else:
+        return "unusable"
+
+    max_rows = max(
+        block_rows, min(block_rows * STATS_MAX_BLOCK_RATIO, MAX_ALLOWED_BLOCK_SIZE)
+    )
+    if max(estimate_block_rows(bounds, hist, hist_rows, mcvs, numeric)) > max_rows:
+        return "unusable"
+
+    if "," in p_key:
+        bounds = [(str(b),) for b in bounds]
+    else:
+        bounds = [str(b) for b in bounds]
+
+    return get_offsets_from_bounds(bounds)
+
+
+def plan_key_ranges(
+    conn,
+    schema_name,
+    table_name,
+    p_key,
+    block_rows,
+    simple_primary_key,
+    range_planner,
+    row_filter=None,
+):
+    """
+    Computes the (start, end) primary key ranges of the blocks to compare,
+    using the requested range planner. With a row filter, blocks are planned
+    over the matching rows only, which statistics cannot tell apart, so the
+    server planner is used instead.
+    """
+    if range_planner == "stats" and row_filter:
+        range_planner = "server"
+
+    if range_planner == "stats":
+        pkey_offsets = get_pkey_offsets_stats(
+            conn, schema_name, table_name, p_key, block_rows
+        )
+
+        if pkey_offsets == "stale":
+            util.message(
+                f"Statistics for {schema_name}.{table_name} are stale: "
+                "planning blocks with the exact planner",
+                p_state="warning",
+            )
+            range_planner = "exact"
+        elif pkey_offsets == "unusable":
+            range_planner = "server"
+        else:
+            return pkey_offsets
+
+    if range_planner == "server":
+        return get_pkey_offsets_server(
+            conn, schema_name, table_name, p_key, block_rows, row_filter
+        )
+
+    pkey_sql = get_pkey_sql(schema_name, table_name, p_key, row_filter)
+    return get_pkey_offsets(conn, pkey_sql, block_rows, simple_primary_key)
+
+
+def get_split_sql(schema_name, table_name, p_key, where_clause, parts):
+    """
+    Returns the keys that split the rows selected by where_clause into (up
+    to) parts sub-ranges of roughly equal size.
+    """
+    key_cols = sql.SQL(", ").join(
+        [sql.Identifier(col.strip()) for col in p_key.split(",")]
+    )
+
+    return sql.SQL(
+        "SELECT {key} FROM ("
+        "SELECT {key}, row_number() OVER (ORDER BY {key}) AS _ace_rn,"
+        " count(*) OVER () AS _ace_cnt"
+        " FROM {table_name} WHERE {where_clause}) s"
+        " WHERE _ace_rn > 1"
+        " AND (_ace_rn - 1) % ceil(_ace_cnt::numeric / {parts})::bigint = 0"
+        " ORDER BY {key}"
+    ).format(
+        key=key_cols,
         table_name=sql.SQL("{}.{}").format(
             sql.Identifier(schema_name),
             sql.Identifier(table_name),
         ),
-        where_clause=sql.SQL(" AND ").join(where_clause),
+        where_clause=where_clause,
+        parts=sql.Literal(parts),
     )
 
-    node_pairs = combinations(node_list, 2)
 
-    block_result = {}
-    block_result["offset"] = f"{pkey1}-{pkey2}"
-    block_result["diffs"] = []
+def bisect_block(shared_objects, worker_state, host1, host2, pkey1, pkey2):
+    """
+    Localises the differences in a mismatched block before any rows are
+    fetched. The block is split into bisect_factor sub-ranges, which are
+    re-hashed on both nodes; matching sub-ranges are dropped and differing
+    ones are split again until they hold at most bisect_leaf_rows rows.
+
+    Returns the ranges whose rows need to be fetched, and updates the
+    bisection counters with the hash queries issued and the rows and bytes
+    a full block fetch would have cost on top of that.
+    """
+    p_key = shared_objects["p_key"]
+    schema_name = shared_objects["schema_name"]
+    table_name = shared_objects["table_name"]
+    simple_primary_key = shared_objects["simple_primary_key"]
+    hash_mode = shared_objects["hash_mode"]
+    columns = shared_objects["columns"]
+    row_filter = shared_objects["row_filter"]
+    factor = shared_objects["bisect_factor"]
+    leaf_rows = shared_objects["bisect_leaf_rows"]
+
+    queries = 0
+    rows_full, bytes_full = 0, 0
+    rows_fetched, bytes_fetched = 0, 0
+    fetch_ranges = []
+
+    # Each entry is (start, end, depth, (rows, bytes) of the range if known)
+    stack = [(pkey1, pkey2, 0, None)]
+
+    while stack:
+        start, end, depth, range_size = stack.pop()
+        where_clause = get_range_clause(
+            p_key, simple_primary_key, start, end, row_filter
+        )
+        split_sql = get_split_sql(
+            schema_name, table_name, p_key, where_clause, factor
+        )
 
-    for node_pair in node_pairs:
-        host1 = node_pair[0]
-        host2 = node_pair[1]
+        # Split on whichever node has rows in this range
+        bounds = []
+        for host in [host1, host2]:
+            queries += 1
+            rows = run_query(worker_state, host, split_sql)
+            if rows:
+                if simple_primary_key:
+                    bounds = [str(row[0]) for row in rows]
+                else:
+                    bounds = [tuple(str(i) for i in row) for row in rows]
+                break
 
-        # Return early if we have already exceeded the max number of diffs
-        if row_diff_count.value >= MAX_DIFF_ROWS:
-            queue.append(block_result)
-            return
+        if not bounds:
+            fetch_ranges.append((start, end))
+            if range_size:
+                rows_fetched += range_size[0]
+                bytes_fetched += range_size[1]
+            continue
 
-        try:
-            # Run the checksum query on both nodes in parallel
-            with ThreadPoolExecutor(max_workers=2) as executor:
-                futures = [
-                    executor.submit(run_query, worker_state, host1, hash_sql),
-                    executor.submit(run_query, worker_state, host2, hash_sql),
-                ]
-                hash1, hash2 = [f.result()[0][0] for f in futures]
-        except Exception as e:
-            print(f"query = {hash_sql.as_string(worker_state[host1])}", e)
-            result_queue.append(BLOCK_ERROR)
-            return
+        sub_ranges = [(start, bounds[0])]
+        sub_ranges += [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+        sub_ranges.append((bounds[-1], end))
+
+        for sub_start, sub_end in sub_ranges:
+            sub_where = get_range_clause(
+                p_key, simple_primary_key, sub_start, sub_end, row_filter
+            )
+            stats_sql = get_hash_sql(
+                schema_name,
+                table_name,
+                p_key,
+                sub_where,
+                hash_mode,
+                block_stats=True,
+                cols=columns,
+            )
+
+            queries += 2
+            results = run_queries(worker_state, {host1: stats_sql, host2: stats_sql})
+            count1, size1, hash1 = results[host1][0]
+            count2, size2, hash2 = results[host2][0]
+            sub_size = (count1 + count2, size1 + size2)
+
+            # The first level of sub-ranges adds up to the whole block
+            if depth == 0:
+                rows_full += sub_size[0]
+                bytes_full += sub_size[1]
+
+            if hash1 == hash2:
+                continue
+
+            if max(count1, count2) <= leaf_rows:
+                fetch_ranges.append((sub_start, sub_end))
+                rows_fetched += sub_size[0]
+                bytes_fetched += sub_size[1]
+            else:
+                stack.append((sub_start, sub_end, depth + 1, sub_size))
+
+    counters = shared_objects["counters"]
+    with counters["bisect_queries"].get_lock():
+        counters["bisect_queries"].value += queries
+    with counters["bisect_rows_saved"].get_lock():
+        counters["bisect_rows_saved"].value += max(rows_full - rows_fetched, 0)
+    with counters["bisect_bytes_saved"].get_lock():
+        counters["bisect_bytes_saved"].value += max(bytes_full - bytes_fetched, 0)
+
+    return fetch_ranges
+
+
+def group_nodes_by_hash(node_list, node_hashes):
+    """
+    Groups the nodes that returned the same block hash, largest group first.
+    Ties go to the group holding the node that comes first in node_list, so
+    the majority group is stable across blocks.
+    """
+    groups = {}
+    for node in node_list:
+        groups.setdefault(node_hashes[node], []).append(node)
+
+    return sorted(
+        groups.values(), key=lambda group: (-len(group), node_list.index(group[0]))
+    )
+
+
+def object_array(values):
+    """
+    Builds a 1-D object array holding the values as they are, also when the
+    values are themselves sequences (composite keys, arrays).
+    """
+    arr = np.empty(len(values), dtype=object)
+    try:
+        arr[:] = values
+    except ValueError:
+        for i, value in enumerate(values):
+            arr[i] = value
+    return arr
 
-        if hash1 != hash2:
-            try:
-                # Run the block query on both nodes in parallel
-                with ThreadPoolExecutor(max_workers=2) as executor:
-                    futures = [
-                        executor.submit(run_query, worker_state, host1, block_sql),
-                        executor.submit(run_query, worker_state, host2, block_sql),
-                    ]
-                    t1_result, t2_result = [f.result() for f in futures]
-            except Exception as e:
-                print(f"query = {block_sql}", e)
-                result_queue.append(BLOCK_ERROR)
-                return
 
-            # Transform all elements in t1_result and t2_result into strings before
-            # consolidating them into a set
-            # TODO: Test and add support for different datatypes here
-            t1_result = [
-                tuple(
-                    str(x) if not isinstance(x, list) else str(sorted(x)) for x in row
+def load_block_columns(rows, ncols, key_idx):
+    """
+    Loads the rows of a block into one object array per column, sorted on
+    the primary key. Values keep the Python types psycopg gave them.
+    """
+    if rows:
+        columns = [object_array(col) for col in zip(*rows)]
+    else:
+        columns = [object_array([]) for _ in range(ncols)]
+
+    if len(key_idx) == 1:
+        keys = columns[key_idx[0]]
+    else:
+        keys = object_array([tuple(row[i] for i in key_idx) for row in rows])
+
+    order = np.argsort(keys, kind="stable")
+
+    return {
+        "keys": keys[order],
+        "columns": [col[order] for col in columns],
+        "rows": [rows[i] for i in order],
+    }
+
+
+def values_differ(values1, values2):
+    """
+    Type-aware, elementwise inequality of two object arrays: 1 and 1.0 are
+    equal, timestamps are compared as instants, and NULLs or NaNs compare
+    equal to themselves.
+    """
+    differ = np.asarray(values1 != values2, dtype=bool)
+
+    for i in np.nonzero(differ)[0]:
+        v1, v2 = values1[i], values2[i]
+        if v1 is not None and v2 is not None and v1 != v1 and v2 != v2:
+            differ[i] = False
+
+    return differ
+
+
+def compare_block_columns(block1, block2, cols, key_idx):
+    """
+    Sorted merge-join of two blocks on the primary key. Rows are classified
+    as missing (only in block1), extra (only in block2) or changed (in both,
+    with different values).
+
+    Returns the rows of each block that are not in the other, and for every
+    changed row its key and the names of the columns that differ.
+    """
+    keys1, keys2 = block1["keys"], block2["keys"]
+
+    pos = np.searchsorted(keys2, keys1)
+    in_range = pos < len(keys2)
+
+    matched1 = np.zeros(len(keys1), dtype=bool)
+    matched1[in_range] = keys2[pos[in_range]] == keys1[in_range]
+
+    idx1 = np.nonzero(matched1)[0]
+    idx2 = pos[matched1]
+
+    matched2 = np.zeros(len(keys2), dtype=bool)
+    matched2[idx2] = True
+
+    changed = np.zeros(len(idx1), dtype=bool)
+    col_differs = {}
+
+    for c, col in enumerate(cols):
+        if c in key_idx:
+            continue
+        col_differs[col] = values_differ(
+            block1["columns"][c][idx1], block2["columns"][c][idx2]
+        )
+        changed |= col_differs[col]
+
+    diff_idx1 = np.sort(np.concatenate([np.nonzero(~matched1)[0], idx1[changed]]))
+    diff_idx2 = np.sort(np.concatenate([np.nonzero(~matched2)[0], idx2[changed]]))
+
+    key_cols = [cols[i] for i in key_idx]
+    changes = []
+    for i in np.nonzero(changed)[0]:
+        row = block1["rows"][idx1[i]]
+        changes.append(
+            {
+                "key": {col: row[k] for col, k in zip(key_cols, key_idx)},
+                "columns": [col for col, differ in col_differs.items() if differ[i]],
+            }
+        )
+
+    return (
+        [block1["rows"][i] for i in diff_idx1],
+        [block2["rows"][i] for i in diff_idx2],
+        changes,
+    )
+
+
+def stringify_row(row):
+    return tuple(str(x) if not isinstance(x, list) else str(sorted(x)) for x in row)
+
+
+def compare_block_rows(shared_objects, worker_state, pkey1, pkey2, groups):
+    """
+    Compares the rows of a block whose nodes were grouped by block hash.
+    Rows are fetched from one node of the majority group and one node of
+    each minority group, and the differences are recorded for every pair of
+    nodes in different groups.
+
+    Returns the block result, the diffs found keyed by node pair and, with
+    the columnar engine, the changed columns of each pair's changed rows.
+    """
+    row_diff_count = shared_objects["counters"]["row_diffs"]
+
+    p_key = shared_objects["p_key"]
+    schema_name = shared_objects["schema_name"]
+    table_name = shared_objects["table_name"]
+    node_list = shared_objects["node_list"]
+    cols = shared_objects["cols_list"]
+    columns = shared_objects["columns"]
+    row_filter = shared_objects["row_filter"]
+    simple_primary_key = shared_objects["simple_primary_key"]
+    columnar = shared_objects["compare_engine"] == "columnar"
+    copy_rows = shared_objects["fetch_mode"] == "copy"
+
+    block_diffs = {}
+    block_changes = {}
+
+    # Nodes in the same group hold the same rows, so one of each is enough
+    majority = groups[0][0]
+    group_nodes = [group[0] for group in groups]
+
+    block_sql = get_block_sql(
+        schema_name,
+        table_name,
+        get_range_clause(p_key, simple_primary_key, pkey1, pkey2, row_filter),
+        columns,
+    )
+
+    try:
+        if shared_objects["bisect"]:
+            # Every difference between two groups is also a difference from
+            # the majority, so these ranges cover all of them
+            fetch_ranges = []
+            for host in group_nodes[1:]:
+                fetch_ranges += bisect_block(
+                    shared_objects, worker_state, majority, host, pkey1, pkey2
                 )
-                for row in t1_result
-            ]
-            t2_result = [
-                tuple(
-                    str(x) if not isinstance(x, list) else str(sorted(x)) for x in row
+        else:
+            fetch_ranges = [(pkey1, pkey2)]
+
+        group_rows = {host: [] for host in group_nodes}
+
+        # The ranges bisected against different minority groups can be the
+        # same or overlap, so they are fetched together, each row once
+        fetch_ranges = list(dict.fromkeys(fetch_ranges))
+        if fetch_ranges:
+            where_clause = sql.SQL(" OR ").join(
+                [
+                    sql.SQL("({})").format(
+                        get_range_clause(p_key, simple_primary_key, start, end)
+                    )
+                    for start, end in fetch_ranges
+                ]
+            )
+            if row_filter:
+                where_clause = sql.SQL("({}) AND ({})").format(
+                    where_clause, sql.SQL(row_filter)
                 )
-                for row in t2_result
-            ]
+            block_sql = get_block_sql(schema_name, table_name, where_clause, columns)
+
+            # Run the block query on one node of each group concurrently
+            group_rows = run_queries(
+                worker_state,
+                {host: block_sql for host in group_nodes},
+                copy_query_async if copy_rows else run_query_async,
+            )
+    except Exception as e:
+        print(f"query = {block_sql.as_string(worker_state[majority])}", e)
+        return BLOCK_ERROR, block_diffs, block_changes
+
+    if copy_rows:
+        tx = get_copy_transformer(worker_state[majority], shared_objects["col_types"])
+
+    if columnar:
+        if copy_rows:
+            group_rows = {
+                host: [decode_copy_row(row, tx) for row in rows]
+                for host, rows in group_rows.items()
+            }
+        key_idx = [cols.index(col.strip()) for col in p_key.split(",")]
+        group_blocks = {
+            host: load_block_columns(rows, len(cols), key_idx)
+            for host, rows in group_rows.items()
+        }
+    elif copy_rows:
+        # Rows fetched with COPY are compared as raw bytes, and only the
+        # ones that differ get decoded
+        group_sets = {host: OrderedSet(rows) for host, rows in group_rows.items()}
+    else:
+        # Rows are compared as strings, and the diffs keep the values fetched
+        group_typed = {
+            host: {stringify_row(row): row for row in rows}
+            for host, rows in group_rows.items()
+        }
+        group_sets = {host: OrderedSet(rows) for host, rows in group_typed.items()}
+
+    node_group = {node: group[0] for group in groups for node in group}
+
+    # Diff files stay pairwise, so record each pair of nodes in different groups
+    for host1, host2 in combinations(node_list, 2):
+        rep1 = node_group[host1]
+        rep2 = node_group[host2]
+
+        if rep1 == rep2:
+            continue
+
+        # Return early if we have already exceeded the max number of diffs
+        if row_diff_count.value >= MAX_DIFF_ROWS:
+            return MAX_DIFF_EXCEEDED, block_diffs, block_changes
+
+        if columnar:
+            t1_diff, t2_diff, changes = compare_block_columns(
+                group_blocks[rep1], group_blocks[rep2], cols, key_idx
+            )
+        else:
+            t1_diff = group_sets[rep1] - group_sets[rep2]
+            t2_diff = group_sets[rep2] - group_sets[rep1]
+
+            if copy_rows:
+                t1_diff = [decode_copy_row(row, tx) for row in t1_diff]
+                t2_diff = [decode_copy_row(row, tx) for row in t2_diff]
+            else:
+                t1_diff = [group_typed[rep1][row] for row in t1_diff]
+                t2_diff = [group_typed[rep2][row] for row in t2_diff]
+
+        if len(t1_diff) == 0 and len(t2_diff) == 0:
+            continue
+
+        block_diffs[f"{host1}/{host2}"] = {
+            host1: [dict(zip(cols, row)) for row in t1_diff],
+            host2: [dict(zip(cols, row)) for row in t2_diff],
+        }
+
+        if columnar and changes:
+            block_changes[f"{host1}/{host2}"] = changes
+
+        with row_diff_count.get_lock():
+            row_diff_count.value += max(len(t1_diff), len(t2_diff))
+
+    if row_diff_count.value >= MAX_DIFF_ROWS:
+        return MAX_DIFF_EXCEEDED, block_diffs, block_changes
+
+    return BLOCK_MISMATCH, block_diffs, block_changes
+
+
+def new_diff_counters():
+    """
+    Counters shared with the workers comparing a table: the diffs found, so
+    that workers can stop early, and the hash queries issued and rows/bytes
+    not fetched thanks to block bisection.
+    """
+    return {
+        "row_diffs": Value("I", 0),
+        "bisect_queries": Value("Q", 0),
+        "bisect_rows_saved": Value("Q", 0),
+        "bisect_bytes_saved": Value("Q", 0),
+    }
+
+
+def merge_diffs(diff_dict, block_diffs, changes=None, block_changes=None):
+    """
+    Appends the diffs (and changed columns) found in a block or batch to the
+    overall ones
+    """
+    for node_pair, node_diffs in block_diffs.items():
+        pair_diffs = diff_dict.setdefault(
+            node_pair, {node: [] for node in node_diffs}
+        )
+        for node, rows in node_diffs.items():
+            pair_diffs[node] += rows
+
+    for node_pair, pair_changes in (block_changes or {}).items():
+        changes.setdefault(node_pair, []).extend(pair_changes)
+
+
+def collect_diffs(result, diffs, changes=None):
+    """
+    Adds the diffs (and changed columns) found in a block or batch to a
+    table's result, or appends the diffs to its binary diff file if it has
+    one, so that they are not kept in memory
+    """
+    writer = result.get("diff_writer")
+    if writer:
+        append_diffs(writer, diffs)
+        diffs = {}
+
+    merge_diffs(result["diff_dict"], diffs, result["changed_columns"], changes)
+
+
+def get_diff_counts(result):
+    """Returns the number of diffs on each node of every node pair of a result"""
+    writer = result.get("diff_writer")
+    if writer:
+        return writer["counts"]
+
+    return {
+        node_pair: {node: len(rows) for node, rows in pair_diffs.items()}
+        for node_pair, pair_diffs in result["diff_dict"].items()
+    }
+
+
+def compare_checksums(shared_objects, worker_state, blocks):
+    """
+    Hashes a batch of blocks exactly once on every node and compares the
+    rows of the blocks whose hashes differ.
+
+    The hash queries for a node are pipelined over the worker's connection
+    to it, max_inflight at a time, and all nodes are queried concurrently,
+    so a batch costs a few round trips instead of one per block and node.
+
+    Returns the result and node hashes of every block compared and the diffs
+    (and changed columns) found in the batch, which the parent merges as
+    batches complete.
+    """
+    block_results = []
+    batch_hashes = []
+    batch_diffs = {}
+    batch_changes = {}
+
+    if shared_objects["counters"]["row_diffs"].value >= MAX_DIFF_ROWS:
+        return block_results, batch_diffs, batch_changes, batch_hashes
+
+    p_key = shared_objects["p_key"]
+    schema_name = shared_objects["schema_name"]
+    table_name = shared_objects["table_name"]
+    node_list = shared_objects["node_list"]
+    simple_primary_key = shared_objects["simple_primary_key"]
+    hash_mode = shared_objects["hash_mode"]
+    row_filter = shared_objects["row_filter"]
+
+    hash_queries = [
+        get_hash_sql(
+            schema_name,
+            table_name,
+            p_key,
+            get_range_clause(p_key, simple_primary_key, pkey1, pkey2, row_filter),
+            hash_mode,
+            cols=shared_objects["columns"],
+        )
+        for pkey1, pkey2 in blocks
+    ]
+
+    max_inflight = shared_objects["max_inflight"]
+    throttle = shared_objects.get("throttle")
+    if throttle:
+        # The governor limits the queries in flight on each node
+        max_inflight = {node: throttle["inflight"][node].value for node in node_list}
+
+    try:
+        block_hashes = run_pipelines(
+            worker_state,
+            {node: hash_queries for node in node_list},
+            max_inflight,
+        )
+    except Exception as e:
+        print(f"query = {hash_queries[0].as_string(worker_state[node_list[0]])}", e)
+        block_results.append(BLOCK_ERROR)
+        return block_results, batch_diffs, batch_changes, batch_hashes
+
+    for block_id, (pkey1, pkey2) in enumerate(blocks):
+        node_hashes = {node: block_hashes[node][block_id][0][0] for node in node_list}
+        groups = group_nodes_by_hash(node_list, node_hashes)
+        batch_hashes.append(node_hashes)
+
+        if len(groups) == 1:
+            block_results.append(BLOCK_OK)
+            continue
+
+        result, block_diffs, block_changes = compare_block_rows(
+            shared_objects, worker_state, pkey1, pkey2, groups
+        )
+        block_results.append(result)
+        merge_diffs(batch_diffs, block_diffs, batch_changes, block_changes)
+
+        if result in [BLOCK_ERROR, MAX_DIFF_EXCEEDED]:
+            break
+
+    return block_results, batch_diffs, batch_changes, batch_hashes
+
+
+def get_mtree_log_name(schema_name, table_name):
+    """
+    Name of the change log kept for a table on every node, in MTREE_LOG_SCHEMA.
+    It is derived from the table name so that it is the same on every node.
+    """
+    table_id = hashlib.md5(f"{schema_name}.{table_name}".encode()).hexdigest()
+    return f"log_{table_id}"
+
+
+def mtree_track_changes(conn, schema_name, table_name, p_key, reset):
+    """
+    Makes sure the changes to a table are being logged on a node, so that
+    dirty Merkle tree leaves can be found without reading the table.
+
+    A row trigger logs the key of every row inserted, updated or deleted,
+    including the rows applied by replication, into a change log holding
+    only the key columns. The log also holds a marker row, which a TRUNCATE
+    of the table deletes. The node's leaves can only be trusted to be clean
+    while the triggers are enabled and the marker is there.
+
+    Returns True if the log was already being kept. Otherwise, or with
+    reset, the log is (re)created empty and every leaf of the node must be
+    re-hashed.
+    """
+    log_table = sql.SQL("{}.{}").format(
+        sql.Identifier(MTREE_LOG_SCHEMA),
+        sql.Identifier(get_mtree_log_name(schema_name, table_name)),
+    )
+    table = sql.SQL("{}.{}").format(
+        sql.Identifier(schema_name), sql.Identifier(table_name)
+    )
+    key_cols = sql.SQL(", ").join(
+        [sql.Identifier(col.strip()) for col in p_key.split(",")]
+    )
+
+    cur = conn.cursor()
+
+    tracked = False
+    if not reset:
+        cur.execute(
+            """
+            SELECT count(*) = 2 AND to_regclass(%s) IS NOT NULL
+            FROM pg_trigger
+            WHERE tgrelid = %s::regclass AND tgenabled = 'A'
+                AND tgname IN ('ace_mtree_log', 'ace_mtree_truncate')
+            """,
+            (log_table.as_string(conn), table.as_string(conn)),
+        )
+        if cur.fetchone()[0]:
+            cur.execute(
+                sql.SQL("SELECT EXISTS (SELECT 1 FROM {} WHERE ace_seq = 0)").format(
+                    log_table
+                )
+            )
+            tracked = cur.fetchone()[0]
+
+    if not tracked:
+        for query in [
+            sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(
+                sql.Identifier(MTREE_LOG_SCHEMA)
+            ),
+            sql.SQL(
+                """
+                CREATE OR REPLACE FUNCTION {schema}.log_change()
+                RETURNS trigger LANGUAGE plpgsql AS $$
+                BEGIN
+                    IF TG_OP <> 'INSERT' THEN
+                        EXECUTE format(
+                            'INSERT INTO {schema}.%I (%s) SELECT %2$s'
+                            ' FROM (SELECT ($1).*) r', TG_ARGV[0], TG_ARGV[1]
+                        ) USING OLD;
+                    END IF;
+                    IF TG_OP <> 'DELETE' THEN
+                        EXECUTE format(
+                            'INSERT INTO {schema}.%I (%s) SELECT %2$s'
+                            ' FROM (SELECT ($1).*) r', TG_ARGV[0], TG_ARGV[1]
+                        ) USING NEW;
+                    END IF;
+                    RETURN NULL;
+                END
+                $$
+                """
+            ).format(schema=sql.Identifier(MTREE_LOG_SCHEMA)),
+            sql.SQL(
+                """
+                CREATE OR REPLACE FUNCTION {schema}.log_truncate()
+                RETURNS trigger LANGUAGE plpgsql AS $$
+                BEGIN
+                    EXECUTE format(
+                        'DELETE FROM {schema}.%I WHERE ace_seq = 0', TG_ARGV[0]
+                    );
+                    RETURN NULL;
+                END
+                $$
+                """
+            ).format(schema=sql.Identifier(MTREE_LOG_SCHEMA)),
+            sql.SQL("DROP TABLE IF EXISTS {}").format(log_table),
+            sql.SQL(
+                "CREATE TABLE {log_table} AS SELECT {key_cols} FROM {table}"
+                " WITH NO DATA"
+            ).format(log_table=log_table, key_cols=key_cols, table=table),
+            sql.SQL("ALTER TABLE {} ADD COLUMN ace_seq bigserial").format(
+                log_table
+            ),
+            sql.SQL("CREATE INDEX ON {} ({})").format(log_table, key_cols),
+            sql.SQL(
+                "CREATE OR REPLACE TRIGGER ace_mtree_log"
+                " AFTER INSERT OR UPDATE OR DELETE ON {table}"
+                " FOR EACH ROW EXECUTE FUNCTION {schema}.log_change({log}, {keys})"
+            ).format(
+                table=table,
+                schema=sql.Identifier(MTREE_LOG_SCHEMA),
+                log=sql.Literal(get_mtree_log_name(schema_name, table_name)),
+                keys=sql.Literal(key_cols.as_string(conn)),
+            ),
+            sql.SQL(
+                "CREATE OR REPLACE TRIGGER ace_mtree_truncate AFTER TRUNCATE ON {table}"
+                " FOR EACH STATEMENT EXECUTE FUNCTION {schema}.log_truncate({log})"
+            ).format(
+                table=table,
+                schema=sql.Identifier(MTREE_LOG_SCHEMA),
+                log=sql.Literal(get_mtree_log_name(schema_name, table_name)),
+            ),
+            # Replication applies changes as a replica, which ordinary
+            # triggers do not fire for
+            sql.SQL("ALTER TABLE {} ENABLE ALWAYS TRIGGER ace_mtree_log").format(
+                table
+            ),
+            sql.SQL("ALTER TABLE {} ENABLE ALWAYS TRIGGER ace_mtree_truncate").format(
+                table
+            ),
+            sql.SQL("INSERT INTO {} (ace_seq) VALUES (0)").format(log_table),
+        ]:
+            cur.execute(query)
+
+    conn.commit()
+    cur.close()
+
+    return tracked
+
+
+def get_mtree_check_sql(schema_name, table_name, where_clause):
+    """
+    Probe used to decide whether a Merkle tree leaf is dirty. It returns the
+    change log entries for the keys of the block, read through the log's
+    index, so the table itself is never read for a clean leaf.
+    """
+    return sql.SQL(
+        "SELECT array_agg(ace_seq) FROM {log_table}"
+        " WHERE ace_seq > 0 AND {where_clause}"
+    ).format(
+        log_table=sql.SQL("{}.{}").format(
+            sql.Identifier(MTREE_LOG_SCHEMA),
+            sql.Identifier(get_mtree_log_name(schema_name, table_name)),
+        ),
+        where_clause=where_clause,
+    )
+
+
+def mtree_consume_changes(conn, schema_name, table_name, seqs):
+    """
+    Deletes the change log entries that the leaves just stored were checked
+    against. Entries logged since, even for those leaves, are kept for the
+    next run.
+    """
+    cur = conn.cursor()
+    cur.execute(
+        sql.SQL("DELETE FROM {} WHERE ace_seq = ANY(%s)").format(
+            sql.SQL("{}.{}").format(
+                sql.Identifier(MTREE_LOG_SCHEMA),
+                sql.Identifier(get_mtree_log_name(schema_name, table_name)),
+            )
+        ),
+        (seqs,),
+    )
+    conn.commit()
+    cur.close()
+
+
+def mtree_split_tail(conns, schema_name, table_name, p_key, simple_primary_key, mtree):
+    """
+    Splits the last, open-ended, block of a Merkle tree once it holds more
+    than block_rows rows on any node, as keys appended to the table all land
+    in it. Only the tail is read, and only up to block_rows rows while it
+    has not grown too large. It is split on the node where it is largest.
+    The leaves stored for the old last block are dropped, so that it and
+    the new blocks are hashed on every node.
+    """
+    block_rows = mtree["block_rows"]
+    start, end = mtree["offsets"][-1]
+    if end is not None:
+        return
+
+    table = sql.SQL("{}.{}").format(
+        sql.Identifier(schema_name), sql.Identifier(table_name)
+    )
+    where_clause = get_range_clause(p_key, simple_primary_key, start, None)
+
+    tail_rows, tail_conn = 0, None
+    for conn in conns:
+        cur = conn.cursor()
+        cur.execute(
+            sql.SQL(
+                "SELECT count(*) FROM (SELECT 1 FROM {table} WHERE {where_clause}"
+                " LIMIT {limit}) s"
+            ).format(
+                table=table,
+                where_clause=where_clause,
+                limit=sql.Literal(block_rows + 1),
+            )
+        )
+        if cur.fetchone()[0] > block_rows:
+            cur.execute(
+                sql.SQL("SELECT count(*) FROM {} WHERE {}").format(table, where_clause)
+            )
+            rows = cur.fetchone()[0]
+            if rows > tail_rows:
+                tail_rows, tail_conn = rows, conn
+        cur.close()
+
+    if not tail_conn:
+        return
+
+    cur = tail_conn.cursor()
+    cur.execute(
+        get_split_sql(
+            schema_name, table_name, p_key, where_clause, -(-tail_rows // block_rows)
+        )
+    )
+    keys = [row[0] if simple_primary_key else tuple(row) for row in cur.fetchall()]
+    cur.close()
+
+    last = len(mtree["offsets"]) - 1
+    bounds = [start] + keys + [None]
+    mtree["offsets"][last:] = list(zip(bounds[:-1], bounds[1:]))
+    for leaves in mtree["leaves"].values():
+        del leaves[last:]
+
+    util.message(
+        f"Split the last Merkle tree block of {schema_name}.{table_name}"
+        f" into {len(keys) + 1} blocks",
+        p_state="info",
+    )
+
+
+def get_mtree_store():
+    """
+    Opens the local Merkle tree store, creating it if needed.
+
+    Leaves are keyed by cluster, node, table and block (PK range). Internal
+    nodes are kept per level so that only the ancestors of dirty leaves
+    need to be recomputed on later runs.
+    """
+    if not os.path.exists(MTREE_DIR):
+        os.makedirs(MTREE_DIR)
+
+    store = sqlite3.connect(os.path.join(MTREE_DIR, MTREE_DB))
+    store.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS mtree_meta (
+            cluster     TEXT NOT NULL,
+            tbl         TEXT NOT NULL,
+            p_key       TEXT NOT NULL,
+            cols        TEXT NOT NULL,
+            block_rows  INTEGER NOT NULL,
+            hash_mode   TEXT NOT NULL,
+            built_at    TEXT NOT NULL,
+            PRIMARY KEY (cluster, tbl)
+        );
+        CREATE TABLE IF NOT EXISTS mtree_leaves (
+            cluster     TEXT NOT NULL,
+            node        TEXT NOT NULL,
+            tbl         TEXT NOT NULL,
+            block_id    INTEGER NOT NULL,
+            range_start TEXT,
+            range_end   TEXT,
+            -- row_count and commit_ts are no longer filled in: leaves are
+            -- found dirty from the change logs kept on the nodes
+            row_count   INTEGER,
+            commit_ts   TEXT,
+            leaf_hash   TEXT,
+            PRIMARY KEY (cluster, node, tbl, block_id)
+        );
+        CREATE TABLE IF NOT EXISTS mtree_nodes (
+            cluster     TEXT NOT NULL,
+            node        TEXT NOT NULL,
+            tbl         TEXT NOT NULL,
+            level       INTEGER NOT NULL,
+            idx         INTEGER NOT NULL,
+            node_hash   TEXT,
+            PRIMARY KEY (cluster, node, tbl, level, idx)
+        );
+        """
+    )
+    migrate_mtree_store(store)
+    return store
+
+
+def migrate_mtree_store(store):
+    """
+    Brings a store created by an older ace up to MTREE_SCHEMA_VERSION.
+
+    Version 1 stores have no hash_mode in mtree_meta. Their trees were
+    always built with md5 block hashes, so the column is added with that
+    default rather than discarding the trees.
+    """
+    version = store.execute("PRAGMA user_version").fetchone()[0]
+    if version >= MTREE_SCHEMA_VERSION:
+        return
+
+    meta_cols = [row[1] for row in store.execute("PRAGMA table_info(mtree_meta)")]
+    with store:
+        if "hash_mode" not in meta_cols:
+            store.execute(
+                "ALTER TABLE mtree_meta "
+                "ADD COLUMN hash_mode TEXT NOT NULL DEFAULT 'md5'"
+            )
+        store.execute(f"PRAGMA user_version = {MTREE_SCHEMA_VERSION}")
+
+
+def mtree_encode_offset(offset):
+    return None if offset is None else json.dumps(offset)
+
+
+def mtree_decode_offset(offset):
+    if offset is None:
+        return None
+    offset = json.loads(offset)
+    return tuple(offset) if isinstance(offset, list) else offset
+
+
+def mtree_load(store, cluster_name, table_name, p_key, cols, hash_mode):
+    """
+    Returns the stored block plan and per-node leaves for a table, or None if
+    there is no tree or the table's key or columns have changed since it
+    was built. Trees hashed with a different hash mode cannot be compared
+    against and are rejected.
+    """
+    row = store.execute(
+        "SELECT p_key, cols, block_rows, hash_mode FROM mtree_meta"
+        " WHERE cluster = ? AND tbl = ?",
+        (cluster_name, table_name),
+    ).fetchone()
+
+    if not row or row[0] != p_key or row[1] != cols:
+        return None
+
+    if row[3] != hash_mode:
+        util.exit_message(
+            f"Merkle tree for {table_name} was built with hash mode '{row[3]}'. "
+            f"Please use --hash_mode={row[3]} or rebuild it with --rebuild_mtree"
+        )
+
+    mtree = {"block_rows": row[2], "offsets": [], "leaves": {}}
+    plan_node = None
+
+    for node, start, end, leaf_hash in store.execute(
+        """
+        SELECT node, range_start, range_end, leaf_hash
+        FROM mtree_leaves WHERE cluster = ? AND tbl = ? ORDER BY node, block_id
+        """,
+        (cluster_name, table_name),
+    ):
+        if node not in mtree["leaves"]:
+            mtree["leaves"][node] = []
+        mtree["leaves"][node].append(leaf_hash)
+
+        # Every node shares the same block plan
+        plan_node = plan_node or node
+        if node == plan_node:
+            mtree["offsets"].append(
+                (mtree_decode_offset(start), mtree_decode_offset(end))
+            )
+
+    if not mtree["offsets"]:
+        return None
+
+    return mtree
+
+
+def mtree_save_plan(
+    store, cluster_name, table_name, p_key, cols, block_rows, hash_mode, offsets
+):
+    """Discards any existing tree for the table and records a new block plan"""
+    with store:
+        for tbl in ["mtree_meta", "mtree_leaves", "mtree_nodes"]:
+            store.execute(
+                f"DELETE FROM {tbl} WHERE cluster = ? AND tbl = ?",
+                (cluster_name, table_name),
+            )
+        store.execute(
+            "INSERT INTO mtree_meta VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                cluster_name,
+                table_name,
+                p_key,
+                cols,
+                block_rows,
+                hash_mode,
+                datetime.now().astimezone(None).isoformat(),
+            ),
+        )
+
+    return {"block_rows": block_rows, "offsets": list(offsets), "leaves": {}}
+
+
+def mtree_hash_children(left, right):
+    return hashlib.md5(((left or "") + (right or "")).encode()).hexdigest()
+
+
+def mtree_save_node(store, cluster_name, table_name, node, mtree, leaves, dirty):
+    """
+    Stores refreshed leaves for a node and recomputes the internal nodes
+    along the paths from the dirty leaves up to the root.
+    """
+    levels = [list(leaves)]
+
+    stored = {}
+    for level, idx, node_hash in store.execute(
+        "SELECT level, idx, node_hash FROM mtree_nodes"
+        " WHERE cluster = ? AND node = ? AND tbl = ?",
+        (cluster_name, node, table_name),
+    ):
+        stored[(level, idx)] = node_hash
+
+    # A node without stored internal nodes gets its whole tree built
+    if not stored:
+        dirty = set(range(len(leaves)))
+
+    changed = []
+    while len(levels[-1]) > 1:
+        children = levels[-1]
+        level = len(levels)
+        parents = [stored.get((level, i)) for i in range((len(children) + 1) // 2)]
+        dirty = {i // 2 for i in dirty}
+
+        for i in dirty:
+            right = children[2 * i + 1] if 2 * i + 1 < len(children) else None
+            parents[i] = mtree_hash_children(children[2 * i], right)
+            changed.append((level, i, parents[i]))
+
+        levels.append(parents)
+
+    with store:
+        store.executemany(
+            "INSERT OR REPLACE INTO mtree_leaves VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    cluster_name,
+                    node,
+                    table_name,
+                    block_id,
+                    mtree_encode_offset(mtree["offsets"][block_id][0]),
+                    mtree_encode_offset(mtree["offsets"][block_id][1]),
+                    None,
+                    None,
+                    leaf_hash,
+                )
+                for block_id, leaf_hash in enumerate(leaves)
+            ],
+        )
+        store.executemany(
+            "INSERT OR REPLACE INTO mtree_nodes VALUES (?, ?, ?, ?, ?, ?)",
+            [(cluster_name, node, table_name, *entry) for entry in changed],
+        )
+
+    return levels
+
+
+def mtree_diff_leaves(levels1, levels2):
+    """
+    Walks two trees down from the root and returns the ids of the leaves
+    whose hashes differ. Subtrees with matching hashes are never visited.
+    """
+    diff_leaves = []
+    stack = [(len(levels1) - 1, 0)]
+
+    while stack:
+        level, idx = stack.pop()
+        if levels1[level][idx] == levels2[level][idx]:
+            continue
+
+        if level == 0:
+            diff_leaves.append(idx)
+            continue
+
+        for child in [2 * idx, 2 * idx + 1]:
+            if child < len(levels1[level - 1]):
+                stack.append((level - 1, child))
+
+    return sorted(diff_leaves)
+
+
+def mtree_refresh_block(shared_objects, worker_state, block_id, pkey1, pkey2, prior):
+    """
+    Re-hashes one Merkle tree leaf on every node where it is dirty. prior
+    holds the leaf hash recorded for each node on the previous run. Returns
+    the leaves, and the change log entries they were checked against.
+    """
+    p_key = shared_objects["p_key"]
+    schema_name = shared_objects["schema_name"]
+    table_name = shared_objects["table_name"]
+    simple_primary_key = shared_objects["simple_primary_key"]
+    tracked_nodes = shared_objects["tracked_nodes"]
+    hash_mode = shared_objects["hash_mode"]
+
+    where_clause = get_range_clause(p_key, simple_primary_key, pkey1, pkey2)
+    hash_sql = get_hash_sql(
+        schema_name,
+        table_name,
+        p_key,
+        where_clause,
+        hash_mode,
+        cols=shared_objects["columns"],
+    )
+    check_sql = get_mtree_check_sql(schema_name, table_name, where_clause)
+
+    leaves = {}
+    changes = {}
+
+    for node in shared_objects["node_list"]:
+        try:
+            if node in tracked_nodes:
+                changes[node] = run_query(worker_state, node, check_sql)[0][0] or []
+                if node in prior and not changes[node]:
+                    leaves[node] = (prior[node], False)
+                    continue
+
+            leaf_hash = run_query(worker_state, node, hash_sql)[0][0]
+            leaves[node] = (leaf_hash, True)
+        except Exception as e:
+            print(f"query = {hash_sql.as_string(worker_state[node])}", e)
+            return block_id, BLOCK_ERROR, None
+
+    return block_id, leaves, changes
+
+
+def mtree_refresh(shared_objects, store, mtree, conns, procs):
+    """
+    Brings the stored Merkle trees of every node in shared_objects up to date
+    and returns the tree levels for each node.
+
+    Leaves are only re-hashed when the change log kept on the node has
+    entries for their keys, which are found through the log's index without
+    reading the table; see mtree_track_changes. Every leaf is re-hashed on a
+    node the log has just been set up on, and the trees are built that way
+    on the first run.
+    """
+    cluster_name = shared_objects["cluster_name"]
+    schema_name = shared_objects["schema_name"]
+    table_name = f"{schema_name}.{shared_objects['table_name']}"
+    node_list = shared_objects["node_list"]
+
+    tracked_nodes = [
+        node
+        for node in node_list
+        if mtree_track_changes(
+            conns[node],
+            schema_name,
+            shared_objects["table_name"],
+            shared_objects["p_key"],
+            reset=node not in mtree["leaves"],
+        )
+    ]
+
+    if mtree["leaves"] and len(tracked_nodes) < len(node_list):
+        util.message(
+            f"Changes to {table_name} were not being tracked on "
+            f"{', '.join(n for n in node_list if n not in tracked_nodes)}: "
+            "every block will be re-hashed on those nodes",
+            p_state="warning",
+        )
+
+    tasks = []
+    for block_id, (pkey1, pkey2) in enumerate(mtree["offsets"]):
+        prior = {
+            node: leaves[block_id]
+            for node, leaves in mtree["leaves"].items()
+            if node in node_list and block_id < len(leaves)
+        }
+        tasks.append((block_id, pkey1, pkey2, prior))
+
+    refresh_objects = {**shared_objects, "tracked_nodes": tracked_nodes}
+
+    util.message("Refreshing Merkle trees...\n", p_state="info")
+
+    with WorkerPool(
+        n_jobs=min(procs, len(tasks)),
+        shared_objects=refresh_objects,
+        use_worker_state=True,
+    ) as pool:
+        results = pool.map_unordered(
+            mtree_refresh_block,
+            tasks,
+            worker_init=init_db_connection,
+            worker_exit=close_db_connection,
+            progress_bar=True,
+            iterable_len=len(tasks),
+        )
+
+    if any(leaves == BLOCK_ERROR for _, leaves, _ in results):
+        util.exit_message(
+            "There were one or more errors while refreshing the Merkle trees.\n \
+                Please examine the connection information provided, or the nodes' \
+                    status before running this script again."
+        )
+
+    node_leaves = {node: [None] * len(tasks) for node in node_list}
+    node_dirty = {node: set() for node in node_list}
+    node_changes = {node: [] for node in node_list}
+
+    for block_id, leaves, changes in results:
+        for node, (leaf_hash, dirty) in leaves.items():
+            node_leaves[node][block_id] = leaf_hash
+            if dirty:
+                node_dirty[node].add(block_id)
+        for node, seqs in changes.items():
+            node_changes[node].extend(seqs)
+
+    levels = {}
+    for node in node_list:
+        levels[node] = mtree_save_node(
+            store,
+            cluster_name,
+            table_name,
+            node,
+            mtree,
+            node_leaves[node],
+            node_dirty[node],
+        )
+        mtree["leaves"][node] = node_leaves[node]
+
+        # Only once the leaves are stored can the changes they cover be
+        # dropped from the log
+        if node_changes[node]:
+            mtree_consume_changes(
+                conns[node],
+                schema_name,
+                shared_objects["table_name"],
+                node_changes[node],
+            )
+
+    dirty_count = len(set().union(*node_dirty.values()))
+    util.message(
+        f"Re-hashed {dirty_count} of {len(tasks)} blocks\n",
+        p_state="info",
+    )
+
+    return levels
+
+
+def get_watermark_store():
+    """Opens the local store of incremental diff watermarks, creating it if needed"""
+    if not os.path.exists(WATERMARK_DIR):
+        os.makedirs(WATERMARK_DIR)
+
+    store = sqlite3.connect(os.path.join(WATERMARK_DIR, WATERMARK_DB))
+    store.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS watermarks (
+            cluster     TEXT NOT NULL,
+            tbl         TEXT NOT NULL,
+            cols        TEXT NOT NULL,
+            row_filter  TEXT NOT NULL,
+            watermark   TEXT NOT NULL,
+            last_full   TEXT NOT NULL,
+            PRIMARY KEY (cluster, tbl)
+        );
+        """
+    )
+    return store
+
+
+def watermark_load(store, cluster_name, table_name, cols, row_filter):
+    """
+    Returns the watermark and the time of the last full diff of a table, or
+    None if there is none or it was kept for other columns or another filter.
+    """
+    row = store.execute(
+        "SELECT cols, row_filter, watermark, last_full FROM watermarks"
+        " WHERE cluster = ? AND tbl = ?",
+        (cluster_name, table_name),
+    ).fetchone()
+
+    if not row or row[0] != cols or row[1] != (row_filter or ""):
+        return None
+
+    return {"watermark": row[2], "last_full": row[3]}
+
+
+def watermark_save(
+    store, cluster_name, table_name, cols, row_filter, watermark, last_full
+):
+    with store:
+        store.execute(
+            "INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?, ?, ?)",
+            (cluster_name, table_name, cols, row_filter or "", watermark, last_full),
+        )
+
+
+def get_run_watermark(node_conns):
+    """
+    Returns the watermark a matching run advances to: the earliest clock of
+    the nodes as the run starts, so that rows committed while it runs are
+    compared again by the next one.
+    """
+    watermark = None
+
+    for conn in node_conns.values():
+        cur = conn.cursor()
+        cur.execute("SELECT clock_timestamp()")
+        node_time = cur.fetchone()[0]
+        cur.close()
+
+        watermark = node_time if watermark is None else min(watermark, node_time)
+
+    return watermark.isoformat()
+
+
+def get_commit_ts_filter(node_conns, watermark):
+    """
+    Returns the row filter that selects the rows committed after the
+    watermark. Spock records the origin's commit timestamp of replicated
+    rows, which is the same on every node, so it is used where available.
+    Otherwise the local commit timestamps are used, and a row applied
+    after the watermark on one node only is compared needlessly.
+    """
+    use_origin = True
+
+    for node, conn in node_conns.items():
+        cur = conn.cursor()
+        cur.execute("SHOW track_commit_timestamp")
+        if cur.fetchone()[0] != "on":
+            cur.close()
+            util.exit_message(
+                f"track_commit_timestamp is off on {node}: "
+                "--incremental needs it on every node"
+            )
+
+        cur.execute("SELECT to_regproc('spock.xact_commit_timestamp_origin')")
+        if cur.fetchone()[0] is None:
+            use_origin = False
+        cur.close()
+
+    commit_ts = (
+        "(spock.xact_commit_timestamp_origin(xmin)).timestamp"
+        if use_origin
+        else "pg_xact_commit_timestamp(xmin)"
+    )
+    conn = next(iter(node_conns.values()))
+
+    return sql.SQL("{} > {}::timestamptz").format(
+        sql.SQL(commit_ts), sql.Literal(watermark)
+    ).as_string(conn)
+
+
+def get_key_bounds_sql(schema_name, table_name, p_key, row_filter=None):
+    """
+    Returns the number of keys in a table and its largest key, as text. Only
+    the key columns are read, so the primary key index can answer both, and
+    the largest key is a single index lookup.
+    """
+    key_cols = [sql.Identifier(col.strip()) for col in p_key.split(",")]
+    table = sql.SQL("{}.{}").format(
+        sql.Identifier(schema_name), sql.Identifier(table_name)
+    )
+    where_clause = (
+        sql.SQL("({})").format(sql.SQL(row_filter)) if row_filter else sql.SQL("TRUE")
+    )
+
+    return sql.SQL(
+        "SELECT count(*), (SELECT ROW({key})::text FROM {table}"
+        " WHERE {where_clause} ORDER BY {key_desc} LIMIT 1)"
+        " FROM {table} WHERE {where_clause}"
+    ).format(
+        key=sql.SQL(", ").join(key_cols),
+        key_desc=sql.SQL(", ").join([sql.SQL("{} DESC").format(c) for c in key_cols]),
+        table=table,
+        where_clause=where_clause,
+    )
+
+
+def keys_match(node_conns, schema_name, table_name, p_key, row_filter=None):
+    """
+    Checks that every node holds as many keys, up to the same largest key.
+    An incremental diff cannot see a row that was deleted on one node only,
+    since the row has no commit after the watermark on either node, but the
+    delete leaves that node one key short.
+    """
+    bounds_sql = get_key_bounds_sql(schema_name, table_name, p_key, row_filter)
+
+    def run_check(conn):
+        try:
+            cur = conn.cursor()
+            cur.execute(bounds_sql)
+            row = cur.fetchone()
+            cur.close()
+            conn.commit()
+        except Exception as e:
+            util.exit_message("Error in keys_match():\n" + str(e), 1)
+
+        return tuple(row)
+
+    with ThreadPoolExecutor(max_workers=len(node_conns)) as executor:
+        bounds = set(executor.map(run_check, node_conns.values()))
+
+    return len(bounds) == 1
+
+
+def get_touched_keys(node_conns, schema_name, table_name, p_key, row_filter):
+    """
+    Returns the keys of the rows committed after the watermark on any node,
+    which row_filter selects. Each node is read once for them.
+    """
+    touched_sql = sql.SQL("SELECT {key} FROM {table} WHERE {row_filter}").format(
+        key=sql.SQL(", ").join([sql.Identifier(col) for col in p_key.split(",")]),
+        table=sql.SQL("{}.{}").format(
+            sql.Identifier(schema_name), sql.Identifier(table_name)
+        ),
+        row_filter=sql.SQL(row_filter),
+    )
+
+    def run_touched(conn):
+        try:
+            cur = conn.cursor()
+            cur.execute(touched_sql)
+            rows = cur.fetchall()
+            cur.close()
+            conn.commit()
+        except Exception as e:
+            util.exit_message("Error in get_touched_keys():\n" + str(e), 1)
+
+        return rows
+
+    with ThreadPoolExecutor(max_workers=len(node_conns)) as executor:
+        return list(set().union(*executor.map(run_touched, node_conns.values())))
+
+
+def plan_touched_ranges(conn, schema_name, table_name, p_key, touched, block_rows):
+    """
+    Computes the key ranges of the blocks an incremental diff compares from
+    the touched keys. Each key is looked up on the node together with the
+    key that follows it, in a single query. A range runs from a touched key
+    to the key after it, and takes in the following touched keys for as
+    long as they are adjacent, up to block_rows of them. The untouched rows
+    between the ranges are never read.
+    """
+    if not touched:
+        return []
+
+    key_cols = [col.strip() for col in p_key.split(",")]
+    key_types = get_col_type_names(conn, schema_name, table_name)
+
+    # The key that follows a touched key is the next one in the table or, if
+    # the node does not hold it, the next touched key
+    next_cols = [sql.Identifier(f"_ace_next_{i}") for i in range(len(key_cols))]
+    keys = sql.SQL(", ").join([sql.Identifier(col) for col in key_cols])
+    k_keys = sql.SQL(", ").join([sql.Identifier("k", col) for col in key_cols])
+    t_keys = sql.SQL(", ").join([sql.Identifier("t", col) for col in key_cols])
+
+    cur = conn.cursor()
+    cur.execute(
+        sql.SQL(
+            "WITH k AS (SELECT {keys}, {leads} FROM (SELECT DISTINCT {keys}"
+            " FROM unnest({key_arrays}) AS u({keys})) d WINDOW w AS (ORDER BY {keys}))"
+            " SELECT {k_keys}, {s_keys} FROM k LEFT JOIN LATERAL ("
+            "SELECT * FROM ((SELECT {t_keys} FROM {table} t"
+            " WHERE ({t_keys}) > ({k_keys}) ORDER BY {t_keys} LIMIT 1)"
+            " UNION ALL SELECT {k_next} WHERE {k_next_0} IS NOT NULL) c ({keys})"
+            " ORDER BY {keys} LIMIT 1) s ON TRUE"
+            " ORDER BY {k_keys}"
+        ).format(
+            keys=keys,
+            leads=sql.SQL(", ").join(
+                [
+                    sql.SQL("lead({}) OVER w AS {}").format(sql.Identifier(col), nxt)
+                    for col, nxt in zip(key_cols, next_cols)
+                ]
+            ),
+            k_keys=k_keys,
+            s_keys=sql.SQL(", ").join([sql.Identifier("s", col) for col in key_cols]),
+            t_keys=t_keys,
+            k_next=sql.SQL(", ").join(
+                [sql.SQL("k.{}").format(nxt) for nxt in next_cols]
+            ),
+            k_next_0=sql.SQL("k.{}").format(next_cols[0]),
+            key_arrays=sql.SQL(", ").join(
+                [sql.SQL("%s::{}[]").format(sql.SQL(key_types[c])) for c in key_cols]
+            ),
+            table=sql.SQL("{}.{}").format(
+                sql.Identifier(schema_name), sql.Identifier(table_name)
+            ),
+        ),
+        [list(col) for col in zip(*touched)],
+    )
+    rows = cur.fetchall()
+    cur.close()
+    conn.commit()
+
+    def as_key(values):
+        if len(key_cols) == 1:
+            return values[0]
+        return None if values[0] is None else tuple(values)
+
+    pkey_offsets = []
+    start, end, run = None, None, 0
+
+    for row in rows:
+        key, next_key = as_key(row[: len(key_cols)]), as_key(row[len(key_cols) :])
+
+        if run and key == end and run < block_rows:
+            run += 1
+        else:
+            if run:
+                pkey_offsets.append((start, end))
+            start, run = key, 1
+        end = next_key
+
+    pkey_offsets.append((start, end))
+    return pkey_offsets
+
+
+def get_job_journal():
+    """Opens the local journal of table-diff jobs, creating it if needed"""
+    if not os.path.exists(JOURNAL_DIR):
+        os.makedirs(JOURNAL_DIR)
+
+    store = sqlite3.connect(os.path.join(JOURNAL_DIR, JOURNAL_DB))
+    store.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id      TEXT PRIMARY KEY,
+            cluster     TEXT NOT NULL,
+            tbl         TEXT NOT NULL,
+            params      TEXT NOT NULL,
+            block_rows  INTEGER NOT NULL,
+            sample      TEXT,
+            created     TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS job_blocks (
+            job_id      TEXT NOT NULL,
+            block_id    INTEGER NOT NULL,
+            range_start TEXT,
+            range_end   TEXT,
+            status      INTEGER,
+            hashes      TEXT,
+            PRIMARY KEY (job_id, block_id)
+        );
+        CREATE TABLE IF NOT EXISTS job_diffs (
+            job_id      TEXT NOT NULL,
+            diffs       TEXT NOT NULL,
+            changes     TEXT NOT NULL
+        );
+        """
+    )
+    return store
+
+
+def journal_start(
+    store, cluster_name, table_name, params, block_rows, sample_meta, pkey_offsets
+):
+    """Journals a new job and its block plan, and returns the job's id"""
+    # The prefix keeps the CLI from parsing the id as a number
+    job_id = f"job_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.urandom(2).hex()}"
+
+    with store:
+        store.execute(
+            "INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                job_id,
+                cluster_name,
+                table_name,
+                json.dumps(params),
+                block_rows,
+                json.dumps(sample_meta) if sample_meta else None,
+                datetime.now().astimezone(None).isoformat(),
+            ),
+        )
+        store.executemany(
+            "INSERT INTO job_blocks VALUES (?, ?, ?, ?, NULL, NULL)",
+            [
+                (
+                    job_id,
+                    block_id,
+                    mtree_encode_offset(start),
+                    mtree_encode_offset(end),
+                )
+                for block_id, (start, end) in enumerate(pkey_offsets)
+            ],
+        )
+
+    return job_id
+
+
+def journal_load(store, job_id):
+    """
+    Returns a journaled job with its block plan, the status of every block
+    (None if it never completed), and the diffs found so far, or None if
+    there is no such job.
+    """
+    row = store.execute(
+        "SELECT cluster, tbl, params, block_rows, sample FROM jobs WHERE job_id = ?",
+        (job_id,),
+    ).fetchone()
+
+    if not row:
+        return None
+
+    blocks = [
+        (mtree_decode_offset(start), mtree_decode_offset(end), status)
+        for start, end, status in store.execute(
+            "SELECT range_start, range_end, status FROM job_blocks"
+            " WHERE job_id = ? ORDER BY block_id",
+            (job_id,),
+        )
+    ]
+    diffs = [
+        (json.loads(diffs), json.loads(changes))
+        for diffs, changes in store.execute(
+            "SELECT diffs, changes FROM job_diffs WHERE job_id = ?", (job_id,)
+        )
+    ]
+
+    return {
+        "cluster": row[0],
+        "table": row[1],
+        "params": json.loads(row[2]),
+        "block_rows": row[3],
+        "sample": json.loads(row[4]) if row[4] else None,
+        "blocks": blocks,
+        "diffs": diffs,
+    }
+
+
+def journal_blocks(
+    journal, table_id, blocks, block_results, block_hashes, diffs, changes
+):
+    """
+    Records the outcome and node hashes of the blocks of a batch that
+    completed, and the diffs found in them. A block made of several planned
+    key ranges completes all of them.
+    """
+    store = journal["store"]
+    starts, ends = journal["ranges"][table_id]
+
+    with store:
+        for (start, end), result, hashes in zip(blocks, block_results, block_hashes):
+            store.execute(
+                "UPDATE job_blocks SET status = ?, hashes = ?"
+                " WHERE job_id = ? AND block_id BETWEEN ? AND ?",
+                (
+                    result,
+                    json.dumps(hashes, default=str),
+                    journal["job_id"],
+                    starts[mtree_encode_offset(start)],
+                    ends[mtree_encode_offset(end)],
+                ),
+            )
+
+        if diffs:
+            store.execute(
+                "INSERT INTO job_diffs VALUES (?, ?, ?)",
+                (
+                    journal["job_id"],
+                    json.dumps(diffs, default=str),
+                    json.dumps(changes, default=str),
+                ),
+            )
+
+
+def journal_delete(store, job_id):
+    with store:
+        for tbl in ["jobs", "job_blocks", "job_diffs"]:
+            store.execute(f"DELETE FROM {tbl} WHERE job_id = ?", (job_id,))
+
+
+def wait_for_lsn_fence(node_conns, timeout):
+    """
+    Fences the nodes at a common point in replication: records the current
+    WAL position of every node, then polls spock.lag_tracker on every node
+    until it has applied each other node's changes up to that position.
+
+    A receiver has caught up with an origin once its last applied commit is
+    at or past the origin's fence, or once it has heard from the origin past
+    the fence and has nothing left to apply (the origin has been idle).
+    """
+    fence = {}
+    for node, conn in node_conns.items():
+        cur = conn.cursor()
+        cur.execute("SELECT pg_current_wal_lsn()::text")
+        fence[node] = cur.fetchone()[0]
+        cur.close()
+        conn.commit()
+
+    fence_sql = """
+    SELECT commit_lsn >= %(lsn)s::pg_lsn
+        OR (remote_insert_lsn >= %(lsn)s::pg_lsn AND replication_lag_bytes <= 0)
+    FROM spock.lag_tracker
+    WHERE origin_name = %(origin)s AND receiver_name = %(receiver)s
+    """
+
+    pending = [
+        (origin, receiver)
+        for origin in node_conns
+        for receiver in node_conns
+        if origin != receiver
+    ]
+
+    util.message(
+        "Waiting for every node to apply changes up to the LSN fence: "
+        + ", ".join(f"{node}={lsn}" for node, lsn in fence.items()),
+        p_state="info",
+    )
+
+    start_time = datetime.now()
+
+    while pending:
+        for origin, receiver in list(pending):
+            conn = node_conns[receiver]
+            try:
+                cur = conn.cursor()
+                cur.execute(
+                    fence_sql,
+                    {"lsn": fence[origin], "origin": origin, "receiver": receiver},
+                )
+                row = cur.fetchone()
+                cur.close()
+                conn.commit()
+            except Exception as e:
+                util.exit_message(
+                    f"Could not read spock.lag_tracker on {receiver}: {e}"
+                )
+
+            if not row:
+                util.message(
+                    f"{receiver} does not replicate from {origin}: "
+                    "not fencing this pair",
+                    p_state="warning",
+                )
+                pending.remove((origin, receiver))
+            elif row[0]:
+                pending.remove((origin, receiver))
+
+        if not pending:
+            break
+
+        if (datetime.now() - start_time).total_seconds() > timeout:
+            util.exit_message(
+                f"Nodes did not reach the LSN fence within {timeout} seconds: "
+                + ", ".join(f"{o} -> {r}" for o, r in pending)
+            )
+
+        time.sleep(FENCE_POLL_INTERVAL)
+
+    util.message("All nodes have reached the LSN fence", p_state="success")
+
+
+def export_snapshots(node_conns):
+    """
+    Opens a repeatable read transaction on each coordinator connection and
+    exports its snapshot. The transactions must stay open, and so the
+    snapshots importable, until the workers are done.
+    """
+    snapshots = {}
+
+    for node, conn in node_conns.items():
+        conn.commit()
+        conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+        cur = conn.cursor()
+        cur.execute("SELECT pg_export_snapshot()")
+        snapshots[node] = cur.fetchone()[0]
+        cur.close()
+
+    return snapshots
+
+
+def get_node_replicas(cluster_name, node_list):
+    """
+    Returns the active sub-nodes of each node being compared, from the node
+    groups of the cluster definition. Sub-nodes are streaming replicas of the
+    node of their group.
+    """
+    cluster_json = cluster.get_cluster_json(cluster_name) or {}
+    replicas = {node: [] for node in node_list}
+
+    for group in cluster_json.get("node_groups", []):
+        if group.get("name") not in replicas:
+            continue
+
+        for sub_node in group.get("sub_nodes", []):
+            if sub_node.get("is_active") == "off":
+                continue
+
+            replicas[group["name"]].append(
+                {
+                    "replica": sub_node.get("name", ""),
+                    "ip_address": sub_node.get("private_ip")
+                    or sub_node.get("public_ip"),
+                    "port": sub_node.get("port") or 5432,
+                }
+            )
+
+    return replicas
+
+
+def wait_for_replicas(node_conns, replicas, database, timeout):
+    """
+    Records the current WAL position of every node, then polls the node's
+    replicas until they have replayed up to it, so that they have every row
+    the node had when the diff started. Replicas that are not in recovery,
+    cannot be reached or do not catch up in time are not read from.
+
+    Returns the replicas to read from for every node.
+    """
+    target = {}
+    for node, conn in node_conns.items():
+        cur = conn.cursor()
+        cur.execute("SELECT pg_current_wal_lsn()::text")
+        target[node] = cur.fetchone()[0]
+        cur.close()
+        conn.commit()
+
+    util.message(
+        "Waiting for the replicas of every node to replay up to: "
+        + ", ".join(f"{node}={lsn}" for node, lsn in target.items()),
+        p_state="info",
+    )
+
+    replay_sql = """
+    SELECT pg_is_in_recovery(),
+        coalesce(pg_last_wal_replay_lsn() >= %s::pg_lsn, false)
+    """
+
+    pending = {}
+    for node in node_conns:
+        for replica in replicas.get(node, []):
+            try:
+                conn = psycopg.connect(
+                    dbname=database["db_name"],
+                    user=database["username"],
+                    password=database["password"],
+                    host=replica["ip_address"],
+                    port=replica["port"],
+                    **get_session_params(),
+                    autocommit=True,
+                )
+            except Exception as e:
+                util.message(
+                    f"Could not connect to replica {replica['replica']} of {node}: {e}",
+                    p_state="warning",
+                )
+                continue
+            pending[(node, replica["replica"])] = (replica, conn)
+
+    ready = {node: [] for node in node_conns}
+    start_time = datetime.now()
+
+    while pending:
+        for (node, name), (replica, conn) in list(pending.items()):
+            cur = conn.cursor()
+            cur.execute(replay_sql, [target[node]])
+            in_recovery, replayed = cur.fetchone()
+            cur.close()
+
+            if not in_recovery:
+                util.message(
+                    f"{name} is not a replica of {node}: not reading from it",
+                    p_state="warning",
+                )
+            elif replayed:
+                ready[node].append(replica)
+            else:
+                continue
+
+            conn.close()
+            del pending[(node, name)]
+
+        if not pending:
+            break
+
+        if (datetime.now() - start_time).total_seconds() > timeout:
+            for (node, name), (_, conn) in pending.items():
+                util.message(
+                    f"Replica {name} of {node} did not replay up to {target[node]} "
+                    f"within {timeout} seconds: not reading from it",
+                    p_state="warning",
+                )
+                conn.close()
+            break
+
+        time.sleep(REPLICA_POLL_INTERVAL)
+
+    for node, node_replicas in ready.items():
+        if not node_replicas:
+            util.exit_message(f"No replica of {node} is ready to be read from")
+
+        util.message(
+            f"Reading {node} from "
+            + ", ".join(replica["replica"] for replica in node_replicas),
+            p_state="success",
+        )
+
+    return ready
+
+
+def get_table_meta(conn_list, p_schema, p_table, keyless_ok=False):
+    """
+    Returns the columns and primary key (or unique key) of a table, and an
+    error if the table cannot be compared across the nodes. With keyless_ok,
+    a table without a key is returned with a key of None.
+    """
+    table_name = f"{p_schema}.{p_table}"
+    cols = None
+    key = None
+
+    for conn in conn_list:
+        curr_cols = get_cols(conn, p_schema, p_table)
+        curr_key = get_key(conn, p_schema, p_table)
+
+        if not curr_cols:
+            return None, None, f"Invalid table name '{table_name}'"
+        if not curr_key and not keyless_ok:
+            return (
+                None,
+                None,
+                f"No primary key or usable unique index found for '{table_name}'",
+            )
+
+        if cols and ((curr_cols != cols) or (curr_key != key)):
+            return None, None, "Table schemas don't match"
+
+        cols = curr_cols
+        key = curr_key
+
+    return cols, key, None
+
+
+def get_table_sizes(conn_list, tables):
+    """Returns the largest pg_relation_size of each table across the nodes"""
+    sizes = {table: 0 for table in tables}
+
+    for conn in conn_list:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT n.nspname || '.' || c.relname, pg_relation_size(c.oid)
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname || '.' || c.relname = ANY(%s)
+            """,
+            [list(tables)],
+        )
+        for table, size in cur.fetchall():
+            sizes[table] = max(sizes[table], size)
+        cur.close()
+
+    return sizes
+
+
+def resolve_table_glob(conn, table_glob):
+    """
+    Returns the tables, as schema.table, matching a glob such as public.* or
+    sales.order_*. System and spock schemas are never matched.
+    """
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT schemaname || '.' || tablename FROM pg_tables
+        WHERE schemaname NOT IN ('pg_catalog', 'information_schema', 'spock')
+        ORDER BY 1
+        """
+    )
+    tables = [row[0] for row in cur.fetchall()]
+    cur.close()
+
+    return [table for table in tables if fnmatchcase(table, table_glob)]
+
+
+def get_leaf_partitions(conn_list, p_schema, p_table):
+    """
+    Returns the leaf partitions of a partitioned table, as schema.table, or
+    an empty list if the table is not partitioned, and the leaves that are
+    not plain tables (e.g. foreign tables), which cannot be diffed on their
+    own. The partitions must be the same on every node.
+    """
+    leaf_sql = """
+    WITH RECURSIVE tree AS (
+        SELECT c.oid, c.relkind
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_partitioned_table p ON p.partrelid = c.oid
+        WHERE n.nspname = %s AND c.relname = %s
+        UNION ALL
+        SELECT i.inhrelid, c.relkind
+        FROM tree t
+        JOIN pg_inherits i ON i.inhparent = t.oid
+        JOIN pg_class c ON c.oid = i.inhrelid
+    )
+    SELECT n.nspname || '.' || c.relname, t.relkind = 'r'
+    FROM tree t
+    JOIN pg_class c ON c.oid = t.oid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE t.relkind <> 'p'
+    ORDER BY 1
+    """
+
+    partitions = None
+
+    for conn in conn_list:
+        try:
+            cur = conn.cursor()
+            cur.execute(leaf_sql, [p_schema, p_table])
+            rows = cur.fetchall()
+            cur.close()
+        except Exception as e:
+            util.exit_message("Error in get_leaf_partitions():\n" + str(e), 1)
+
+        if partitions is not None and rows != partitions:
+            util.exit_message(
+                f"Partitions of '{p_schema}.{p_table}' don't match across nodes"
+            )
+        partitions = rows
+
+    return (
+        [name for name, is_table in partitions if is_table],
+        [name for name, is_table in partitions if not is_table],
+    )
+
+
+def get_write_stats(node_conns, p_schema, p_table):
+    """
+    Returns what the statistics of every node say about the writes to a
+    table: its relfilenode and its inserted, updated and deleted tuple
+    counts. Only the catalogs are read, never the table.
+    """
+    stats_sql = """
+    SELECT pg_relation_filenode(relid), n_tup_ins, n_tup_upd, n_tup_del
+    FROM pg_stat_user_tables WHERE schemaname = %s AND relname = %s
+    """
+
+    def run_check(conn):
+        try:
+            cur = conn.cursor()
+            cur.execute(stats_sql, [p_schema, p_table])
+            row = cur.fetchone()
+            cur.close()
+            # Statistics read in a transaction are a snapshot until it ends
+            conn.commit()
+        except Exception as e:
+            util.exit_message("Error in get_write_stats():\n" + str(e), 1)
+
+        return list(row) if row else None
+
+    with ThreadPoolExecutor(max_workers=len(node_conns)) as executor:
+        return dict(zip(node_conns, executor.map(run_check, node_conns.values())))
+
+
+def get_precheck_store():
+    """Opens the local store of the write statistics of matched tables"""
+    if not os.path.exists(PRECHECK_DIR):
+        os.makedirs(PRECHECK_DIR)
+
+    store = sqlite3.connect(os.path.join(PRECHECK_DIR, PRECHECK_DB))
+    store.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS prechecks (
+            cluster     TEXT NOT NULL,
+            tbl         TEXT NOT NULL,
+            cols        TEXT NOT NULL,
+            row_filter  TEXT NOT NULL,
+            stats       TEXT NOT NULL,
+            PRIMARY KEY (cluster, tbl)
+        );
+        """
+    )
+    return store
+
+
+def precheck_load(store, cluster_name, table_name, cols, row_filter):
+    """
+    Returns the write statistics of every node from when the table last
+    matched, or None if it has not matched yet, or did for other columns or
+    another filter.
+    """
+    row = store.execute(
+        "SELECT cols, row_filter, stats FROM prechecks WHERE cluster = ? AND tbl = ?",
+        (cluster_name, table_name),
+    ).fetchone()
+
+    if not row or row[0] != cols or row[1] != (row_filter or ""):
+        return None
+
+    return json.loads(row[2])
+
+
+def precheck_save(store, cluster_name, table_name, cols, row_filter, stats):
+    with store:
+        store.execute(
+            "INSERT OR REPLACE INTO prechecks VALUES (?, ?, ?, ?, ?)",
+            (cluster_name, table_name, cols, row_filter or "", json.dumps(stats)),
+        )
+
+
+def calibrate_block_rows(
+    node_conns,
+    plan_conn,
+    schema_name,
+    table_name,
+    p_key,
+    hash_mode,
+    target_ms,
+    max_block_size,
+    cols=None,
+    row_filter=None,
+):
+    """
+    Cost-based block sizing for --block_rows=auto. The average row width,
+    from pg_stats or else from the table's size and row estimate, bounds a
+    calibration sample of about ADAPTIVE_CALIBRATION_BYTES. The sample is
+    hashed on every node, and blocks are sized so that hashing one takes
+    about target_ms on the slowest node.
+
+    Returns the block size and the measured hash latency per row, in ms.
+    """
+    simple_primary_key = len(p_key.split(",")) == 1
+
+    cur = plan_conn.cursor()
+    cur.execute(
+        """
+        SELECT c.reltuples, pg_relation_size(c.oid),
+            (SELECT sum(s.avg_width) FROM pg_stats s
+            WHERE s.schemaname = n.nspname AND s.tablename = c.relname)
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relname = %s
+        """,
+        [schema_name, table_name],
+    )
+    reltuples, rel_size, avg_width = cur.fetchone()
+
+    row_width = avg_width or (rel_size / reltuples if reltuples > 0 else None)
+    sample_rows = max_block_size
+    if row_width:
+        sample_rows = int(ADAPTIVE_CALIBRATION_BYTES / row_width)
+    sample_rows = max(MIN_ALLOWED_BLOCK_SIZE, min(sample_rows, max_block_size))
+
+    cur.execute(
+        sql.SQL("{} OFFSET {} LIMIT 1").format(
+            get_pkey_sql(schema_name, table_name, p_key, row_filter),
+            sql.Literal(sample_rows),
+        )
+    )
+    row = cur.fetchone()
+    cur.close()
+
+    sample_end = None
+    if row:
+        sample_end = str(row[0]) if simple_primary_key else tuple(str(i) for i in row)
+
+    where_clause = get_range_clause(
+        p_key, simple_primary_key, None, sample_end, row_filter
+    )
+    count_sql = sql.SQL("SELECT count(*) FROM {}.{} WHERE {}").format(
+        sql.Identifier(schema_name), sql.Identifier(table_name), where_clause
+    )
+    hash_sql = get_hash_sql(
+        schema_name, table_name, p_key, where_clause, hash_mode, cols=cols
+    )
+
+    row_ms = 0
+    for conn in node_conns.values():
+        cur = conn.cursor()
+        cur.execute(count_sql)
+        rows = max(1, cur.fetchone()[0])
+
+        # The first pass warms the cache, the second one is timed
+        cur.execute(hash_sql)
+        start = time.monotonic()
+        cur.execute(hash_sql)
+        cur.fetchall()
+        elapsed_ms = (time.monotonic() - start) * 1000
+        cur.close()
+
+        row_ms = max(row_ms, elapsed_ms / rows)
+
+    block_rows = int(target_ms / row_ms) if row_ms else max_block_size
+    block_rows = max(MIN_ALLOWED_BLOCK_SIZE, min(block_rows, max_block_size))
+
+    return block_rows, row_ms
+
+
+def new_adaptive_state(block_rows, row_ms, target_ms, max_block_size):
+    """
+    Returns the adaptive planner state of a table calibrated to block_rows.
+    Its key ranges are planned at base_rows, and coalesce of them make up
+    a block.
+    """
+    base_rows = max(MIN_ALLOWED_BLOCK_SIZE, block_rows // ADAPTIVE_SPLIT)
+
+    return {
+        "target_ms": target_ms,
+        "row_ms": row_ms,
+        "base_rows": base_rows,
+        "coalesce": max(1, block_rows // base_rows),
+        "max_coalesce": max(1, max_block_size // base_rows),
+        "range_ms": None,
+        "samples": 0,
+    }
+
+
+def get_node_headroom(node_conns):
+    """Returns how many more client connections every node can accept"""
+    headroom = None
+
+    for conn in node_conns.values():
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT current_setting('max_connections')::int
+                - current_setting('superuser_reserved_connections')::int
+                - count(*)
+            FROM pg_stat_activity WHERE backend_type = 'client backend'
+            """
+        )
+        node_headroom = cur.fetchone()[0]
+        cur.close()
+
+        headroom = node_headroom if headroom is None else min(headroom, node_headroom)
+
+    return max(1, headroom or 1)
+
+
+def adaptive_batches(tables, adaptive, max_inflight):
+    """
+    Yields batches of blocks for the adaptive planner. Blocks are made of
+    consecutive planned key ranges, as many as the table's current coalesce
+    factor, which the parent keeps adjusting while batches are consumed.
+    """
+    for table_id, (_, pkey_offsets) in tables.items():
+        state = adaptive[table_id]
+        i = 0
+
+        while i < len(pkey_offsets):
+            blocks = []
+            ranges = 0
+
+            while i < len(pkey_offsets) and len(blocks) < max_inflight:
+                group = pkey_offsets[i : i + state["coalesce"]]
+                blocks.append((group[0][0], group[-1][1]))
+                ranges += len(group)
+                i += len(group)
+
+            yield table_id, blocks, ranges
+
+
+def adapt_to_latency(state, gate, n_jobs, ranges, elapsed):
+    """
+    Feeds the latency of a batch of blocks that all matched back into the
+    adaptive planner. Blocks are resized to take about the target time
+    again, and the number of workers allowed to run at once is lowered
+    while rows take much longer to hash than during calibration, which
+    means the nodes are saturated, and raised again once they recover.
+    """
+    range_ms = elapsed * 1000 / ranges
+    if state["range_ms"] is not None:
+        range_ms = 0.7 * state["range_ms"] + 0.3 * range_ms
+    state["range_ms"] = range_ms
+
+    state["coalesce"] = max(
+        1, min(round(state["target_ms"] / range_ms), state["max_coalesce"])
+    )
+
+    state["samples"] += 1
+    if state["samples"] % n_jobs or not state["row_ms"]:
+        return
+
+    row_ms = range_ms / state["base_rows"]
+    with gate["limit"].get_lock():
+        if row_ms > ADAPTIVE_SLOWDOWN * state["row_ms"]:
+            gate["limit"].value = max(1, gate["limit"].value - 1)
+        elif row_ms < ADAPTIVE_SPEEDUP * state["row_ms"]:
+            gate["limit"].value = min(n_jobs, gate["limit"].value + 1)
+
+
+def gate_enter(gate):
+    """
+    Waits for a slot under the adaptive planner's concurrency limit, and the
+    governor's
+    """
+    while True:
+        with gate["active"].get_lock():
+            limit = gate["limit"].value
+            if "cap" in gate:
+                limit = min(limit, gate["cap"].value)
+
+            if gate["active"].value < limit:
+                gate["active"].value += 1
+                return
+        time.sleep(ADAPTIVE_GATE_POLL_INTERVAL)
+
+
+def gate_exit(gate):
+    with gate["active"].get_lock():
+        gate["active"].value -= 1
+
+
+def get_read_bytes_sql(conn):
+    """
+    Returns the query for the bytes a node has read so far: from pg_stat_io
+    where available (PostgreSQL 16+), and from pg_stat_database otherwise.
+    """
+    version = conn.info.server_version
+
+    if version >= 180000:
+        return "SELECT sum(read_bytes) FROM pg_stat_io"
+    if version >= 160000:
+        return "SELECT sum(reads * op_bytes) FROM pg_stat_io"
+
+    return (
+        "SELECT sum(blks_read) * current_setting('block_size')::bigint"
+        " FROM pg_stat_database"
+    )
+
+
+def sample_node_load(governor, node, cur):
+    """
+    Returns the load on a node: ACE's active queries, all active sessions,
+    those waiting on I/O, and the spock replication lag in bytes when the
+    governor has a lag budget (0 otherwise). Shared by the diff and repair
+    governors; if spock.lag_tracker cannot be read, lag checks are turned
+    off for the rest of the run.
+    """
+    cur.execute(
+        "SELECT count(*) FILTER (WHERE application_name = %s),"
+        " count(*), count(*) FILTER (WHERE wait_event_type = 'IO')"
+        " FROM pg_stat_activity"
+        " WHERE state = 'active' AND backend_type = 'client backend'"
+        " AND pid <> pg_backend_pid()",
+        [SESSION_APPLICATION_NAME],
+    )
+    queries, active, io_wait = cur.fetchone()
+    lag = 0
+
+    if governor["max_lag_bytes"] and governor["check_lag"]:
+        try:
+            cur.execute(SPOCK_LAG_SQL)
+            lag = cur.fetchone()[0]
+        except Exception:
+            util.message(
+                f"Unable to read spock.lag_tracker on {node}: "
+                "replication lag will not be checked",
+                p_state="warning",
+            )
+            governor["check_lag"] = False
+
+    return {"queries": queries, "active": active, "io_wait": io_wait, "lag": lag}
+
+
+def governor_sample(governor, node, conn):
+    """
+    Samples the load on a node and returns the budgets it is over, with
+    why: ACE's and all active sessions, those waiting on I/O, replication
+    lag and the MB/s read since the previous sample.
+    """
+    reasons = []
+    cur = conn.cursor()
+
+    load = sample_node_load(governor, node, cur)
+    queries, active, io_wait = load["queries"], load["active"], load["io_wait"]
+
+    if governor["max_queries"] and queries > governor["max_queries"]:
+        reasons.append(("queries", f"{queries} ACE queries"))
+    if governor["max_active"] and active > governor["max_active"]:
+        reasons.append(("active", f"{active} active sessions"))
+    if (
+        active >= GOVERNOR_IO_WAIT_MIN_SESSIONS
+        and io_wait > GOVERNOR_IO_WAIT_RATIO * active
+    ):
+        reasons.append(
+            ("io_wait", f"{io_wait} of {active} active sessions waiting on I/O")
+        )
+    if governor["max_lag_bytes"] and load["lag"] > governor["max_lag_bytes"]:
+        reasons.append(("lag", f"replication lag of {load['lag']} bytes"))
+
+    if governor["max_read_mbps"]:
+        # With replicas a node has several connections, so reads are per
+        # connection
+        cur.execute(governor["read_sql"][conn])
+        read_bytes = int(cur.fetchone()[0] or 0)
+        now = time.monotonic()
+        prev = governor["reads"].get(conn)
+        governor["reads"][conn] = (read_bytes, now)
+
+        if prev and now > prev[1]:
+            read_mbps = (read_bytes - prev[0]) / (now - prev[1]) / 1048576
+            if read_mbps > governor["max_read_mbps"]:
+                reasons.append(("read", f"{read_mbps:.1f} MB/s read"))
+
+    cur.close()
+    return reasons
+
+
+def governor_adjust(governor, throttle, over, max_procs, max_inflight):
+    """
+    Slows the diff down while nodes are over budget, and speeds it up again
+    one step at a time once none is. The in-flight queries of the nodes over
+    budget are halved first; once they are down to one, or the nodes run
+    too many ACE queries, fewer workers are let through at once, and once
+    only one is, the pause between batches grows.
+    """
+    cap = throttle["cap"]
+    pace_ms = throttle["pace_ms"]
+    inflight = throttle["inflight"]
+
+    if over:
+        lower_cap = any(inflight[node].value == 1 for node in over) or any(
+            budget == "queries" for reasons in over.values() for budget, _ in reasons
+        )
+
+        for node in over:
+            inflight[node].value = max(1, inflight[node].value // 2)
+
+        if lower_cap and cap.value > 1:
+            cap.value -= 1
+        elif lower_cap:
+            pace_ms.value = min(GOVERNOR_MAX_PACE_MS, max(100, pace_ms.value * 2))
+
+        governor["throttled"] += 1
+    elif pace_ms.value:
+        pace_ms.value = pace_ms.value // 2 if pace_ms.value > 100 else 0
+    elif cap.value < max_procs:
+        cap.value += 1
+    else:
+        for value in inflight.values():
+            value.value = min(max_inflight, value.value + 1)
+
+    governor["samples"] += 1
+    governor["min_cap"] = min(governor.get("min_cap", max_procs), cap.value)
+    governor["max_pace_ms"] = max(governor.get("max_pace_ms", 0), pace_ms.value)
+
+
+def governor_run(governor, throttle, conns, stop, max_procs, max_inflight):
+    """
+    Samples every node each GOVERNOR_POLL_INTERVAL seconds, and adjusts the
+    diff's concurrency and pacing, until stop is set.
+    """
+    was_over = False
+
+    while not stop.wait(GOVERNOR_POLL_INTERVAL):
+        over = {}
+        try:
+            for node, node_conns in conns.items():
+                for conn in node_conns:
+                    reasons = governor_sample(governor, node, conn)
+                    if reasons:
+                        over.setdefault(node, []).extend(reasons)
+        except Exception as e:
+            util.message(
+                f"Governor could not sample the nodes: {e}", p_state="warning"
+            )
+            continue
+
+        if over and not was_over:
+            util.message(
+                "Throttling diff: "
+                + "; ".join(
+                    f"{node}: {', '.join(why for _, why in reasons)}"
+                    for node, reasons in over.items()
+                ),
+                p_state="warning",
+            )
+        was_over = bool(over)
+
+        governor_adjust(governor, throttle, over, max_procs, max_inflight)
+
+
+def connect_nodes(shared_objects, autocommit=False):
+    """
+    Opens connections to where the blocks of every node being compared are
+    read, keyed by node: the node itself, or each of its replicas being read
+    from with --use_replicas
+    """
+    db, pg, node_info = cluster.load_json(shared_objects["cluster_name"])
+    database = shared_objects["database"]
+    replicas = shared_objects.get("replicas")
+
+    conns = {}
+    for node in node_info:
+        if node["name"] not in shared_objects["node_list"]:
+            continue
+
+        if replicas:
+            conns[node["name"]] = [
+                connect_node({**database, **node, **replica}, autocommit)
+                for replica in replicas[node["name"]]
+            ]
+        else:
+            conns[node["name"]] = [connect_node({**database, **node}, autocommit)]
+
+    return conns
+
+
+def get_calibration_conns(shared_objects, node_conns):
+    """
+    Returns a connection to every node to calibrate the block size on. With
+    --use_replicas, blocks are read on the replicas, so one replica of every
+    node is used. close_calibration_conns() closes them again.
+    """
+    if not shared_objects.get("replicas"):
+        return node_conns
+
+    database = shared_objects["database"]
+    return {
+        node: connect_node({**database, **replicas[0]})
+        for node, replicas in shared_objects["replicas"].items()
+    }
+
+
+def close_calibration_conns(calibration_conns, node_conns):
+    if calibration_conns is not node_conns:
+        for conn in calibration_conns.values():
+            conn.close()
+
+
+def compare_table_checksums(shared_objects, worker_state, table_id, blocks, ranges):
+    """
+    compare_checksums() for a batch of blocks of one of several tables. The
+    batch covers ranges planned key ranges; how long it took is returned so
+    that the adaptive planner can resize blocks.
+    """
+    table_objects = {**shared_objects, **shared_objects["tables"][table_id]}
+    gate = shared_objects.get("gate")
+    throttle = shared_objects.get("throttle")
+
+    if gate:
+        gate_enter(gate)
+
+    try:
+        start = time.monotonic()
+        results = compare_checksums(table_objects, worker_state, blocks)
+        elapsed = time.monotonic() - start
+
+        # The governor's pause between batches holds on to the slot
+        if throttle and throttle["pace_ms"].value:
+            time.sleep(throttle["pace_ms"].value / 1000)
+    finally:
+        if gate:
+            gate_exit(gate)
+
+    return (table_id, blocks, ranges, elapsed, *results)
+
+
+def get_block_batches(tables, procs, max_inflight):
+    """
+    Splits the key ranges of every table into batches that a worker can
+    pipeline on each of its node connections but small enough to keep
+    every worker busy.
+    """
+    batches = []
+
+    for table_id, (_, pkey_offsets) in tables.items():
+        batch_size = max(1, min(max_inflight, -(-len(pkey_offsets) // procs)))
+        for i in range(0, len(pkey_offsets), batch_size):
+            batch = pkey_offsets[i : i + batch_size]
+            batches.append((table_id, batch, len(batch)))
+
+    return batches
+
+
+def run_table_diffs(
+    shared_objects, tables, procs, adaptive=None, journal=None, diff_writers=None
+):
+    """
+    Compares the planned blocks of one or more tables in a single worker
+    pool, so that every worker keeps one connection per node across tables.
+
+    tables maps a table to its own shared objects and key ranges. Blocks are
+    handed out in batches, table by table in the order given, in batches that
+    a worker can pipeline on each of its node connections but small enough
+    to keep every worker busy.
+
+    adaptive maps tables to their adaptive planner state, if blocks are to
+    be sized during the run. Their key ranges are then coalesced into
+    blocks as batches are handed out, and the number of workers comparing
+    blocks at once is adjusted as the batches complete.
+
+    If the governor has budgets, it throttles the workers while it runs
+    alongside them, see governor_run().
+
+    A batch stops at the first block that fails. The blocks from there on
+    are retried in a new pool, with new connections, up to block_retries
+    times with a growing backoff, before they are reported as errors. If a
+    journal is given, every batch is recorded in it as it completes.
+
+    diff_writers maps tables to the binary diff files their diffs are
+    appended to as batches complete, instead of being merged in memory.
+
+    Returns the block results, diffs and changed columns of every table.
+    """
+    max_inflight = shared_objects["max_inflight"]
+    block_retries = shared_objects.get("block_retries", 0)
+    results = {
+        table_id: {
+            "block_results": [],
+            "diff_dict": {},
+            "changed_columns": {},
+            "diff_writer": (diff_writers or {}).get(table_id),
+        }
+        for table_id in tables
+    }
+
+    pool_objects = {
+        **shared_objects,
+        "tables": {table_id: objects for table_id, (objects, _) in tables.items()},
+    }
+
+    if adaptive:
+        pool_objects["gate"] = {"active": Value("i", 0), "limit": Value("i", procs)}
+        batches = adaptive_batches(tables, adaptive, max_inflight)
+    else:
+        batches = get_block_batches(tables, procs, max_inflight)
+
+    governor = shared_objects.get("governor")
+    if governor:
+        """
+        The governor samples the nodes from this process, over connections of
+        its own, and throttles the workers through the values they share:
+        how many of them may compare blocks at once, the queries each may
+        have in flight on every node, and the pause after every batch.
+        """
+        gate = pool_objects.setdefault(
+            "gate", {"active": Value("i", 0), "limit": Value("i", procs)}
+        )
+        gate["cap"] = Value("i", procs)
+        throttle = {
+            "cap": gate["cap"],
+            "pace_ms": Value("i", 0),
+            "inflight": {
+                node: Value("i", max_inflight) for node in shared_objects["node_list"]
+            },
+        }
+        pool_objects["throttle"] = throttle
+
+        governor_conns = connect_nodes(shared_objects, autocommit=True)
+        governor.update(
+            check_lag=True,
+            reads={},
+            read_sql={
+                conn: get_read_bytes_sql(conn)
+                for node_conns in governor_conns.values()
+                for conn in node_conns
+            },
+            samples=0,
+            throttled=0,
+        )
+        governor_stop = threading.Event()
+        governor_thread = threading.Thread(
+            target=governor_run,
+            args=(
+                governor,
+                throttle,
+                governor_conns,
+                governor_stop,
+                procs,
+                max_inflight,
+            ),
+            daemon=True,
+        )
+        governor_thread.start()
+
+    attempt = 0
+
+    while batches:
+        # Retried blocks are compared as they are, without adapting them
+        if adaptive and attempt == 0:
+            n_jobs = procs
+            map_args = {"chunk_size": 1}
+        else:
+            n_jobs = min(procs, len(batches))
+            map_args = {"iterable_len": len(batches)}
+
+        failed = {}
+
+        with WorkerPool(
+            n_jobs=n_jobs,
+            shared_objects=pool_objects,
+            use_worker_state=True,
+        ) as pool:
+            for (
+                table_id,
+                blocks,
+                ranges,
+                elapsed,
+                batch_results,
+                batch_diffs,
+                batch_changes,
+                batch_hashes,
+            ) in pool.imap_unordered(
+                compare_table_checksums,
+                batches,
+                worker_init=init_db_connection,
+                worker_exit=close_db_connection,
+                progress_bar=True,
+                **map_args,
+            ):
+                batch_failed = bool(batch_results) and batch_results[-1] == BLOCK_ERROR
+                if batch_failed:
+                    batch_results = batch_results[:-1]
+                    failed.setdefault(table_id, []).extend(
+                        blocks[len(batch_results) :]
+                    )
+
+                result = results[table_id]
+                result["block_results"] += batch_results
+                collect_diffs(result, batch_diffs, batch_changes)
+
+                if journal:
+                    journal_blocks(
+                        journal,
+                        table_id,
+                        blocks,
+                        batch_results,
+                        batch_hashes,
+                        batch_diffs,
+                        batch_changes,
+                    )
+
+                # Batches that had rows fetched say little about hashing speed
+                if (
+                    adaptive
+                    and attempt == 0
+                    and not batch_failed
+                    and batch_results
+                    and set(batch_results) == {BLOCK_OK}
+                ):
+                    adapt_to_latency(
+                        adaptive[table_id],
+                        pool_objects["gate"],
+                        n_jobs,
+                        ranges,
+                        elapsed,
+                    )
+
+        if not failed:
+            break
+
+        failed_blocks = sum(len(blocks) for blocks in failed.values())
+
+        if attempt >= block_retries:
+            for table_id, blocks in failed.items():
+                results[table_id]["block_results"] += [BLOCK_ERROR] * len(blocks)
+            break
+
+        attempt += 1
+        backoff = BLOCK_RETRY_BACKOFF * 2 ** (attempt - 1)
+        util.message(
+            f"{failed_blocks} blocks failed: retrying them in {backoff} seconds"
+            f" (retry {attempt} of {block_retries})",
+            p_state="warning",
+        )
+        time.sleep(backoff)
+
+        retry_tables = {
+            table_id: (tables[table_id][0], blocks)
+            for table_id, blocks in failed.items()
+        }
+        batches = get_block_batches(retry_tables, procs, max_inflight)
+
+    if governor:
+        governor_stop.set()
+        governor_thread.join()
+        for node_conns in governor_conns.values():
+            for conn in node_conns:
+                conn.close()
+
+    if adaptive:
+        for state in adaptive.values():
+            state["workers"] = pool_objects["gate"]["limit"].value
+
+    return results
+
+
+def report_table_diff(result, diff_meta, output, dirname=None):
+    """
+    Reports how a table's nodes compared, and writes out the diffs found.
+    Returns "error", "mismatch" or "match".
+    """
+    mismatch = False
+    diffs_exceeded = False
+    writer = result.get("diff_writer")
+
+    for block_result in result["block_results"]:
+        if block_result == MAX_DIFF_EXCEEDED:
+            diffs_exceeded = True
+
+        if block_result == BLOCK_MISMATCH or block_result == MAX_DIFF_EXCEEDED:
+            mismatch = True
+
+        if block_result == BLOCK_ERROR:
+            if writer:
+                finish_diffs_binary(writer, keep=False)
+            return "error"
+
+    if not mismatch:
+        if writer:
+            finish_diffs_binary(writer, keep=False)
+        util.message("TABLES MATCH OK\n", p_state="success")
+        return "match"
+
+    diff_dict = result["diff_dict"]
+    diff_counts = get_diff_counts(result)
+    changed_columns = result["changed_columns"]
+
+    # Mismatch is True if there is a block mismatch or if we have
+    # estimated that diffs may be greater than max allowed diffs
+    if diffs_exceeded:
+        util.message(
+            f"TABLES DO NOT MATCH. DIFFS HAVE EXCEEDED {MAX_DIFF_ROWS} ROWS",
+            p_state="warning",
+        )
+
+    else:
+        util.message("TABLES DO NOT MATCH", p_state="warning")
+
+    """
+    Count the differences between each node pair in the cluster
+    """
+
+    for node_pair in diff_counts.keys():
+        node1, node2 = node_pair.split("/")
+        diff_count = max(diff_counts[node_pair].values())
+        util.message(
+            f"FOUND {diff_count} DIFFS BETWEEN {node1} AND {node2}",
+            p_state="warning",
+        )
+
+        if node_pair in changed_columns:
+            col_counts = {}
+            for change in changed_columns[node_pair]:
+                for col in change["columns"]:
+                    col_counts[col] = col_counts.get(col, 0) + 1
+            util.message(
+                "  CHANGED COLUMNS: "
+                + ", ".join(f"{col} ({n})" for col, n in col_counts.items()),
+                p_state="warning",
+            )
+
+    print()
+
+    if changed_columns:
+        diff_meta["changed_columns"] = changed_columns
+
+    if writer:
+        finish_diffs_binary(writer, diff_meta)
+
+    elif output == "json":
+        write_diffs_json(diff_dict, diff_meta["block_rows"], diff_meta, dirname)
+
+    elif output == "csv":
+        write_diffs_csv(diff_dict, dirname)
+
+    return "mismatch"
+
+
+def sample_key_ranges(pkey_offsets, sample, seed, table_name):
+    """
+    Picks a random share of the planned key ranges to compare. The choice is
+    seeded with the seed and the table name, so a sample can be repeated.
+    """
+    count = max(1, math.ceil(len(pkey_offsets) * sample))
+    rng = random.Random(f"{seed}:{table_name}")
+    picked = sorted(rng.sample(range(len(pkey_offsets)), count))
+
+    return [pkey_offsets[i] for i in picked]
+
+
+def get_sample_interval(hits, compared, total):
+    """
+    Returns the Wilson score interval of the share of blocks that diverge,
+    given the hits among the blocks compared out of the table's total. The
+    sample counts for more as it nears the whole table (finite population
+    correction), and a sample of every block gives the exact share.
+    """
+    if not compared:
+        return 0.0, 1.0
+
+    p = hits / compared
+    if compared >= total:
+        return p, p
+
+    n = compared * (total - 1) / (total - compared)
+    z = SAMPLE_CONFIDENCE_Z
+    denom = 1 + z * z / n
+    centre = (p + z * z / (2 * n)) / denom
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+
+    return max(0.0, centre - margin), min(1.0, centre + margin)
+
+
+def report_sample(result, sample_meta):
+    """
+    Reports the share of a table's blocks estimated to diverge from the
+    blocks sampled, and the number of divergent rows that extrapolates to
+    """
+    block_results = result["block_results"]
+    compared = len(block_results)
+    mismatched = sum(1 for block_result in block_results if block_result != BLOCK_OK)
+    total = sample_meta["total_blocks"]
+
+    rate = mismatched / compared if compared else 0.0
+    low, high = get_sample_interval(mismatched, compared, total)
+
+    diff_rows = max(
+        (max(counts.values()) for counts in get_diff_counts(result).values()),
+        default=0,
+    )
+    estimated_rows = round(diff_rows * total / compared) if compared else 0
+
+    util.message(
+        f"SAMPLED BLOCKS = {compared} of {total}\n"
+        f"MISMATCHED BLOCKS IN SAMPLE = {mismatched}\n"
+        f"ESTIMATED DIVERGENT BLOCKS = {rate:.2%}"
+        f" (95% CI {low:.2%} - {high:.2%})\n"
+        f"ESTIMATED DIVERGENT ROWS = {estimated_rows}",
+        p_state="info",
+    )
+
+
+def diff_tables(
+    shared_objects,
+    node_conns,
+    tables,
+    block_rows,
+    max_cpu_ratio,
+    output,
+    range_planner=RANGE_PLANNER_DEFAULT,
+    consistent=False,
+    fence_timeout=FENCE_TIMEOUT_DEFAULT,
+    target_block_ms=TARGET_BLOCK_MS_DEFAULT,
+    sample=0,
+    sample_seed=SAMPLE_SEED_DEFAULT,
+    precheck=False,
+):
+    """
+    Diffs many tables at once under one budget of worker processes, and so
+    of connections per node. Tables are checked and planned over the given
+    connections, then their blocks are compared in a single worker pool,
+    largest tables first so that the small ones fill in at the end.
+    Tables that cannot be compared are reported and skipped. With a
+    block_rows of "auto", every table's blocks are sized by the adaptive
+    planner. With a sample ratio, only that share of every table's blocks
+    is compared, and row counts are estimated instead of counted. With
+    precheck, tables that matched before, and have not been written to on
+    any node since going by the nodes' statistics, are not read at all.
+    """
+    conn_list = list(node_conns.values())
+    start_time = datetime.now()
+
+    sizes = get_table_sizes(conn_list, tables)
+    tables = sorted(tables, key=lambda table: sizes[table], reverse=True)
+
+    util.message(f"Planning {len(tables)} tables...\n", p_state="info")
+
+    planned = {}
+    adaptive = {}
+    samples = {}
+    outcomes = {}
+    total_rows = 0
+
+    precheck_store = get_precheck_store() if precheck else None
+    prechecked = {}
+
+    calibration_conns = None
+    if block_rows == "auto":
+        calibration_conns = get_calibration_conns(shared_objects, node_conns)
+
+    for table in tables:
+        l_schema, l_table = table.split(".", 1)
+        cols, key, error = get_table_meta(conn_list, l_schema, l_table)
+
+        if error:
+            util.message(f"Skipping {table}: {error}", p_state="warning")
+            outcomes[table] = "skipped"
+            continue
+
+        if precheck:
+            # The statistics are read before the table is compared, so that
+            # writes made while it is are seen by the next run
+            stats = get_write_stats(node_conns, l_schema, l_table)
+            row_filter = shared_objects["row_filter"]
+            if precheck_load(
+                precheck_store, shared_objects["cluster_name"], table, cols, row_filter
+            ) == stats and None not in stats.values():
+                total_rows += sum(
+                    get_row_estimate(conn, l_schema, l_table) for conn in conn_list
+                )
+                outcomes[table] = "match"
+                continue
+            prechecked[table] = (cols, stats)
+
+        row_count = 0
+        conn_with_max_rows = None
+        for node, conn in node_conns.items():
+            if sample:
+                rows = get_row_estimate(conn, l_schema, l_table)
+            else:
+                rows = get_row_count(conn, l_schema, l_table)
+            total_rows += rows
+            if rows > row_count:
+                row_count = rows
+                conn_with_max_rows = conn
+
+        if not conn_with_max_rows:
+            outcomes[table] = "empty"
+            continue
+
+        simple_primary_key = len(key.split(",")) == 1
+        table_block_rows = block_rows
+        plan_rows = block_rows
+
+        if block_rows == "auto":
+            hash_mode = shared_objects["hash_mode"]
+            max_block_size = get_max_block_size(hash_mode)
+            table_block_rows, row_ms = calibrate_block_rows(
+                calibration_conns,
+                conn_with_max_rows,
+                l_schema,
+                l_table,
+                key,
+                hash_mode,
+                target_block_ms,
+                max_block_size,
+                row_filter=shared_objects["row_filter"],
+            )
+            util.message(
+                f"Calibrated block size for {table}: {table_block_rows} rows"
+                f" ({row_ms * 1000:.1f} us per row)",
+                p_state="info",
+            )
+            plan_rows = table_block_rows
+
+            # Sampled key ranges are not contiguous and cannot be coalesced
+            if not sample:
+                adaptive[table] = new_adaptive_state(
+                    table_block_rows, row_ms, target_block_ms, max_block_size
+                )
+                plan_rows = adaptive[table]["base_rows"]
+
+        table_objects = {
+            "schema_name": l_schema,
+            "table_name": l_table,
+            "cols_list": [col for col in cols.split(",") if not col.startswith("_Spock_")],
+            "p_key": key,
+            "columns": None,
+            "block_rows": table_block_rows,
+            "simple_primary_key": simple_primary_key,
+            "counters": new_diff_counters(),
+        }
+
+        if shared_objects["fetch_mode"] == "copy":
+            set_copy_col_types(table_objects, conn_with_max_rows, l_schema, l_table)
+
+        pkey_offsets = plan_key_ranges(
+            conn_with_max_rows,
+            l_schema,
+            l_table,
+            key,
+            plan_rows,
+            simple_primary_key,
+            range_planner,
+            shared_objects["row_filter"],
+        )
+
+        if sample:
+            samples[table] = {
+                "ratio": sample,
+                "seed": sample_seed,
+                "total_blocks": len(pkey_offsets),
+            }
+            pkey_offsets = sample_key_ranges(pkey_offsets, sample, sample_seed, table)
+            samples[table]["blocks"] = len(pkey_offsets)
+
+        planned[table] = (table_objects, pkey_offsets)
+
+    if calibration_conns:
+        close_calibration_conns(calibration_conns, node_conns)
+
+    if consistent:
+        # All tables are compared at the same replication-consistent point
+        wait_for_lsn_fence(node_conns, fence_timeout)
+        shared_objects = {
+            **shared_objects,
+            "snapshots": export_snapshots(node_conns),
+        }
+
+    cpus = cpu_count()
+    procs = int(cpus * max_cpu_ratio * 2) if cpus > 1 else 1
+    procs = max(1, procs)
+
+    # Each worker holds a connection to every node
+    if adaptive:
+        procs = min(procs, get_node_headroom(node_conns))
+
+    # Every table's diffs go under one directory for the run
+    dirname = os.path.join(
+        "diffs", datetime.now().astimezone(None).strftime("%Y-%m-%d_%H:%M:%S")
+    )
+
+    diff_writers = None
+    if output == "binary":
+        diff_writers = {
+            table: open_diffs_binary(
+                table_objects["p_key"], os.path.join(dirname, table)
+            )
+            for table, (table_objects, _) in planned.items()
+        }
+
+    util.message("Starting jobs to compare tables...\n", p_state="info")
+
+    results = run_table_diffs(
+        shared_objects, planned, procs, adaptive, diff_writers=diff_writers
+    )
+
+    if consistent:
+        for conn in node_conns.values():
+            conn.rollback()
+
+    for table in tables:
+        util.message(f"\n\nCHECKING TABLE {table}...\n", p_state="info")
+
+        if outcomes.get(table) == "skipped":
+            util.message("SKIPPED", p_state="warning")
+            continue
+
+        if outcomes.get(table) == "empty":
+            util.message("ALL TABLES ARE EMPTY", p_state="warning")
+            continue
+
+        if outcomes.get(table) == "match":
+            util.message(
+                "TABLES MATCH OK (not written to since it last matched)\n",
+                p_state="success",
+            )
+            continue
+
+        diff_meta = {
+            "table": table,
+            "key": planned[table][0]["p_key"],
+            "block_rows": planned[table][0]["block_rows"],
+            "hash_mode": shared_objects["hash_mode"],
+            "compare_engine": shared_objects["compare_engine"],
+        }
+
+        if shared_objects["row_filter"]:
+            diff_meta["where"] = shared_objects["row_filter"]
+
+        if table in samples:
+            diff_meta["sample"] = samples[table]
+
+        outcomes[table] = report_table_diff(
+            results[table], diff_meta, output, os.path.join(dirname, table)
+        )
+
+        if table in samples and outcomes[table] != "error":
+            report_sample(results[table], samples[table])
+
+        # A sampled match does not cover the rows that were not compared
+        if outcomes[table] == "match" and table in prechecked and not sample:
+            cols, stats = prechecked[table]
+            precheck_save(
+                precheck_store,
+                shared_objects["cluster_name"],
+                table,
+                cols,
+                shared_objects["row_filter"],
+                stats,
+            )
+
+        if outcomes[table] == "error":
+            util.message(
+                "There were one or more errors while comparing this table",
+                p_state="warning",
+            )
+
+    run_time = util.round_timedelta(datetime.now() - start_time).total_seconds()
+    outcome_counts = {
+        outcome: list(outcomes.values()).count(outcome)
+        for outcome in ["match", "mismatch", "error", "empty", "skipped"]
+    }
+
+    print()
+
+    util.message(
+        f"TABLES CHECKED = {len(tables)}\n"
+        f"MATCHED = {outcome_counts['match']}, "
+        f"MISMATCHED = {outcome_counts['mismatch']}, "
+        f"ERRORS = {outcome_counts['error']}, "
+        f"EMPTY = {outcome_counts['empty']}, "
+        f"SKIPPED = {outcome_counts['skipped']}\n"
+        f"TOTAL ROWS CHECKED = {total_rows}\n"
+        f"RUN TIME = {run_time:.2f} seconds",
+        p_state="info",
+    )
+
+    return outcomes
+
+
+def get_keyless_row(cols):
+    """
+    The row t of a keyless table as text, made of the compared columns only,
+    so that the _Spock_ metadata columns, which differ by node, are left out
+    """
+    return sql.SQL("ROW({})::text").format(get_select_list(cols, "t"))
+
+
+def get_keyless_bucket(n_buckets, cols):
+    """The bucket of the row t of a keyless table, from a hash of the row"""
+    return sql.SQL("((hashtextextended({row}, 0) % {n}) + {n}) % {n}").format(
+        row=get_keyless_row(cols), n=sql.Literal(n_buckets)
+    )
+
+
+def get_keyless_where(lo_page, hi_page, row_filter=None):
+    """
+    Selects the rows of a keyless table stored in pages [lo_page, hi_page),
+    or from lo_page on if hi_page is None, that match the row filter
+    """
+    conditions = [sql.SQL("t.ctid >= {}::tid").format(sql.Literal(f"({lo_page},0)"))]
+
+    if hi_page is not None:
+        conditions.append(
+            sql.SQL("t.ctid < {}::tid").format(sql.Literal(f"({hi_page},0)"))
+        )
+    if row_filter:
+        conditions.append(sql.SQL("({})").format(sql.SQL(row_filter)))
+
+    return sql.SQL(" AND ").join(conditions)
+
+
+def get_keyless_hash_sql(schema_name, table_name, n_buckets, where_clause, cols):
+    """
+    Returns the row count and the sum of the row hashes of every bucket. A sum
+    does not depend on the order rows are read in, so the buckets of each
+    page range can be added up, and compared across nodes, without sorting.
+    """
+    return sql.SQL(
+        "SELECT {bucket}, count(*), sum(hashtextextended({row}, 1)::numeric)"
+        " FROM {table_name} t WHERE {where_clause} GROUP BY 1"
+    ).format(
+        bucket=get_keyless_bucket(n_buckets, cols),
+        row=get_keyless_row(cols),
+        table_name=sql.SQL("{}.{}").format(
+            sql.Identifier(schema_name), sql.Identifier(table_name)
+        ),
+        where_clause=where_clause,
+    )
+
+
+def get_keyless_rows_sql(
+    schema_name, table_name, n_buckets, where_clause, buckets, cols
+):
+    return sql.SQL(
+        "SELECT {bucket}, {select_list} FROM {table_name} t"
+        " WHERE {where_clause} AND {bucket} = ANY({buckets})"
+    ).format(
+        bucket=get_keyless_bucket(n_buckets, cols),
+        select_list=get_select_list(cols, "t"),
+        table_name=sql.SQL("{}.{}").format(
+            sql.Identifier(schema_name), sql.Identifier(table_name)
+        ),
+        where_clause=where_clause,
+        buckets=sql.Literal(list(buckets)),
+    )
+
+
+def get_table_pages(conn_list, p_schema, p_table):
+    """Returns the number of heap pages of the largest copy of a table"""
+    pages = 0
+
+    for conn in conn_list:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT pg_relation_size(format('%%I.%%I', %s::text, %s::text)::regclass)"
+            " / current_setting('block_size')::int",
+            [p_schema, p_table],
+        )
+        pages = max(pages, cur.fetchone()[0])
+        cur.close()
+
+    return pages
+
+
+def hash_keyless_pages(shared_objects, worker_state, lo_page, hi_page):
+    """
+    Hashes the buckets of the rows in a page range on every node. Returns
+    the (count, hash sum) of each bucket keyed by node, or None on error.
+    """
+    where_clause = get_keyless_where(lo_page, hi_page, shared_objects["row_filter"])
+    hash_sql = get_keyless_hash_sql(
+        shared_objects["schema_name"],
+        shared_objects["table_name"],
+        shared_objects["n_buckets"],
+        where_clause,
+        shared_objects["cols_list"],
+    )
+
+    try:
+        results = run_queries(
+            worker_state, {node: hash_sql for node in shared_objects["node_list"]}
+        )
+    except Exception as e:
+        util.message(
+            f"Hash query for pages {lo_page}-{hi_page} failed: {e}", p_state="warning"
+        )
+        return None
+
+    return {
+        node: {bucket: (count, total) for bucket, count, total in rows}
+        for node, rows in results.items()
+    }
+
+
+def fetch_keyless_pages(shared_objects, worker_state, lo_page, hi_page, buckets):
+    """
+    Fetches the rows of some buckets in a page range on every node. Returns
+    the rows of each bucket keyed by node, or None on error.
+    """
+    where_clause = get_keyless_where(lo_page, hi_page, shared_objects["row_filter"])
+    rows_sql = get_keyless_rows_sql(
+        shared_objects["schema_name"],
+        shared_objects["table_name"],
+        shared_objects["n_buckets"],
+        where_clause,
+        buckets,
+        shared_objects["cols_list"],
+    )
+
+    try:
+        results = run_queries(
+            worker_state, {node: rows_sql for node in shared_objects["node_list"]}
+        )
+    except Exception as e:
+        util.message(
+            f"Fetch query for pages {lo_page}-{hi_page} failed: {e}", p_state="warning"
+        )
+        return None
+
+    node_rows = {}
+    for node, rows in results.items():
+        node_rows[node] = {}
+        for row in rows:
+            node_rows[node].setdefault(row[0], []).append(row[1:])
+
+    return node_rows
+
+
+def count_keyless_rows(bucket_counts, node_idx, n_nodes, rows):
+    """
+    Adds the rows fetched from one node to the counts of a bucket's rows on
+    every node. Rows are compared as strings, and a row whose count becomes
+    the same on every node is dropped, so only rows that may be diffs are
+    held while the page ranges are read.
+    """
+    for row in rows:
+        row_key = stringify_row(row)
+        entry = bucket_counts.get(row_key)
+        if entry is None:
+            entry = bucket_counts[row_key] = (row, [0] * n_nodes)
+
+        counts = entry[1]
+        counts[node_idx] += 1
+        if counts.count(counts[0]) == n_nodes:
+            del bucket_counts[row_key]
+
+
+def compare_keyless_buckets(node_list, cols, bucket_counts):
+    """
+    Compares the rows of a bucket as multisets, from their count on every
+    node, so that a row duplicated on one node counts as a diff. Returns the
+    diffs keyed by node pair.
+    """
+    bucket_diffs = {}
+
+    for (idx1, node1), (idx2, node2) in combinations(enumerate(node_list), 2):
+        t1_diff = []
+        t2_diff = []
+
+        for row, counts in bucket_counts.values():
+            surplus = counts[idx1] - counts[idx2]
+            if surplus > 0:
+                t1_diff += [row] * surplus
+            elif surplus < 0:
+                t2_diff += [row] * -surplus
+
+        if t1_diff or t2_diff:
+            bucket_diffs[f"{node1}/{node2}"] = {
+                node1: [dict(zip(cols, row)) for row in t1_diff],
+                node2: [dict(zip(cols, row)) for row in t2_diff],
+            }
+
+    return bucket_diffs
+
+
+def run_keyless_diff(shared_objects, table_objects, pages, procs, diff_writer=None):
+    """
+    Compares a table that has no key. Every node's buckets are hashed over
+    ranges of heap pages in parallel, and summed up per node. The rows of the
+    buckets whose counts or hashes differ are then fetched, again by page
+    range, and compared. Returns the result of every bucket and the diffs,
+    which are appended to diff_writer instead, if given.
+    """
+    node_list = shared_objects["node_list"]
+    pool_objects = {**shared_objects, **table_objects}
+
+    bounds = list(range(0, pages, KEYLESS_RANGE_PAGES)) or [0]
+    page_ranges = list(zip(bounds, bounds[1:] + [None]))
+    n_jobs = max(1, min(procs, len(page_ranges)))
+
+    result = {
+        "block_results": [],
+        "diff_dict": {},
+        "changed_columns": {},
+        "diff_writer": diff_writer,
+    }
+    buckets = {node: {} for node in node_list}
+
+    with WorkerPool(
+        n_jobs=n_jobs, shared_objects=pool_objects, use_worker_state=True
+    ) as pool:
+        for range_buckets in pool.imap_unordered(
+            hash_keyless_pages,
+            page_ranges,
+            worker_init=init_db_connection,
+            worker_exit=close_db_connection,
+            progress_bar=True,
+        ):
+            if range_buckets is None:
+                result["block_results"].append(BLOCK_ERROR)
+                return result
+
+            for node, node_buckets in range_buckets.items():
+                for bucket, (count, total) in node_buckets.items():
+                    prior_count, prior_total = buckets[node].get(bucket, (0, 0))
+                    buckets[node][bucket] = (prior_count + count, prior_total + total)
+
+        mismatched = []
+        fetch_rows = 0
+        for bucket in sorted(set().union(*buckets.values())):
+            node_buckets = [buckets[node].get(bucket, (0, 0)) for node in node_list]
+            if len(set(node_buckets)) == 1:
+                result["block_results"].append(BLOCK_OK)
+                continue
+
+            # A bucket holds at least as many diffs as its counts differ by
+            counts = [count for count, _ in node_buckets]
+            if fetch_rows >= MAX_DIFF_ROWS:
+                result["block_results"].append(MAX_DIFF_EXCEEDED)
+                continue
+            fetch_rows += max(1, max(counts) - min(counts))
+            mismatched.append(bucket)
+
+        if not mismatched:
+            return result
+
+        # Every mismatched bucket's rows are fetched in a single pass
+        n_nodes = len(node_list)
+        bucket_counts = {bucket: {} for bucket in mismatched}
+
+        for range_rows in pool.imap_unordered(
+            fetch_keyless_pages,
+            [(lo, hi, mismatched) for lo, hi in page_ranges],
+            worker_init=init_db_connection,
+            worker_exit=close_db_connection,
+        ):
+            if range_rows is None:
+                result["block_results"].append(BLOCK_ERROR)
+                return result
+
+            for node, node_buckets in range_rows.items():
+                node_idx = node_list.index(node)
+                for bucket, rows in node_buckets.items():
+                    count_keyless_rows(bucket_counts[bucket], node_idx, n_nodes, rows)
+
+    row_diffs = 0
+
+    for bucket in mismatched:
+        if row_diffs >= MAX_DIFF_ROWS:
+            result["block_results"].append(MAX_DIFF_EXCEEDED)
+            continue
+
+        bucket_diffs = compare_keyless_buckets(
+            node_list, table_objects["cols_list"], bucket_counts[bucket]
+        )
+        collect_diffs(result, bucket_diffs)
+        row_diffs += sum(
+            max(len(rows) for rows in pair_diffs.values())
+            for pair_diffs in bucket_diffs.values()
+        )
+        result["block_results"].append(BLOCK_MISMATCH)
+
+    return result
+
+
+def table_diff_keyless(
+    shared_objects,
+    node_conns,
+    schema_name,
+    table_name,
+    cols_list,
+    block_rows,
+    max_cpu_ratio,
+    output,
+    consistent,
+    fence_timeout,
+):
+    """
+    Compares a table that has neither a primary key nor a usable unique
+    index. The diffs found are whole rows: they can be reviewed, but not
+    rerun or repaired.
+    """
+    full_name = f"{schema_name}.{table_name}"
+    conn_list = list(node_conns.values())
+
+    if block_rows == "auto":
+        block_rows = int(BLOCK_ROWS_DEFAULT)
+
+    row_counts = [get_row_count(conn, schema_name, table_name) for conn in conn_list]
+    row_count = max(row_counts)
+    if not row_count:
+        util.message("ALL TABLES ARE EMPTY", p_state="warning")
+        return
+
+    pages = get_table_pages(conn_list, schema_name, table_name)
+    n_buckets = max(1, math.ceil(row_count / block_rows))
+
+    util.message(
+        f"No primary key or usable unique index found for '{full_name}': "
+        f"comparing in keyless mode with {n_buckets} buckets",
+        p_state="warning",
+    )
+
+    if shared_objects["governor"]:
+        util.message(
+            "The load governor does not apply in keyless mode", p_state="warning"
+        )
+
+    cpus = cpu_count()
+    procs = int(cpus * max_cpu_ratio * 2) if cpus > 1 else 1
+    start_time = datetime.now()
 
-            # Collect results into OrderedSets for comparison
-            t1_set = OrderedSet(t1_result)
-            t2_set = OrderedSet(t2_result)
+    table_objects = {
+        "schema_name": schema_name,
+        "table_name": table_name,
+        "cols_list": cols_list,
+        "n_buckets": n_buckets,
+    }
 
-            t1_diff = t1_set - t2_set
-            t2_diff = t2_set - t1_set
+    if consistent:
+        wait_for_lsn_fence(node_conns, fence_timeout)
+        shared_objects["snapshots"] = export_snapshots(node_conns)
 
-            node_pair_key = f"{host1}/{host2}"
+    util.message("Starting jobs to compare tables...\n", p_state="info")
 
-            if node_pair_key not in diff_dict:
-                diff_dict[node_pair_key] = {}
+    diff_writer = open_diffs_binary() if output == "binary" else None
+    result = run_keyless_diff(shared_objects, table_objects, pages, procs, diff_writer)
 
-            with lock:
-                if len(t1_diff) > 0 or len(t2_diff) > 0:
-                    temp_dict = {}
-                    if host1 in diff_dict[node_pair_key]:
-                        temp_dict[host1] = diff_dict[node_pair_key][host1]
-                    else:
-                        temp_dict[host1] = []
-                    if host2 in diff_dict[node_pair_key]:
-                        temp_dict[host2] = diff_dict[node_pair_key][host2]
-                    else:
-                        temp_dict[host2] = []
+    if consistent:
+        for conn in node_conns.values():
+            conn.rollback()
 
-                    temp_dict[host1] += [dict(zip(cols, row)) for row in t1_diff]
-                    temp_dict[host2] += [dict(zip(cols, row)) for row in t2_diff]
+    print("")
 
-                    diff_dict[node_pair_key] = temp_dict
+    diff_meta = {
+        "table": full_name,
+        "key": None,
+        "block_rows": block_rows,
+        "keyless": True,
+    }
+    if shared_objects["row_filter"]:
+        diff_meta["where"] = shared_objects["row_filter"]
 
-            with row_diff_count.get_lock():
-                row_diff_count.value += max(len(t1_diff), len(t2_diff))
+    outcome = report_table_diff(result, diff_meta, output)
 
-            if row_diff_count.value >= MAX_DIFF_ROWS:
-                result_queue.append(MAX_DIFF_EXCEEDED)
-                return
-            else:
-                result_queue.append(BLOCK_MISMATCH)
+    if outcome == "error":
+        util.exit_message(
+            "There were one or more errors while connecting to databases.\n \
+                Please examine the connection information provided, or the nodes' \
+                    status before running this script again."
+        )
 
-        else:
-            result_queue.append(BLOCK_OK)
+    run_time = util.round_timedelta(datetime.now() - start_time).total_seconds()
+
+    print()
+    util.message(
+        f"TOTAL ROWS CHECKED = {sum(row_counts)}\nRUN TIME = {run_time:.2f} seconds",
+        p_state="info",
+    )
 
 
 def table_diff(
@@ -683,22 +5487,60 @@ def table_diff(
     output="json",
     nodes="all",
     diff_file=None,
+    use_mtree=False,
+    rebuild_mtree=False,
+    range_planner=RANGE_PLANNER_DEFAULT,
+    hash_mode=HASH_MODE_DEFAULT,
+    bisect=False,
+    bisect_factor=BISECT_FACTOR_DEFAULT,
+    bisect_leaf_rows=BISECT_LEAF_ROWS_DEFAULT,
+    max_inflight=MAX_INFLIGHT_DEFAULT,
+    consistent=False,
+    fence_timeout=FENCE_TIMEOUT_DEFAULT,
+    compare_engine=COMPARE_ENGINE_DEFAULT,
+    fetch_mode=FETCH_MODE_DEFAULT,
+    target_block_ms=TARGET_BLOCK_MS_DEFAULT,
+    columns=None,
+    exclude_columns=None,
+    where=None,
+    incremental=False,
+    full_interval=INCREMENTAL_FULL_INTERVAL_DEFAULT,
+    sample=0,
+    sample_seed=SAMPLE_SEED_DEFAULT,
+    block_retries=BLOCK_RETRIES_DEFAULT,
+    resume=None,
+    max_queries=GOVERNOR_MAX_QUERIES_DEFAULT,
+    max_active=GOVERNOR_MAX_ACTIVE_DEFAULT,
+    max_lag_bytes=GOVERNOR_MAX_LAG_BYTES_DEFAULT,
+    max_read_mbps=GOVERNOR_MAX_READ_MBPS_DEFAULT,
+    use_replicas=False,
+    replica_timeout=REPLICA_TIMEOUT_DEFAULT,
+    precheck=True,
 ):
     """Efficiently compare tables across cluster using checksums and blocks of rows"""
-    
-    if type(block_rows) is str:
-        try:
-            block_rows = int(block_rows)
-        except Exception:
-            util.exit_message("Invalid values for ACE_BLOCK_ROWS")
-    elif type(block_rows) is not int:
-        util.exit_message("Invalid value type for ACE_BLOCK_ROWS")
-    
-    # Capping max block size here to prevent the hash function from taking forever
-    if block_rows > MAX_ALLOWED_BLOCK_SIZE:
-        util.exit_message(f"Block row size should be <= {MAX_ALLOWED_BLOCK_SIZE}")
-    if block_rows < MIN_ALLOWED_BLOCK_SIZE:
-        util.exit_message(f"Block row size should be >= {MIN_ALLOWED_BLOCK_SIZE}")
+
+    block_rows = check_block_rows(block_rows, hash_mode)
+    max_block_size = get_max_block_size(hash_mode)
+
+    if compare_engine not in COMPARE_ENGINES:
+        util.exit_message(
+            f"Invalid compare engine '{compare_engine}'. "
+            f"Valid values are {', '.join(COMPARE_ENGINES)}"
+        )
+
+    if fetch_mode not in FETCH_MODES:
+        util.exit_message(
+            f"Invalid fetch mode '{fetch_mode}'. "
+            f"Valid values are {', '.join(FETCH_MODES)}"
+        )
+
+    try:
+        target_block_ms = int(target_block_ms)
+    except Exception:
+        util.exit_message("Invalid values for ACE_TARGET_BLOCK_MS")
+
+    if target_block_ms < 1:
+        util.exit_message("Target block time should be >= 1 ms")
 
     if type(max_cpu_ratio) is int:
         max_cpu_ratio = float(max_cpu_ratio)
@@ -713,11 +5555,132 @@ def table_diff(
     if max_cpu_ratio > 1.0 or max_cpu_ratio < 0.0:
         util.exit_message("Invalid value range for ACE_MAX_CPU_RATIO or --max_cpu_ratio")
 
-    if output not in ["csv", "json"]:
+    if output not in DIFF_OUTPUTS:
+        util.exit_message(
+            "table-diff currently supports only csv, json and binary output formats"
+        )
+
+    use_mtree = check_bool_param(use_mtree, "use_mtree")
+    rebuild_mtree = check_bool_param(rebuild_mtree, "rebuild_mtree")
+
+    if range_planner not in RANGE_PLANNERS:
+        util.exit_message(
+            f"Invalid range planner '{range_planner}'. "
+            f"Valid values are {', '.join(RANGE_PLANNERS)}"
+        )
+
+    if where is not None and type(where) is not str:
+        util.exit_message("Invalid value for --where")
+
+    if where and use_mtree:
+        util.exit_message("--where cannot be combined with --use_mtree")
+
+    incremental = check_bool_param(incremental, "incremental")
+
+    try:
+        full_interval = int(full_interval)
+    except Exception:
+        util.exit_message("Invalid values for ACE_INCREMENTAL_FULL_INTERVAL")
+
+    if incremental and (use_mtree or diff_file):
+        util.exit_message(
+            "--incremental cannot be combined with --use_mtree or --diff_file"
+        )
+
+    try:
+        sample = float(sample)
+        sample_seed = int(sample_seed)
+    except Exception:
+        util.exit_message("Invalid values for --sample or ACE_SAMPLE_SEED")
+
+    if sample < 0.0 or sample > 1.0:
+        util.exit_message("Sample ratio should be between 0 and 1")
+
+    if sample and (use_mtree or diff_file or incremental):
+        util.exit_message(
+            "--sample cannot be combined with --use_mtree, --diff_file or --incremental"
+        )
+
+    try:
+        block_retries = int(block_retries)
+    except Exception:
+        util.exit_message("Invalid values for ACE_BLOCK_RETRIES")
+
+    if block_retries < 0:
+        util.exit_message("Block retries should be >= 0")
+
+    if resume is not None:
+        resume = str(resume)
+
+    try:
+        max_queries = int(max_queries)
+        max_active = int(max_active)
+        max_lag_bytes = int(max_lag_bytes)
+        max_read_mbps = float(max_read_mbps)
+    except Exception:
+        util.exit_message(
+            "Invalid values for ACE_GOVERNOR_MAX_QUERIES, ACE_GOVERNOR_MAX_ACTIVE, "
+            "ACE_GOVERNOR_MAX_LAG_BYTES or ACE_GOVERNOR_MAX_READ_MBPS"
+        )
+
+    if min(max_queries, max_active, max_lag_bytes, max_read_mbps) < 0:
+        util.exit_message("Governor budgets should be >= 0")
+
+    # The governor only runs if it has a budget to keep to
+    governor = None
+    if max_queries or max_active or max_lag_bytes or max_read_mbps:
+        governor = {
+            "max_queries": max_queries,
+            "max_active": max_active,
+            "max_lag_bytes": max_lag_bytes,
+            "max_read_mbps": max_read_mbps,
+        }
+
+    if resume and (use_mtree or diff_file or incremental):
         util.exit_message(
-            "table-diff currently supports only csv and json output formats"
+            "--resume cannot be combined with --use_mtree, --diff_file or --incremental"
         )
 
+    bisect = check_bool_param(bisect, "bisect")
+
+    try:
+        bisect_factor = int(bisect_factor)
+        bisect_leaf_rows = int(bisect_leaf_rows)
+    except Exception:
+        util.exit_message("Invalid values for ACE_BISECT_FACTOR or ACE_BISECT_LEAF_ROWS")
+
+    if bisect_factor < 2:
+        util.exit_message("Bisect factor should be >= 2")
+    if bisect_leaf_rows < 1:
+        util.exit_message("Bisect leaf rows should be >= 1")
+
+    try:
+        max_inflight = int(max_inflight)
+    except Exception:
+        util.exit_message("Invalid values for ACE_MAX_INFLIGHT")
+
+    if max_inflight < 1:
+        util.exit_message("Max in-flight queries per node should be >= 1")
+
+    consistent = check_bool_param(consistent, "consistent")
+
+    try:
+        fence_timeout = int(fence_timeout)
+    except Exception:
+        util.exit_message("Invalid values for ACE_FENCE_TIMEOUT")
+
+    use_replicas = check_bool_param(use_replicas, "use_replicas")
+    precheck = check_bool_param(precheck, "precheck")
+
+    try:
+        replica_timeout = int(replica_timeout)
+    except Exception:
+        util.exit_message("Invalid values for ACE_REPLICA_TIMEOUT")
+
+    # Snapshots exported on a node cannot be imported on its replicas
+    if use_replicas and consistent:
+        util.exit_message("--use_replicas cannot be combined with --consistent")
+
     node_list = []
     try:
         node_list = parse_nodes(nodes)
@@ -727,11 +5690,6 @@ def table_diff(
                 E.g., --nodes="n1,n2". Error: {e}'
         )
 
-    if len(node_list) > 3:
-        util.exit_message(
-            "table-diff currently supports up to a three-way table comparison"
-        )
-
     if nodes != "all" and len(node_list) == 1:
         util.exit_message("table-diff needs at least two nodes to compare")
 
@@ -773,6 +5731,7 @@ def table_diff(
                 util.exit_message("Specified nodenames not present in cluster")
 
     conn_list = []
+    node_conns = {}
 
     try:
         for nd in cluster_nodes:
@@ -786,39 +5745,264 @@ def table_diff(
                     password=nd["password"],
                     host=nd["ip_address"],
                     port=nd.get("port", 5432),
+                    **get_session_params(),
                 )
                 conn_list.append(psql_conn)
+                node_conns[nd["name"]] = psql_conn
 
     except Exception as e:
         util.exit_message("Error in table_diff() Getting Connections:" + str(e), 1)
 
     util.message("Connections successful to nodes in cluster", p_state="success")
 
-    cols = None
-    key = None
-
-    for conn in conn_list:
-        curr_cols = get_cols(conn, l_schema, l_table)
-        curr_key = get_key(conn, l_schema, l_table)
+    # Shared variables needed by all workers, whichever table they compare
+    shared_objects = {
+        "cluster_name": cluster_name,
+        "database": database,
+        "node_list": node_list,
+        "hash_mode": hash_mode,
+        "bisect": bisect,
+        "bisect_factor": bisect_factor,
+        "bisect_leaf_rows": bisect_leaf_rows,
+        "max_inflight": max_inflight,
+        "compare_engine": compare_engine,
+        "fetch_mode": fetch_mode,
+        "row_filter": where or None,
+        "block_retries": block_retries,
+        "governor": governor,
+    }
 
-        if not curr_cols:
-            util.exit_message(f"Invalid table name '{table_name}'")
-        if not curr_key:
-            util.exit_message(f"No primary key found for '{table_name}'")
+    if use_replicas:
+        # Blocks are hashed and fetched on the nodes' replicas, once they have
+        # caught up with the nodes, and block sizes are calibrated and the
+        # load governed there too. Tables are still checked and planned on
+        # the nodes themselves.
+        shared_objects["replicas"] = wait_for_replicas(
+            node_conns,
+            get_node_replicas(cluster_name, node_list),
+            database,
+            replica_timeout,
+        )
 
-        if (not cols) and (not key):
-            cols = curr_cols
-            key = curr_key
-            continue
+    if any(c in table_name for c in "*?["):
+        if use_mtree or diff_file or resume:
+            util.exit_message(
+                "--use_mtree, --diff_file and --resume cannot be used with a table glob"
+            )
+        if columns or exclude_columns or incremental:
+            util.exit_message(
+                "--columns, --exclude_columns and --incremental cannot be used "
+                "with a table glob"
+            )
 
-        if (curr_cols != cols) or (curr_key != key):
-            util.exit_message("Table schemas don't match")
+        tables = resolve_table_glob(conn_list[0], table_name)
+        if not tables:
+            util.exit_message(f"No tables match '{table_name}'")
+
+        diff_tables(
+            shared_objects,
+            node_conns,
+            tables,
+            block_rows,
+            max_cpu_ratio,
+            output,
+            range_planner,
+            consistent,
+            fence_timeout,
+            target_block_ms,
+            sample,
+            sample_seed,
+            precheck,
+        )
+        return
 
-        cols = curr_cols
-        key = curr_key
+    cols, key, error = get_table_meta(conn_list, l_schema, l_table, keyless_ok=True)
+    if error:
+        util.exit_message(error)
 
     util.message(f"Table {table_name} is comparable across nodes", p_state="success")
 
+    cols_list = cols.split(",")
+    cols_list = [col for col in cols_list if not col.startswith("_Spock_")]
+
+    if not key:
+        if use_mtree or diff_file or incremental or sample or resume:
+            util.exit_message(
+                "--use_mtree, --diff_file, --incremental, --sample and --resume "
+                "need a primary key or unique index"
+            )
+        if columns or exclude_columns:
+            util.exit_message(
+                "--columns and --exclude_columns need a primary key or unique index"
+            )
+
+        table_diff_keyless(
+            shared_objects,
+            node_conns,
+            l_schema,
+            l_table,
+            cols_list,
+            block_rows,
+            max_cpu_ratio,
+            output,
+            consistent,
+            fence_timeout,
+        )
+        return
+
+    if not get_key(conn_list[0], l_schema, l_table, unique_fallback=False):
+        _, index_name = get_unique_key(conn_list[0], l_schema, l_table)
+        util.message(
+            f"No primary key found for '{table_name}': comparing by unique "
+            f"index {index_name} ({key})",
+            p_state="info",
+        )
+
+    """
+    A partitioned table is diffed partition by partition, like a table glob:
+    every leaf partition is planned on its own and its blocks are hashed on
+    the partition directly, so no block query goes through partition routing
+    or has to merge rows from several partitions.
+    """
+    partitions, other_leaves = get_leaf_partitions(conn_list, l_schema, l_table)
+    whole_table = (
+        use_mtree or diff_file or incremental or resume or columns or exclude_columns
+    )
+
+    if other_leaves and not whole_table:
+        util.exit_message(
+            f"{table_name} has partitions that are not plain tables and cannot "
+            f"be diffed on their own: {', '.join(other_leaves)}"
+        )
+
+    if (partitions or other_leaves) and whole_table:
+        util.message(
+            f"{table_name} is partitioned, but --use_mtree, --diff_file, "
+            "--incremental, --resume, --columns and --exclude_columns only apply "
+            "to whole tables: diffing it as a whole",
+            p_state="warning",
+        )
+    elif partitions:
+        util.message(
+            f"{table_name} is partitioned: diffing its {len(partitions)} "
+            "partitions",
+            p_state="info",
+        )
+        diff_tables(
+            shared_objects,
+            node_conns,
+            partitions,
+            block_rows,
+            max_cpu_ratio,
+            output,
+            range_planner,
+            consistent,
+            fence_timeout,
+            target_block_ms,
+            sample,
+            sample_seed,
+            precheck,
+        )
+        return
+
+    # Only the projected columns are hashed, fetched and compared
+    projection = get_projection(cols_list, key, columns, exclude_columns)
+    mtree_cols = ",".join(projection) if projection else cols
+
+    """
+    Every job that plans its own blocks is journaled, so that it can be
+    resumed from the blocks that did not complete. A job is resumed with the
+    options it was started with, and compares the blocks it planned then.
+    """
+    journal_store = None
+    job = None
+    job_id = None
+    job_params = {
+        "nodes": sorted(node_list),
+        "block_rows": block_rows,
+        "columns": projection,
+        "where": where or None,
+        "hash_mode": hash_mode,
+        "compare_engine": compare_engine,
+        "sample": sample,
+        "sample_seed": sample_seed,
+    }
+
+    if not (use_mtree or diff_file or incremental):
+        journal_store = get_job_journal()
+
+    if resume:
+        job = journal_load(journal_store, resume)
+        if not job:
+            util.exit_message(f"No job '{resume}' found in the journal")
+
+        if (
+            job["cluster"] != cluster_name
+            or job["table"] != table_name
+            or job["params"] != job_params
+        ):
+            util.exit_message(
+                f"Job {resume} was started with different options. Please rerun "
+                "with the same table, nodes, columns, filter, block size, hash "
+                "mode, compare engine and sample"
+            )
+
+        job_id = resume
+
+    watermark = None
+    watermark_store = None
+    commit_ts_filter = None
+    touched_keys = None
+
+    if incremental:
+        """
+        Only compare the rows committed since the last run that matched, unless
+        there is no such run yet or the last full diff is too old. A mismatch
+        leaves the watermark where it is, so those rows are compared again.
+        """
+        watermark_store = get_watermark_store()
+        watermark = watermark_load(
+            watermark_store, cluster_name, table_name, mtree_cols, where
+        )
+        run_watermark = get_run_watermark(node_conns)
+
+        if watermark and (
+            datetime.fromisoformat(run_watermark)
+            - datetime.fromisoformat(watermark["last_full"])
+        ).total_seconds() >= full_interval:
+            util.message(
+                f"Last full diff of {table_name} was at {watermark['last_full']}: "
+                "running a full diff",
+                p_state="info",
+            )
+            watermark = None
+        elif watermark and not keys_match(node_conns, l_schema, l_table, key, where):
+            util.message(
+                f"The nodes hold different keys of {table_name}: "
+                "running a full diff",
+                p_state="info",
+            )
+            watermark = None
+        elif watermark:
+            commit_ts_filter = get_commit_ts_filter(node_conns, watermark["watermark"])
+            touched_keys = get_touched_keys(
+                node_conns,
+                l_schema,
+                l_table,
+                key,
+                f"({where}) AND {commit_ts_filter}" if where else commit_ts_filter,
+            )
+            util.message(
+                f"Comparing the {len(touched_keys)} rows committed after "
+                f"{watermark['watermark']}",
+                p_state="info",
+            )
+        else:
+            util.message(
+                f"No watermark for {table_name}: running a full diff",
+                p_state="info",
+            )
+
     simple_primary_key = True
     if len(key.split(",")) > 1:
         simple_primary_key = False
@@ -830,15 +6014,61 @@ def table_diff(
     diff_json = None
     conn_with_max_rows = None
 
-    if not diff_file:
+    mtree = None
+    mtree_store = None
+
+    if use_mtree:
+        if diff_file:
+            util.exit_message("--use_mtree cannot be combined with --diff_file")
+
+        mtree_store = get_mtree_store()
+        if not rebuild_mtree:
+            mtree = mtree_load(
+                mtree_store, cluster_name, table_name, key, mtree_cols, hash_mode
+            )
+
+        if mtree:
+            block_rows = mtree["block_rows"]
+            util.message(
+                f"Reusing Merkle tree of {len(mtree['offsets'])} blocks"
+                f" for {table_name}",
+                p_state="info",
+            )
+
+            # The leaves of nodes left out of this run would no longer match
+            # the block plan once it is split
+            if set(mtree["leaves"]) <= set(node_list):
+                mtree_split_tail(
+                    conn_list, l_schema, l_table, key, simple_primary_key, mtree
+                )
+
+    if touched_keys is not None:
+        # Only the touched keys are compared, and only they are counted
+        conn_with_max_rows = conn_list[0]
+        row_count = len(touched_keys)
+        total_rows = row_count * len(conn_list)
+    elif not diff_file and not mtree:
         for conn in conn_list:
-            rows = get_row_count(conn, l_schema, l_table)
+            if sample:
+                rows = get_row_estimate(conn, l_schema, l_table)
+            else:
+                rows = get_row_count(conn, l_schema, l_table)
             total_rows += rows
             if rows > row_count:
                 row_count = rows
                 conn_with_max_rows = conn
-    else:
-        diff_json = json.loads(open(diff_file, "r").read())
+    elif diff_file:
+        # The diff files table-diff writes out, JSON or binary (.acediff),
+        # hold rows rather than block offsets: table-rerun rechecks those
+        if is_diff_binary(diff_file):
+            diff_json = {}
+        else:
+            diff_json = json.loads(open(diff_file, "r").read())
+        if "block_size" not in diff_json:
+            util.exit_message(
+                f"{diff_file} holds the rows of a table-diff, which --diff_file "
+                "cannot read. Please use table-rerun to recheck them"
+            )
         block_rows = diff_json["block_size"]
 
         for diff in diff_json["diffs"]:
@@ -849,74 +6079,152 @@ def table_diff(
 
     pkey_offsets = []
 
-    if not conn_with_max_rows:
+    if not conn_with_max_rows and not mtree:
         util.message(
             "ALL TABLES ARE EMPTY",
             p_state="warning",
         )
         return
 
-    # Use conn_with_max_rows to get the first and last primary key values
-    # of every block row. Repeat until we no longer have any more rows.
-    # Store results in pkey_offsets.
-
-    if simple_primary_key:
-        pkey_sql = sql.SQL("SELECT {key} FROM {table_name} ORDER BY {key}").format(
-            key=sql.Identifier(key),
-            table_name=sql.SQL("{}.{}").format(
-                sql.Identifier(l_schema), sql.Identifier(l_table)
-            ),
+    adaptive = None
+    plan_rows = block_rows
+
+    if job:
+        block_rows = job["block_rows"]
+        plan_rows = block_rows
+
+    if block_rows == "auto":
+        calibration_conns = get_calibration_conns(shared_objects, node_conns)
+        block_rows, row_ms = calibrate_block_rows(
+            calibration_conns,
+            conn_with_max_rows,
+            l_schema,
+            l_table,
+            key,
+            hash_mode,
+            target_block_ms,
+            max_block_size,
+            projection,
+            shared_objects["row_filter"],
+        )
+        close_calibration_conns(calibration_conns, node_conns)
+        util.message(
+            f"Calibrated block size: {block_rows} rows"
+            f" ({row_ms * 1000:.1f} us per row)",
+            p_state="info",
+        )
+        plan_rows = block_rows
+
+        # A Merkle tree keeps the block plan it is built with, and sampled
+        # and touched key ranges are not contiguous and cannot be coalesced
+        if not use_mtree and not sample and touched_keys is None:
+            adaptive = {
+                table_name: new_adaptive_state(
+                    block_rows, row_ms, target_block_ms, max_block_size
+                )
+            }
+            plan_rows = adaptive[table_name]["base_rows"]
+
+    # Use conn_with_max_rows to plan the first and last primary key values
+    # of every block. Store results in pkey_offsets.
+
+    if mtree:
+        pkey_offsets = mtree["offsets"]
+    elif job:
+        pkey_offsets = [(start, end) for start, end, _ in job["blocks"]]
+    elif touched_keys is not None:
+        pkey_offsets = plan_touched_ranges(
+            conn_with_max_rows, l_schema, l_table, key, touched_keys, plan_rows
         )
     else:
-        pkey_sql = sql.SQL("SELECT {key} FROM {table_name} ORDER BY {key}").format(
-            key=sql.SQL(", ").join([sql.Identifier(col) for col in key.split(",")]),
-            table_name=sql.SQL("{}.{}").format(
-                sql.Identifier(l_schema), sql.Identifier(l_table)
-            ),
+        future = ThreadPoolExecutor().submit(
+            plan_key_ranges,
+            conn_with_max_rows,
+            l_schema,
+            l_table,
+            key,
+            plan_rows,
+            simple_primary_key,
+            range_planner,
+            shared_objects["row_filter"],
+        )
+        pkey_offsets = future.result()
+
+    sample_meta = None
+    if job:
+        sample_meta = job["sample"]
+    elif sample:
+        sample_meta = {
+            "ratio": sample,
+            "seed": sample_seed,
+            "total_blocks": len(pkey_offsets),
+        }
+        pkey_offsets = sample_key_ranges(pkey_offsets, sample, sample_seed, table_name)
+        sample_meta["blocks"] = len(pkey_offsets)
+        util.message(
+            f"Sampling {len(pkey_offsets)} of {sample_meta['total_blocks']} blocks",
+            p_state="info",
         )
 
-    def get_pkey_offsets(conn, pkey_sql, block_rows):
-        pkey_offsets = []
-        cur = conn.cursor()
-        cur.execute(pkey_sql)
-        rows = cur.fetchmany(block_rows)
-
-        if simple_primary_key:
-            rows[:] = [str(x[0]) for x in rows]
-            pkey_offsets.append((None, str(rows[0])))
-            prev_min_offset = str(rows[0])
-            prev_max_offset = str(rows[-1])
-        else:
-            rows[:] = [tuple(str(i) for i in x) for x in rows]
-            pkey_offsets.append((None, rows[0]))
-            prev_min_offset = rows[0]
-            prev_max_offset = rows[-1]
-
-        while rows:
-            rows = cur.fetchmany(block_rows)
-            if simple_primary_key:
-                rows[:] = [str(x[0]) for x in rows]
-            else:
-                rows[:] = [tuple(str(i) for i in x) for x in rows]
-
-            if not rows:
-                if prev_max_offset != prev_min_offset:
-                    pkey_offsets.append((prev_min_offset, prev_max_offset))
-                pkey_offsets.append((prev_max_offset, None))
-                break
+    if use_mtree and not mtree:
+        mtree = mtree_save_plan(
+            mtree_store,
+            cluster_name,
+            table_name,
+            key,
+            mtree_cols,
+            block_rows,
+            hash_mode,
+            pkey_offsets,
+        )
 
-            curr_min_offset = rows[0]
-            pkey_offsets.append((prev_min_offset, curr_min_offset))
-            prev_min_offset = curr_min_offset
-            prev_max_offset = rows[-1]
+    journal = None
+    if journal_store:
+        if not job:
+            job_id = journal_start(
+                journal_store,
+                cluster_name,
+                table_name,
+                job_params,
+                block_rows,
+                sample_meta,
+                pkey_offsets,
+            )
 
-        cur.close()
-        return pkey_offsets
+        # Compared blocks are journaled against the planned key ranges they
+        # start and end with
+        journal = {
+            "store": journal_store,
+            "job_id": job_id,
+            "ranges": {
+                table_name: (
+                    {mtree_encode_offset(r[0]): i for i, r in enumerate(pkey_offsets)},
+                    {mtree_encode_offset(r[1]): i for i, r in enumerate(pkey_offsets)},
+                )
+            },
+        }
+        util.message(f"Journaling job {job_id}", p_state="info")
+
+    done_results = []
+    if job:
+        done_results = [
+            status
+            for _, _, status in job["blocks"]
+            if status not in (None, BLOCK_ERROR)
+        ]
+        pkey_offsets = [
+            (start, end)
+            for start, end, status in job["blocks"]
+            if status in (None, BLOCK_ERROR)
+        ]
+        util.message(
+            f"Resuming job {job_id}: {len(pkey_offsets)} of {len(job['blocks'])}"
+            " blocks left to compare",
+            p_state="info",
+        )
 
-    future = ThreadPoolExecutor().submit(
-        get_pkey_offsets, conn_with_max_rows, pkey_sql, block_rows
-    )
-    pkey_offsets = future.result()
+    if mtree:
+        row_count = block_rows * len(pkey_offsets)
 
     total_blocks = row_count // block_rows
     total_blocks = total_blocks if total_blocks > 0 else 1
@@ -926,6 +6234,9 @@ def table_diff(
     # If we don't have enough blocks to keep all CPUs busy, use fewer processes
     procs = max_procs if total_blocks > max_procs else total_blocks
 
+    # Each worker holds a connection to every node
+    if adaptive:
+        procs = min(procs, get_node_headroom(node_conns))
     start_time = datetime.now()
 
     """
@@ -936,123 +6247,211 @@ def table_diff(
     if not diff_file:
         offsets = [x for x in range(0, row_count + 1, block_rows)]
 
-    cols_list = cols.split(",")
-    cols_list = [col for col in cols_list if not col.startswith("_Spock_")]
-
-    # Shared variables needed by all workers
-    shared_objects = {
-        "cluster_name": cluster_name,
-        "database": database,
-        "node_list": node_list,
+    # Shared variables needed by the workers comparing this table
+    table_objects = {
         "schema_name": l_schema,
         "table_name": l_table,
-        "cols_list": cols_list,
+        "cols_list": projection or cols_list,
+        "columns": projection,
         "p_key": key,
         "block_rows": block_rows,
         "simple_primary_key": simple_primary_key,
+        "counters": new_diff_counters(),
     }
 
+    if fetch_mode == "copy":
+        # Binary COPY rows are decoded with the loaders for the column types
+        set_copy_col_types(table_objects, conn_list[0], l_schema, l_table, projection)
+
+    if job:
+        # Diffs found before the job was resumed count towards MAX_DIFF_ROWS
+        table_objects["counters"]["row_diffs"].value = sum(
+            max(len(rows) for rows in pair_diffs.values())
+            for diffs, _ in job["diffs"]
+            for pair_diffs in diffs.values()
+        )
+
+    if consistent:
+        """
+        Compare every node at a single, replication-consistent point: wait
+        until all nodes have applied each other's changes up to a common LSN
+        fence, then have all workers read a snapshot exported per node.
+        """
+        wait_for_lsn_fence(node_conns, fence_timeout)
+        shared_objects["snapshots"] = export_snapshots(node_conns)
+
     print("")
-    util.message("Starting jobs to compare tables...\n", p_state="info")
 
-    with WorkerPool(
-        n_jobs=procs,
-        shared_objects=shared_objects,
-        use_worker_state=True,
-    ) as pool:
-        pool.map_unordered(
-            compare_checksums,
-            pkey_offsets,
-            worker_init=init_db_connection,
-            progress_bar=True,
-            iterable_len=len(pkey_offsets),
+    if mtree:
+        """
+        Bring every node's tree up to date, re-hashing only the dirty leaves,
+        and then walk the trees of each node pair down from the root. Only the
+        blocks under the leaves that differ need to be compared row by row.
+        """
+        levels = mtree_refresh(
+            {**shared_objects, **table_objects}, mtree_store, mtree, node_conns, procs
         )
 
-    mismatch = False
-    diffs_exceeded = False
-    errors = False
+        total_rows = row_count * len(node_list)
 
-    for result in result_queue:
-        if result == MAX_DIFF_EXCEEDED:
-            diffs_exceeded = True
+        diff_leaves = set()
+        for node1, node2 in combinations(node_list, 2):
+            diff_leaves.update(mtree_diff_leaves(levels[node1], levels[node2]))
 
-        if result == BLOCK_MISMATCH or result == MAX_DIFF_EXCEEDED:
-            mismatch = True
+        pkey_offsets = [pkey_offsets[i] for i in sorted(diff_leaves)]
+        procs = max(1, min(procs, len(pkey_offsets)))
 
-        if result == BLOCK_ERROR:
-            errors = True
+    # Binary diffs are written out as they are found
+    diff_writers = None
+    if output == "binary":
+        diff_writers = {table_name: open_diffs_binary(key)}
 
-    print("")
+    util.message("Starting jobs to compare tables...\n", p_state="info")
 
-    if errors:
-        util.exit_message(
-            "There were one or more errors while connecting to databases.\n \
-                Please examine the connection information provided, or the nodes' \
-                    status before running this script again."
-        )
+    results = run_table_diffs(
+        shared_objects,
+        {table_name: (table_objects, pkey_offsets)},
+        procs,
+        adaptive,
+        journal,
+        diff_writers,
+    )
 
-    # Mismatch is True if there is a block mismatch or if we have
-    # estimated that diffs may be greater than max allowed diffs
-    if mismatch:
-        if diffs_exceeded:
-            util.message(
-                f"TABLES DO NOT MATCH. DIFFS HAVE EXCEEDED {MAX_DIFF_ROWS} ROWS",
-                p_state="warning",
-            )
+    if job:
+        # Blocks that completed before the job was resumed are reported too
+        result = {
+            "block_results": done_results,
+            "diff_dict": {},
+            "changed_columns": {},
+            "diff_writer": results[table_name]["diff_writer"],
+        }
+        for diffs, changes in job["diffs"] + [
+            (results[table_name]["diff_dict"], results[table_name]["changed_columns"])
+        ]:
+            collect_diffs(result, diffs, changes)
+        result["block_results"] += results[table_name]["block_results"]
+        results[table_name] = result
+
+    if consistent:
+        # The snapshots are no longer needed once the workers are done
+        for conn in node_conns.values():
+            conn.rollback()
 
-        else:
-            util.message("TABLES DO NOT MATCH", p_state="warning")
+    print("")
 
-        """
-        Read the result queue and count differences between each node pair
-        in the cluster
-        """
+    diff_meta = {
+        "table": table_name,
+        "key": key,
+        "block_rows": block_rows,
+        "hash_mode": hash_mode,
+        "compare_engine": compare_engine,
+    }
 
-        for node_pair in diff_dict.keys():
-            node1, node2 = node_pair.split("/")
-            diff_count = max(
-                len(diff_dict[node_pair][node1]), len(diff_dict[node_pair][node2])
-            )
-            util.message(
-                f"FOUND {diff_count} DIFFS BETWEEN {node1} AND {node2}",
-                p_state="warning",
-            )
+    # Repair and rerun work on the same columns and rows
+    if projection:
+        diff_meta["columns"] = projection
+    if where:
+        diff_meta["where"] = where
+    if commit_ts_filter:
+        diff_meta["watermark"] = watermark["watermark"]
+    if sample_meta:
+        diff_meta["sample"] = sample_meta
 
-        print()
+    outcome = report_table_diff(results[table_name], diff_meta, output)
 
-        if output == "json":
-            write_diffs_json(block_rows)
+    if outcome == "error" and journal:
+        util.message(
+            f"Job {job_id} did not complete: resume it with --resume={job_id}",
+            p_state="warning",
+        )
+    elif journal:
+        journal_delete(journal_store, job_id)
 
-        elif output == "csv":
-            write_diffs_csv()
+    if outcome == "error":
+        util.exit_message(
+            "There were one or more errors while connecting to databases.\n \
+                Please examine the connection information provided, or the nodes' \
+                    status before running this script again."
+        )
 
-    else:
-        util.message("TABLES MATCH OK\n", p_state="success")
+    if incremental and outcome == "match":
+        watermark_save(
+            watermark_store,
+            cluster_name,
+            table_name,
+            mtree_cols,
+            where,
+            run_watermark,
+            watermark["last_full"] if watermark else run_watermark,
+        )
+        util.message(
+            f"Watermark of {table_name} advanced to {run_watermark}",
+            p_state="info",
+        )
+    elif incremental:
+        util.message(
+            f"Watermark of {table_name} left at "
+            f"{watermark['watermark'] if watermark else 'none'} until the "
+            "differences are resolved",
+            p_state="warning",
+        )
 
     run_time = util.round_timedelta(datetime.now() - start_time).total_seconds()
     run_time_str = f"{run_time:.2f}"
 
     print()
 
+    if sample_meta:
+        report_sample(results[table_name], sample_meta)
+
     util.message(
         f"TOTAL ROWS CHECKED = {total_rows}\nRUN TIME = {run_time_str} seconds",
         p_state="info",
     )
 
+    if adaptive:
+        state = adaptive[table_name]
+        util.message(
+            f"FINAL BLOCK SIZE = {state['coalesce'] * state['base_rows']} rows\n"
+            f"FINAL CONCURRENCY = {state.get('workers', procs)} of {procs} workers",
+            p_state="info",
+        )
 
-def write_diffs_json(block_rows):
-    dirname = datetime.now().astimezone(None).strftime("%Y-%m-%d_%H:%M:%S")
+    if governor:
+        util.message(
+            f"GOVERNOR THROTTLED {governor['throttled']} OF {governor['samples']} "
+            f"SAMPLES (MIN WORKERS = {governor.get('min_cap', procs)}, "
+            f"MAX PAUSE = {governor.get('max_pace_ms', 0)} ms)",
+            p_state="info",
+        )
 
-    if not os.path.exists("diffs"):
-        os.mkdir("diffs")
+    counters = table_objects["counters"]
+    if bisect and outcome == "mismatch":
+        util.message(
+            f"BISECTION HASH QUERIES = {counters['bisect_queries'].value}\n"
+            f"ROWS NOT FETCHED = {counters['bisect_rows_saved'].value}\n"
+            "BYTES NOT FETCHED = "
+            f"{util.get_file_size(counters['bisect_bytes_saved'].value)}",
+            p_state="info",
+        )
 
-    dirname = os.path.join("diffs", dirname)
-    os.mkdir(dirname)
+
+def write_diffs_json(diff_dict, block_rows, diff_meta=None, dirname=None):
+    if not dirname:
+        dirname = os.path.join(
+            "diffs", datetime.now().astimezone(None).strftime("%Y-%m-%d_%H:%M:%S")
+        )
+
+    os.makedirs(dirname)
 
     filename = os.path.join(dirname, "diff.json")
 
+    diff_out = dict(diff_dict)
+    if diff_meta:
+        diff_out[DIFF_META_KEY] = diff_meta
+
     with open(filename, "w") as f:
-        f.write(json.dumps(dict(diff_dict), default=str))
+        f.write(json.dumps(diff_out, default=str))
 
     util.message(
         f"Diffs written out to" f" {util.set_colour(filename, 'blue')}",
@@ -1061,16 +6460,15 @@ def write_diffs_json(block_rows):
 
 
 # TODO: Come up with better naming convention for diff files
-def write_diffs_csv():
+def write_diffs_csv(diff_dict, dirname=None):
     import pandas as pd
 
-    dirname = datetime.now().astimezone(None).strftime("%Y-%m-%d_%H:%M:%S")
-
-    if not os.path.exists("diffs"):
-        os.mkdir("diffs")
+    if not dirname:
+        dirname = os.path.join(
+            "diffs", datetime.now().astimezone(None).strftime("%Y-%m-%d_%H:%M:%S")
+        )
 
-    dirname = os.path.join("diffs", dirname)
-    os.mkdir(dirname)
+    os.makedirs(dirname)
 
     for node_pair in diff_dict.keys():
         node1, node2 = node_pair.split("/")
@@ -1104,9 +6502,470 @@ def write_diffs_csv():
         )
 
 
-def table_rerun(cluster_name, diff_file, table_name, dbname=None):
+def get_diff_codec(codec=None):
+    """
+    Returns the id, compressor and decompressor of the codec for binary diff
+    files. New files are compressed with zstd if the zstandard module is
+    installed, and with zlib otherwise.
+    """
+    if codec in (None, DIFF_CODEC_ZSTD):
+        try:
+            import zstandard
+
+            return (
+                DIFF_CODEC_ZSTD,
+                zstandard.ZstdCompressor().compress,
+                zstandard.ZstdDecompressor().decompress,
+            )
+        except ImportError:
+            if codec:
+                util.exit_message(
+                    "Diff file is zstd-compressed. "
+                    "Please install the zstandard module to read it"
+                )
+
+    if codec in (None, DIFF_CODEC_ZLIB):
+        return DIFF_CODEC_ZLIB, zlib.compress, zlib.decompress
+
+    util.exit_message(f"Unknown codec {codec} in diff file")
+
+
+def open_diff_writer(filename, p_key=None):
+    codec, compress, _ = get_diff_codec()
+
+    f = open(filename, "wb")
+    f.write(DIFF_BINARY_MAGIC + bytes([codec]))
+
+    return {
+        "file": f,
+        "compress": compress,
+        "key_cols": p_key.split(",") if p_key else None,
+        "pairs": [],
+        "chunks": [],
+    }
+
+
+def write_diff_block(writer, data, encode=None):
+    if encode:
+        data = encode(data)
+    else:
+        data = json.dumps(data, default=str).encode()
+
+    payload = writer["compress"](data)
+    offset = writer["file"].tell()
+    writer["file"].write(payload)
+
+    return offset, len(payload)
+
+
+def get_diff_column_type(values):
+    present = [v for v in values if v is not None]
+
+    if not present:
+        return "text"
+    if all(isinstance(v, bool) for v in present):
+        return "bool"
+    if all(
+        isinstance(v, int) and not isinstance(v, bool) and -(2**63) <= v < 2**63
+        for v in present
+    ):
+        return "int"
+    if all(isinstance(v, float) for v in present):
+        return "float"
+    if all(isinstance(v, (dict, list)) for v in present):
+        return "json"
+
+    return "text"
+
+
+def encode_diff_columns(data):
+    """
+    Encodes the columns of a chunk of diff rows with the type of their
+    values. Values of other types, such as numerics and timestamps, are
+    stored as text, as they are in JSON diff files.
+    """
+    n_rows = len(data["values"][0]) if data["values"] else 0
+    types = []
+    parts = []
+
+    for values in data["values"]:
+        col_type = get_diff_column_type(values)
+        types.append(col_type)
+        parts.append(bytes(v is None for v in values))
+
+        if col_type == "bool":
+            parts.append(bytes(bool(v) for v in values))
+        elif col_type in ("int", "float"):
+            fmt = "q" if col_type == "int" else "d"
+            parts.append(
+                struct.pack(f"<{n_rows}{fmt}", *[v or 0 for v in values])
+            )
+        else:
+            encoded = [
+                b""
+                if v is None
+                else (
+                    json.dumps(v, default=str) if col_type == "json" else str(v)
+                ).encode()
+                for v in values
+            ]
+            parts.append(struct.pack(f"<{n_rows}I", *[len(v) for v in encoded]))
+            parts += encoded
+
+    header = json.dumps(
+        {"cols": data["cols"], "rows": n_rows, "types": types}
+    ).encode()
+
+    return struct.pack("<I", len(header)) + header + b"".join(parts)
+
+
+def decode_diff_columns(buf):
+    """Decodes a chunk written by encode_diff_columns into its columns"""
+    header_len = struct.unpack_from("<I", buf, 0)[0]
+    header = json.loads(buf[4 : 4 + header_len])
+    n_rows = header["rows"]
+    pos = 4 + header_len
+    values = []
+
+    for col_type in header["types"]:
+        nulls = buf[pos : pos + n_rows]
+        pos += n_rows
+
+        if col_type == "bool":
+            col = [bool(b) for b in buf[pos : pos + n_rows]]
+            pos += n_rows
+        elif col_type in ("int", "float"):
+            fmt = "q" if col_type == "int" else "d"
+            col = list(struct.unpack_from(f"<{n_rows}{fmt}", buf, pos))
+            pos += 8 * n_rows
+        else:
+            lengths = struct.unpack_from(f"<{n_rows}I", buf, pos)
+            pos += 4 * n_rows
+            col = []
+            for null, length in zip(nulls, lengths):
+                value = None if null else buf[pos : pos + length].decode()
+                if value is not None and col_type == "json":
+                    value = json.loads(value)
+                col.append(value)
+                pos += length
+
+        values.append([None if null else v for null, v in zip(nulls, col)])
+
+    return {"cols": header["cols"], "values": values}
+
+
+def write_diff_rows(writer, node_pair, node, rows):
+    """
+    Appends the diffs of one node of a node pair to a binary diff file, in
+    chunks of DIFF_CHUNK_ROWS rows.
+    """
+    if node_pair not in writer["pairs"]:
+        writer["pairs"].append(node_pair)
+
+    for i in range(0, len(rows), DIFF_CHUNK_ROWS):
+        rows_chunk = rows[i : i + DIFF_CHUNK_ROWS]
+        chunk_cols = list(rows_chunk[0].keys())
+        values = [[row.get(col) for row in rows_chunk] for col in chunk_cols]
+
+        offset, length = write_diff_block(
+            writer, {"cols": chunk_cols, "values": values}, encode_diff_columns
+        )
+        chunk = {
+            "pair": node_pair,
+            "node": node,
+            "rows": len(rows_chunk),
+            "offset": offset,
+            "length": length,
+        }
+
+        if writer["key_cols"]:
+            keys = [[str(row[col]) for col in writer["key_cols"]] for row in rows_chunk]
+            chunk["key_offset"], chunk["key_length"] = write_diff_block(writer, keys)
+
+        writer["chunks"].append(chunk)
+
+
+def close_diff_writer(writer, diff_meta=None):
+    footer = {
+        "meta": diff_meta or {},
+        "chunk_format": DIFF_CHUNK_FORMAT,
+        "key": ",".join(writer["key_cols"]) if writer["key_cols"] else None,
+        "pairs": writer["pairs"],
+        "chunks": writer["chunks"],
+    }
+    offset, _ = write_diff_block(writer, footer)
+
+    writer["file"].write(struct.pack(">Q", offset) + DIFF_BINARY_MAGIC)
+    writer["file"].close()
+
+
+def write_diff_binary_file(filename, diff_dict, diff_meta=None, p_key=None):
+    writer = open_diff_writer(filename, p_key)
+
+    for node_pair in diff_dict.keys():
+        for node in node_pair.split("/"):
+            write_diff_rows(writer, node_pair, node, diff_dict[node_pair][node])
+
+    close_diff_writer(writer, diff_meta)
+
+
+def open_diffs_binary(p_key=None, dirname=None):
+    """
+    Opens the binary diff file of a table before its blocks are compared.
+    The diffs of every batch are appended to it as the batch completes (see
+    append_diffs()), so at most DIFF_CHUNK_ROWS rows of each node of a node
+    pair are held in memory, however many diffs are found.
+    """
+    if not dirname:
+        dirname = os.path.join(
+            "diffs", datetime.now().astimezone(None).strftime("%Y-%m-%d_%H:%M:%S")
+        )
+
+    os.makedirs(dirname, exist_ok=True)
+
+    filename = os.path.join(dirname, "diff.acediff")
+    writer = open_diff_writer(filename, p_key)
+    writer.update(filename=filename, dirname=dirname, buffers={}, counts={})
+
+    return writer
+
+
+def append_diffs(writer, diffs):
+    """
+    Appends the diffs found in a block or batch to a binary diff file, and
+    counts them. Rows are buffered until a whole chunk can be written.
+    """
+    for node_pair, node_diffs in diffs.items():
+        if node_pair not in writer["pairs"]:
+            writer["pairs"].append(node_pair)
+
+        counts = writer["counts"].setdefault(
+            node_pair, {node: 0 for node in node_pair.split("/")}
+        )
+        for node, rows in node_diffs.items():
+            counts[node] += len(rows)
+
+            buffer = writer["buffers"].setdefault((node_pair, node), [])
+            buffer += rows
+            if len(buffer) >= DIFF_CHUNK_ROWS:
+                write_diff_rows(writer, node_pair, node, buffer)
+                buffer.clear()
+
+
+def finish_diffs_binary(writer, diff_meta=None, keep=True):
+    """
+    Writes out the diffs still buffered and the footer of a binary diff
+    file, or removes the file if there are no diffs to keep
+    """
+    if not keep:
+        writer["file"].close()
+        os.remove(writer["filename"])
+        try:
+            os.removedirs(writer["dirname"])
+        except OSError:
+            pass
+        return
+
+    for (node_pair, node), rows in writer["buffers"].items():
+        if rows:
+            write_diff_rows(writer, node_pair, node, rows)
+
+    close_diff_writer(writer, diff_meta)
+
+    util.message(
+        f"Diffs written out to" f" {util.set_colour(writer['filename'], 'blue')}",
+        p_state="info",
+    )
+
+
+def is_diff_binary(diff_file):
+    with open(diff_file, "rb") as f:
+        return f.read(len(DIFF_BINARY_MAGIC)) == DIFF_BINARY_MAGIC
+
+
+def open_diff_binary(diff_file):
+    """
+    Memory-maps a binary diff file and reads its footer. Chunks are only
+    decompressed when they are read.
+    """
+    trailer_len = 8 + len(DIFF_BINARY_MAGIC)
+
+    try:
+        with open(diff_file, "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(buf) < len(DIFF_BINARY_MAGIC) + 1 + trailer_len or (
+            buf[-len(DIFF_BINARY_MAGIC) :] != DIFF_BINARY_MAGIC
+        ):
+            raise ValueError("truncated file")
+
+        _, _, decompress = get_diff_codec(buf[len(DIFF_BINARY_MAGIC)])
+        footer_offset = struct.unpack(
+            ">Q", buf[-trailer_len : -len(DIFF_BINARY_MAGIC)]
+        )[0]
+        footer = json.loads(decompress(buf[footer_offset : len(buf) - trailer_len]))
+    except Exception as e:
+        util.exit_message(f"Could not load binary diff file: {e}")
+
+    return {"buf": buf, "decompress": decompress, **footer}
+
+
+def read_diff_block(reader, offset, length):
+    return json.loads(reader["decompress"](reader["buf"][offset : offset + length]))
+
+
+def iter_diff_chunks(reader, node_pair=None, node=None):
+    """
+    Yields the node pair, node and rows of each chunk of a binary diff file
+    in the order they were written, optionally only those of one node pair
+    or node. Other chunks are not decompressed.
+    """
+    for chunk in reader["chunks"]:
+        if (node_pair and chunk["pair"] != node_pair) or (
+            node and chunk["node"] != node
+        ):
+            continue
+
+        if reader.get("chunk_format") == DIFF_CHUNK_FORMAT:
+            offset, length = chunk["offset"], chunk["length"]
+            data = decode_diff_columns(
+                reader["decompress"](reader["buf"][offset : offset + length])
+            )
+        else:
+            # Files written before chunks were typed hold JSON chunks
+            data = read_diff_block(reader, chunk["offset"], chunk["length"])
+
+        rows = [dict(zip(data["cols"], values)) for values in zip(*data["values"])]
+        yield chunk["pair"], chunk["node"], rows
+
+
+def load_diff_file(diff_file):
+    """
+    Loads and validates a diff file written by table-diff. Returns the
+    per node-pair diffs and the metadata recorded alongside them.
+    """
+    if is_diff_binary(diff_file):
+        reader = open_diff_binary(diff_file)
+        diff_meta = reader["meta"]
+        diff_json = {
+            node_pair: {node: [] for node in node_pair.split("/")}
+            for node_pair in reader["pairs"]
+        }
+
+        for node_pair, node, rows in iter_diff_chunks(reader):
+            diff_json[node_pair][node].extend(rows)
+
+        reader["buf"].close()
+        return diff_json, diff_meta
+
+    try:
+        diff_json = json.loads(open(diff_file, "r").read())
+    except Exception:
+        util.exit_message("Could not load diff file as JSON")
+
+    diff_meta = {}
+    if isinstance(diff_json, dict):
+        diff_meta = diff_json.pop(DIFF_META_KEY, {})
+
+    try:
+        if any([set(list(diff_json[k].keys())) != set(k.split('/')) for k in diff_json.keys()]):
+            util.exit_message("Contents of diff file improperly formatted")
+    except Exception:
+        util.exit_message("Contents of diff file improperly formatted")
+
+    return diff_json, diff_meta
+
+
+def open_diff_rows(diff_file):
+    """
+    Opens a diff file to be read one node of a node pair at a time. Returns
+    a function yielding the rows of a node of a node pair, along with the
+    node pairs and the metadata of the file. The chunks of a binary diff file
+    are decompressed as they are read, while a JSON diff file is loaded whole.
+    """
+    if is_diff_binary(diff_file):
+        reader = open_diff_binary(diff_file)
+
+        def diff_rows(node_pair, node):
+            for _, _, rows in iter_diff_chunks(reader, node_pair, node):
+                yield from rows
+
+        return diff_rows, reader["pairs"], reader["meta"]
+
+    diff_json, diff_meta = load_diff_file(diff_file)
+
+    def diff_rows(node_pair, node):
+        yield from diff_json[node_pair].get(node, [])
+
+    return diff_rows, list(diff_json.keys()), diff_meta
+
+
+def load_diff_keys(diff_file, p_key):
+    """
+    Returns the keys of the diffs of each node pair in a diff file, as
+    tuples of strings, along with its metadata. The keys of a binary diff
+    file are read from its key chunks, without decompressing any rows.
+    """
+    key_cols = p_key.split(",")
+
+    if is_diff_binary(diff_file):
+        reader = open_diff_binary(diff_file)
+
+        if reader["key"] == p_key:
+            diff_keys = {node_pair: OrderedSet() for node_pair in reader["pairs"]}
+
+            for chunk in reader["chunks"]:
+                keys = read_diff_block(
+                    reader, chunk["key_offset"], chunk["key_length"]
+                )
+                diff_keys[chunk["pair"]].update(tuple(k) for k in keys)
+
+            reader["buf"].close()
+            return diff_keys, reader["meta"]
+
+        reader["buf"].close()
+
+    diff_json, diff_meta = load_diff_file(diff_file)
+    diff_keys = {}
+
+    for node_pair in diff_json.keys():
+        diff_keys[node_pair] = OrderedSet()
+        for node in node_pair.split("/"):
+            for row in diff_json[node_pair][node]:
+                diff_keys[node_pair].add(tuple(str(row[col]) for col in key_cols))
+
+    return diff_keys, diff_meta
+
+
+def table_rerun(
+    cluster_name,
+    diff_file,
+    table_name,
+    dbname=None,
+    use_mtree=False,
+    batch_size=RERUN_BATCH_SIZE_DEFAULT,
+    max_inflight=MAX_INFLIGHT_DEFAULT,
+):
     """Re-run differences on the results of a recent table-diff"""
 
+    use_mtree = check_bool_param(use_mtree, "use_mtree")
+
+    try:
+        batch_size = int(batch_size)
+    except Exception:
+        util.exit_message("Invalid values for ACE_RERUN_BATCH_SIZE")
+
+    if batch_size < 1:
+        util.exit_message("Batch size should be >= 1")
+
+    try:
+        max_inflight = int(max_inflight)
+    except Exception:
+        util.exit_message("Invalid values for ACE_MAX_INFLIGHT")
+
+    if max_inflight < 1:
+        util.exit_message("Max in-flight queries per node should be >= 1")
+
     if not os.path.exists(diff_file):
         util.exit_message(f"Diff file {diff_file} not found")
 
@@ -1152,6 +7011,7 @@ def table_rerun(cluster_name, diff_file, table_name, dbname=None):
                 password=nd["password"],
                 host=nd["ip_address"],
                 port=nd.get("port", 5432),
+                **get_session_params(),
             )
     except Exception as e:
         util.exit_message("Error in diff_tbls() Getting Connections:" + str(e), 1)
@@ -1168,7 +7028,9 @@ def table_rerun(cluster_name, diff_file, table_name, dbname=None):
         if not curr_cols:
             util.exit_message(f"Invalid table name '{table_name}'")
         if not curr_key:
-            util.exit_message(f"No primary key found for '{table_name}'")
+            util.exit_message(
+                f"No primary key or usable unique index found for '{table_name}'"
+            )
 
         if (not cols) and (not key):
             cols = curr_cols
@@ -1186,25 +7048,17 @@ def table_rerun(cluster_name, diff_file, table_name, dbname=None):
     start_time = datetime.now()
 
     """
-    Please see comments in table_repair() for an explanation of validating the
-    diff file.
-    """
-    try:
-        diff_json = json.loads(open(diff_file, "r").read())
-    except Exception:
-        util.exit_message("Could not load diff file as JSON")
-
-    try:
-        if any([set(list(diff_json[k].keys())) != set(k.split('/')) for k in diff_json.keys()]):
-            util.exit_message("Contents of diff file improperly formatted")
-    except Exception:
-        util.exit_message("Contents of diff file improperly formatted")
-
-    """
+    Please see comments in table_repair() for an explanation of validating the
+    diff file.
+    """
+    diff_keys, diff_meta = load_diff_keys(diff_file, key)
+    hash_mode = diff_meta.get("hash_mode", "md5")
+
+    """
     We first need to identify the tuples we need to recheck.
-    For that, we iterate through the diffs and get the primary key values.
-    However, if the primary key is a composite key, we need to get all the columns,
-    and then use all of them to extract the respective tuples from the database
+    For that, we collect the primary key values of the diffs. If the primary
+    key is a composite key, every key is a tuple of its columns, which are
+    then all used to extract the respective tuples from the database.
 
     We need to collect a maximal set of rows for each pair of nodes. E.g., if we have
     7 rows in node A and 5 rows in node B, we need to collect a union of both those
@@ -1219,46 +7073,129 @@ def table_rerun(cluster_name, diff_file, table_name, dbname=None):
     }
     """
 
+    simple_primary_key = len(key.split(",")) == 1
     diff_values = {}
-    simple_primary_key = True
 
-    if len(key.split(",")) > 1:
-        # We have a composite key situation here
-        key_cols = key.split(",")
-        simple_primary_key = False
+    for node_pair, keys in diff_keys.items():
+        if simple_primary_key:
+            diff_values[node_pair] = [k[0] for k in keys]
+        else:
+            diff_values[node_pair] = list(keys)
 
-        node_pairs = diff_json.keys()
+    cols_list = cols.split(",")
+    cols_list = [col for col in cols_list if not col.startswith("_Spock_")]
 
-        for node_pair in node_pairs:
-            if node_pair not in diff_values:
-                diff_values[node_pair] = set()
+    # Rows are rechecked on the columns and filter the diff was made with
+    row_filter = diff_meta.get("where")
+    projection = get_projection(cols_list, key, diff_meta.get("columns"))
+    mtree_cols = ",".join(projection) if projection else cols
+    cols_list = projection or cols_list
 
-            for node in node_pair.split("/"):
-                for row in diff_json[node_pair][node]:
-                    diff_values[node_pair].add(tuple(row[col] for col in key_cols))
-    else:
-        # We have a single column primary key
-        node_pairs = diff_json.keys()
+    rerun_nodes = sorted(
+        {node for node_pair in diff_values for node in node_pair.split("/")}
+    )
 
-        for node_pair in node_pairs:
-            if node_pair not in diff_values:
-                diff_values[node_pair] = set()
+    if use_mtree:
+        """
+        Refresh the Merkle trees built by table-diff --use_mtree. Node pairs
+        whose trees match again have had all their differences resolved, so
+        their rows need not be fetched at all.
+        """
+        mtree_store = get_mtree_store()
+        mtree = mtree_load(
+            mtree_store, cluster_name, table_name, key, mtree_cols, hash_mode
+        )
+        if not mtree:
+            util.exit_message(
+                f"No Merkle tree found for {table_name}. "
+                "Please run table-diff with --use_mtree first"
+            )
 
-            for node in node_pair.split("/"):
-                for row in diff_json[node_pair][node]:
-                    diff_values[node_pair].add(row[key])
+        shared_objects = {
+            "cluster_name": cluster_name,
+            "database": database,
+            "node_list": rerun_nodes,
+            "schema_name": l_schema,
+            "table_name": l_table,
+            "p_key": key,
+            "simple_primary_key": simple_primary_key,
+            "hash_mode": hash_mode,
+            "columns": projection,
+        }
+        cpus = cpu_count()
+        procs = max(1, int(cpus * float(MAX_CPU_RATIO_DEFAULT)))
+        levels = mtree_refresh(shared_objects, mtree_store, mtree, conn_list, procs)
+
+        for node_pair_key in list(diff_values.keys()):
+            node1, node2 = node_pair_key.split("/")
+            if not mtree_diff_leaves(levels[node1], levels[node2]):
+                util.message(
+                    f"Merkle trees of {node1} and {node2} match: skipping "
+                    f"{len(diff_values[node_pair_key])} rows",
+                    p_state="info",
+                )
+                del diff_values[node_pair_key]
 
-    # Transform the set of tuples into a list of tuples
-    for node_pair in diff_values.keys():
-        diff_values[node_pair] = list(diff_values[node_pair])
+    """
+    Fetch the rows of the differing keys from every node in batches. Each
+    node is asked only once for every key it has a diff for, whichever
+    pairs it appears in, and the batches are pipelined over one persistent
+    connection per node, with all nodes queried concurrently.
+    """
+    key_types = get_col_type_names(
+        next(iter(conn_list.values())), l_schema, l_table
+    )
+    lookup_sql = get_key_lookup_sql(
+        l_schema,
+        l_table,
+        key,
+        [key_types[col] for col in key.split(",")],
+        projection,
+        row_filter,
+    )
 
-    cols_list = cols.split(",")
-    cols_list = [col for col in cols_list if not col.startswith("_Spock_")]
+    node_keys = {node: set() for node in rerun_nodes}
+    for node_pair_key, values in diff_values.items():
+        for node in node_pair_key.split("/"):
+            node_keys[node].update(values)
+
+    node_queries = {}
+    for node, keys in node_keys.items():
+        keys = list(keys)
+        node_queries[node] = []
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i : i + batch_size]
+            if simple_primary_key:
+                params = [list(batch)]
+            else:
+                params = [list(col) for col in zip(*batch)]
+            node_queries[node].append((lookup_sql, params))
 
-    def run_query(cur, query):
-        cur.execute(query)
-        results = cur.fetchall()
-        return results
+    worker_state = {}
+    init_db_connection(
+        {"cluster_name": cluster_name, "database": database, "node_list": rerun_nodes},
+        worker_state,
+    )
+    try:
+        node_results = run_pipelines(worker_state, node_queries, max_inflight)
+    except Exception as e:
+        util.exit_message(f"Error in table_rerun() fetching rows: {e}")
+    finally:
+        close_db_connection(None, worker_state)
+
+    key_idx = [cols_list.index(col) for col in key.split(",")]
+
+    # Rows by their key, stringified like the keys read from the diff file.
+    # Rows are compared as strings, and the diffs keep the values fetched.
+    node_rows = {}
+    typed_rows = {}
+    for node, results in node_results.items():
+        node_rows[node] = {}
+        for rows in results:
+            for row in rows:
+                row_key = tuple(str(row[i]) for i in key_idx)
+                node_rows[node][row_key] = stringify_row(row)
+                typed_rows[node_rows[node][row_key]] = row
 
     diff_rerun = {}
     diffs_found = False
@@ -1266,80 +7203,17 @@ def table_rerun(cluster_name, diff_file, table_name, dbname=None):
     for node_pair_key, values in diff_values.items():
         node1, node2 = node_pair_key.split("/")
 
-        node1_cur = conn_list[node1].cursor()
-        node2_cur = conn_list[node2].cursor()
-
         node1_set = OrderedSet()
         node2_set = OrderedSet()
 
-        if simple_primary_key:
-            for index in values:
-                sql = f"""
-                SELECT *
-                FROM {table_name}
-                WHERE "{key}" = '{index}';
-                """
-
-                with ThreadPoolExecutor(max_workers=2) as executor:
-                    futures = [
-                        executor.submit(run_query, node1_cur, sql),
-                        executor.submit(run_query, node2_cur, sql),
-                    ]
-
-                    t1_result, t2_result = [f.result() for f in futures]
-                    t1_result = t1_result[0] if t1_result else None
-                    t2_result = t2_result[0] if t2_result else None
-
-                    if t1_result is not None and t2_result is not None:
-                        t1_result = tuple(
-                            str(x) if not isinstance(x, list) else str(sorted(x))
-                            for x in t1_result
-                        )
-                        t2_result = tuple(
-                            str(x) if not isinstance(x, list) else str(sorted(x))
-                            for x in t2_result
-                        )
-
-                        node1_set.add(t1_result)
-                        node2_set.add(t2_result)
-        else:
-            for indices in values:
-                sql = f"""
-                SELECT *
-                FROM {table_name}
-                WHERE
-                """
+        for value in values:
+            row_key = (str(value),) if simple_primary_key else tuple(map(str, value))
 
-                ctr = 0
-                for k in key.split(","):
-                    sql += f" \"{k}\" = '{indices[ctr]}' AND"
-                    ctr += 1
-
-                # Get rid of the last "AND" and add a semicolon
-                sql = sql[:-3] + ";"
-
-                with ThreadPoolExecutor(max_workers=2) as executor:
-                    futures = [
-                        executor.submit(run_query, node1_cur, sql),
-                        executor.submit(run_query, node2_cur, sql),
-                    ]
-
-                    t1_result, t2_result = [f.result() for f in futures]
-                    t1_result = t1_result[0] if t1_result else None
-                    t2_result = t2_result[0] if t2_result else None
-
-                    if t1_result is not None and t2_result is not None:
-                        t1_result = tuple(
-                            str(x) if not isinstance(x, list) else str(sorted(x))
-                            for x in t1_result
-                        )
-                        t2_result = tuple(
-                            str(x) if not isinstance(x, list) else str(sorted(x))
-                            for x in t2_result
-                        )
-
-                        node1_set.add(t1_result)
-                        node2_set.add(t2_result)
+            # A row that is still missing on one node is still a diff
+            if row_key in node_rows[node1]:
+                node1_set.add(node_rows[node1][row_key])
+            if row_key in node_rows[node2]:
+                node2_set.add(node_rows[node2][row_key])
 
         node1_diff = node1_set - node2_set
         node2_diff = node2_set - node1_set
@@ -1347,8 +7221,8 @@ def table_rerun(cluster_name, diff_file, table_name, dbname=None):
         if len(node1_diff) > 0 or len(node2_diff) > 0:
             diffs_found = True
             diff_rerun[node_pair_key] = {
-                node1: [dict(zip(cols_list, row)) for row in node1_diff],
-                node2: [dict(zip(cols_list, row)) for row in node2_diff],
+                node1: [dict(zip(cols_list, typed_rows[row])) for row in node1_diff],
+                node2: [dict(zip(cols_list, typed_rows[row])) for row in node2_diff],
             }
 
     dirname = datetime.now().astimezone(None).strftime("%Y-%m-%d_%H:%M:%S")
@@ -1359,10 +7233,21 @@ def table_rerun(cluster_name, diff_file, table_name, dbname=None):
     dirname = os.path.join("diffs", dirname)
     os.mkdir(dirname)
 
-    filename = os.path.join(dirname, "diff.json")
+    # Changed columns describe the rows of the original run only
+    diff_meta.pop("changed_columns", None)
 
-    with open(filename, "w") as f:
-        f.write(json.dumps(diff_rerun, default=str))
+    # The rerun's diffs are written in the same format as the diff file
+    if is_diff_binary(diff_file):
+        filename = os.path.join(dirname, "diff.acediff")
+        write_diff_binary_file(filename, diff_rerun, diff_meta, key)
+    else:
+        filename = os.path.join(dirname, "diff.json")
+
+        if diff_meta:
+            diff_rerun[DIFF_META_KEY] = diff_meta
+
+        with open(filename, "w") as f:
+            f.write(json.dumps(diff_rerun, default=str))
 
     print()
 
@@ -1379,11 +7264,324 @@ def table_rerun(cluster_name, diff_file, table_name, dbname=None):
     util.message("RUN TIME = " + str(util.round_timedelta(datetime.now() - start_time)))
 
 
+def fetch_source_rows(source_conn, lookup_sql, keys):
+    """
+    Returns the whole rows of the given keys on the source of truth, for the
+    rows of a projected diff to be inserted with every column. Keys the
+    source of truth no longer has are skipped.
+    """
+    if len(keys[0]) == 1:
+        params = [[key[0] for key in keys]]
+    else:
+        params = [list(col) for col in zip(*keys)]
+
+    cur = source_conn.cursor()
+    cur.execute(lookup_sql, params)
+    rows = cur.fetchall()
+    cur.close()
+
+    # The source of truth is only read from
+    source_conn.rollback()
+
+    return rows
+
+
+def repair_bulk(
+    source_conn, conn, schema_name, table_name, cols_list, p_key, keys, update_cols=None
+):
+    """
+    Makes the rows of the given keys on a divergent node match the source of
+    truth, in a set-based way. The keys are copied into a temporary table on
+    both nodes, and the source of truth's rows for them are streamed with
+    COPY into a staging table typed like the target table. A single
+    INSERT ... SELECT ... ON CONFLICT then applies the upserts, and a single
+    DELETE anti-joined against the staged rows removes the keys the source
+    of truth does not have. Staging tables live in the repair transaction and
+    are neither logged nor replicated.
+
+    Rows are always inserted with every column; only update_cols, if given,
+    are updated on rows the divergent node already has.
+
+    Returns the number of rows upserted and deleted.
+    """
+    key_cols = p_key.split(",")
+    col_types = get_col_type_names(conn, schema_name, table_name)
+
+    table = sql.SQL("{}.{}").format(
+        sql.Identifier(schema_name), sql.Identifier(table_name)
+    )
+    stage_rows = sql.Identifier("_ace_repair_rows")
+    stage_keys = sql.Identifier("_ace_repair_keys")
+
+    def col_defs(cols):
+        return sql.SQL(", ").join(
+            [
+                sql.SQL("{} {}").format(sql.Identifier(col), sql.SQL(col_types[col]))
+                for col in cols
+            ]
+        )
+
+    def col_names(cols, alias=None):
+        return sql.SQL(", ").join(
+            [
+                sql.Identifier(alias, col) if alias else sql.Identifier(col)
+                for col in cols
+            ]
+        )
+
+    def key_match(alias1, alias2):
+        return sql.SQL("({}) = ({})").format(
+            col_names(key_cols, alias1), col_names(key_cols, alias2)
+        )
+
+    source_cur = source_conn.cursor()
+    cur = conn.cursor()
+
+    for c in [source_cur, cur]:
+        c.execute(
+            sql.SQL("CREATE TEMP TABLE {} ({}) ON COMMIT DROP").format(
+                stage_keys, col_defs(key_cols)
+            )
+        )
+        with c.copy(
+            sql.SQL("COPY {} ({}) FROM STDIN").format(stage_keys, col_names(key_cols))
+        ) as copy:
+            for key in keys:
+                copy.write_row(key)
+
+    cur.execute(
+        sql.SQL("CREATE TEMP TABLE {} ({}) ON COMMIT DROP").format(
+            stage_rows, col_defs(cols_list)
+        )
+    )
+
+    copy_out_sql = sql.SQL(
+        "COPY (SELECT {cols} FROM {table} t JOIN {stage} k ON {match}) TO STDOUT"
+    ).format(
+        cols=col_names(cols_list, "t"),
+        table=table,
+        stage=stage_keys,
+        match=key_match("t", "k"),
+    )
+    copy_in_sql = sql.SQL("COPY {} ({}) FROM STDIN").format(
+        stage_rows, col_names(cols_list)
+    )
+
+    with source_cur.copy(copy_out_sql) as copy_out:
+        with cur.copy(copy_in_sql) as copy_in:
+            for data in copy_out:
+                copy_in.write(data)
+
+    # The source of truth is only read from
+    source_cur.close()
+    source_conn.rollback()
+
+    cur.execute(
+        sql.SQL(
+            "INSERT INTO {table} ({cols}) SELECT {cols} FROM {stage}"
+            " ON CONFLICT ({keys}) DO UPDATE SET {updates}"
+        ).format(
+            table=table,
+            cols=col_names(cols_list),
+            stage=stage_rows,
+            keys=col_names(key_cols),
+            updates=sql.SQL(", ").join(
+                [
+                    sql.SQL("{} = EXCLUDED.{}").format(
+                        sql.Identifier(col), sql.Identifier(col)
+                    )
+                    for col in update_cols or cols_list
+                ]
+            ),
+        )
+    )
+    upserted = cur.rowcount
+
+    cur.execute(
+        sql.SQL(
+            "DELETE FROM {table} t USING {keys} k WHERE {match}"
+            " AND NOT EXISTS (SELECT 1 FROM {rows} s WHERE {staged})"
+        ).format(
+            table=table,
+            keys=stage_keys,
+            match=key_match("t", "k"),
+            rows=stage_rows,
+            staged=key_match("s", "k"),
+        )
+    )
+    deleted = cur.rowcount
+
+    cur.close()
+    return upserted, deleted
+
+
+def connect_node(nd, autocommit=False):
+    return psycopg.connect(
+        dbname=nd["db_name"],
+        user=nd["username"],
+        password=nd["password"],
+        host=nd["ip_address"],
+        port=nd.get("port", 5432),
+        **get_session_params(),
+        autocommit=autocommit,
+    )
+
+
+def repair_governor_check(governor):
+    """
+    Returns why the repair should pause, or None if replication lag and
+    session load on every node are within the configured limits.
+    """
+    for node, conn in governor["conns"].items():
+        cur = conn.cursor()
+        load = sample_node_load(governor, node, cur)
+        cur.close()
+
+        if governor["max_active"] and load["active"] > governor["max_active"]:
+            return f"{load['active']} active sessions on {node}"
+        if governor["max_lag_bytes"] and load["lag"] > governor["max_lag_bytes"]:
+            return f"replication lag of {load['lag']} bytes on {node}"
+
+    return None
+
+
+def repair_governor_wait(governor):
+    """Blocks while any node is over the repair's lag or load limits"""
+    if not governor["max_lag_bytes"] and not governor["max_active"]:
+        return
+
+    paused = False
+    while True:
+        with governor["lock"]:
+            reason = repair_governor_check(governor)
+
+        if not reason:
+            return
+
+        if not paused:
+            util.message(f"Pausing repair: {reason}", p_state="warning")
+            paused = True
+
+        time.sleep(REPAIR_GOVERNOR_POLL_INTERVAL)
+
+
+def repair_checkpoint_save(checkpoint_file, checkpoint):
+    tmp_file = checkpoint_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        f.write(json.dumps(checkpoint))
+    os.replace(tmp_file, checkpoint_file)
+
+
+def repair_node(nd, source_nd, job, repair_objects):
+    """
+    Repairs one divergent node in chunks of chunk_rows operations, each in
+    its own transaction between spock.repair_mode(true/false). The governor
+    is consulted before every chunk, and the checkpoint is updated after
+    every commit so that an interrupted repair can resume from the next
+    chunk.
+
+    Returns the rows upserted and deleted, and the node's spock version.
+    """
+    node = nd["name"]
+    chunk_rows = repair_objects["chunk_rows"]
+    checkpoint = repair_objects["checkpoint"]
+    checkpoint_lock = repair_objects["checkpoint_lock"]
+
+    conn = connect_node(nd)
+    source_conn = (
+        connect_node(source_nd) if job["mode"] == "bulk" or job["lookup_sql"] else None
+    )
+    spock_version = get_spock_version(conn)
+
+    chunks = [
+        job["ops"][i : i + chunk_rows] for i in range(0, len(job["ops"]), chunk_rows)
+    ]
+    first_chunk = checkpoint["done"].get(node, 0)
+
+    if 0 < first_chunk < len(chunks):
+        util.message(
+            f"Resuming repair of {node} at chunk {first_chunk + 1} of {len(chunks)}",
+            p_state="info",
+        )
+
+    try:
+        for chunk_id in range(first_chunk, len(chunks)):
+            chunk = chunks[chunk_id]
+            repair_governor_wait(repair_objects["governor"])
+
+            cur = conn.cursor()
+
+            # FIXME: Do not use harcoded version numbers
+            # Read required version numbers from a config file
+            if spock_version >= 4.0:
+                cur.execute("SELECT spock.repair_mode(true);")
+
+            if job["mode"] == "bulk":
+                upserted, deleted = repair_bulk(
+                    source_conn,
+                    conn,
+                    repair_objects["schema_name"],
+                    repair_objects["table_name"],
+                    repair_objects["cols_list"],
+                    repair_objects["p_key"],
+                    chunk,
+                    repair_objects["update_cols"],
+                )
+            else:
+                upsert_tuples = [op for kind, op in chunk if kind == "upsert"]
+                delete_keys = [op for kind, op in chunk if kind == "delete"]
+
+                if job["lookup_sql"] and upsert_tuples:
+                    upsert_tuples = fetch_source_rows(
+                        source_conn, job["lookup_sql"], upsert_tuples
+                    )
+
+                if upsert_tuples:
+                    cur.executemany(job["update_sql"], upsert_tuples)
+                if delete_keys:
+                    cur.executemany(job["delete_sql"], delete_keys)
+
+                upserted, deleted = len(upsert_tuples), len(delete_keys)
+
+            if spock_version >= 4.0:
+                cur.execute("SELECT spock.repair_mode(false);")
+
+            cur.close()
+            conn.commit()
+
+            with checkpoint_lock:
+                checkpoint["done"][node] = chunk_id + 1
+                checkpoint["upserted"][node] = (
+                    checkpoint["upserted"].get(node, 0) + upserted
+                )
+                checkpoint["deleted"][node] = checkpoint["deleted"].get(node, 0) + deleted
+                repair_checkpoint_save(repair_objects["checkpoint_file"], checkpoint)
+    finally:
+        conn.close()
+        if source_conn:
+            source_conn.close()
+
+    return (
+        checkpoint["upserted"].get(node, 0),
+        checkpoint["deleted"].get(node, 0),
+        spock_version,
+    )
+
+
 def table_repair(
-    cluster_name, diff_file, source_of_truth, table_name, dbname=None, dry_run=False
+    cluster_name,
+    diff_file,
+    source_of_truth,
+    table_name,
+    dbname=None,
+    dry_run=False,
+    repair_mode=REPAIR_MODE_DEFAULT,
+    chunk_rows=REPAIR_CHUNK_ROWS_DEFAULT,
+    max_lag_bytes=REPAIR_MAX_LAG_BYTES_DEFAULT,
+    max_active=REPAIR_MAX_ACTIVE_DEFAULT,
+    resume=False,
 ):
     """Apply changes from a table-diff source of truth to destination table"""
-    import pandas as pd
 
     # Check if diff_file exists on disk
     if not os.path.exists(diff_file):
@@ -1397,6 +7595,30 @@ def table_repair(
     if type(dry_run) is not bool:
         util.exit_message("Dry run should be True (1) or False (0)")
 
+    if repair_mode not in REPAIR_MODES:
+        util.exit_message(
+            f"Invalid repair mode '{repair_mode}'. "
+            f"Valid values are {', '.join(REPAIR_MODES)}"
+        )
+
+    resume = check_bool_param(resume, "resume")
+
+    try:
+        chunk_rows = int(chunk_rows)
+        max_lag_bytes = int(max_lag_bytes)
+        max_active = int(max_active)
+    except Exception:
+        util.exit_message(
+            "Invalid values for ACE_REPAIR_CHUNK_ROWS, ACE_REPAIR_MAX_LAG_BYTES "
+            "or ACE_REPAIR_MAX_ACTIVE"
+        )
+
+    if chunk_rows < 1:
+        util.exit_message("Chunk rows should be >= 1")
+
+    if max_lag_bytes < 0 or max_active < 0:
+        util.exit_message("Repair lag and load limits should be >= 0")
+
     util.check_cluster_exists(cluster_name)
     util.message(f"Cluster {cluster_name} exists", p_state="success")
 
@@ -1447,6 +7669,7 @@ def table_repair(
                 password=nd["password"],
                 host=nd["ip_address"],
                 port=nd.get("port", 5432),
+                **get_session_params(),
             )
 
     except Exception as e:
@@ -1464,7 +7687,9 @@ def table_repair(
         if not curr_cols:
             util.exit_message(f"Invalid table name '{table_name}'")
         if not curr_key:
-            util.exit_message(f"No primary key found for '{table_name}'")
+            util.exit_message(
+                f"No primary key or usable unique index found for '{table_name}'"
+            )
 
         if (not cols) and (not key):
             cols = curr_cols
@@ -1502,24 +7727,27 @@ def table_repair(
     inner keys are contained in the list when the root key is split by "/". If not, we
     throw an error message and exit.
 
+    The diff file may also carry a metadata entry that is not a node pair;
+    load_diff_file() sets it aside.
+
     TODO: It might be possible that the diff file has different cols compared to the
     target table. We need to handle this case.
     """
-    try:
-        diff_json = json.loads(open(diff_file, "r").read())
-    except Exception:
-        util.exit_message("Could not load diff file as JSON")
-
-    try:
-        if any([set(list(diff_json[k].keys())) != set(k.split('/')) for k in diff_json.keys()]):
-            util.exit_message("Contents of diff file improperly formatted")
-    except Exception:
-        util.exit_message("Contents of diff file improperly formatted")
-
-    true_df = pd.DataFrame()
+    if repair_mode == "bulk":
+        """
+        A bulk repair streams the rows from the source of truth, so only the
+        keys of each node pair's diffs are needed. These are read from the
+        key index of a binary diff file, without loading any rows.
+        """
+        diff_keys, diff_meta = load_diff_keys(diff_file, key)
+        node_pairs = list(diff_keys.keys())
+    else:
+        # Rows are read one node of a node pair at a time, streaming the
+        # chunks of a binary diff file
+        diff_rows, node_pairs, diff_meta = open_diff_rows(diff_file)
 
     """
-    The structure of the diff_json is as follows:
+    The structure of the diffs is as follows:
     {
         "node1/node2": {
             "node1": [row1, row2, row3],
@@ -1571,22 +7799,17 @@ def table_repair(
 
     """
 
-    # Gather all rows from source of truth node across all node pairs
-    true_rows = [
-        entry
-        for node_pair in diff_json.keys()
-        for entry in diff_json[node_pair].get(source_of_truth, [])
-    ]
-
-    # Collect all rows from our source of truth node and dedupe
-    true_df = pd.concat([true_df, pd.DataFrame(true_rows)], ignore_index=True)
-    true_df.drop_duplicates(inplace=True)
-
-    if not true_df.empty:
-        # Convert them to a list of tuples after deduping
-        true_rows = [
-            tuple(str(x) for x in row) for row in true_df.to_records(index=False)
-        ]
+    if repair_mode == "bulk":
+        true_rows = OrderedSet(k for keys in diff_keys.values() for k in keys)
+    else:
+        # Gather and dedupe all rows from source of truth node across all node
+        # pairs. Rows are compared as strings, as values such as json may be
+        # unhashable
+        true_rows = OrderedSet(
+            tuple(str(x) for x in entry.values())
+            for node_pair in node_pairs
+            for entry in diff_rows(node_pair, source_of_truth)
+        )
 
     print()
 
@@ -1608,6 +7831,29 @@ def table_repair(
     # Remove metadata columsn "_Spock_CommitTS_" and "_Spock_CommitOrigin_"
     # from cols_list
     cols_list = [col for col in cols_list if not col.startswith("_Spock_")]
+
+    """
+    A diff made on some columns only updates those columns. Its rows hold
+    only those columns, so the rows missing on a divergent node are fetched
+    whole from the source of truth and inserted with every column.
+    """
+    projection = get_projection(cols_list, key, diff_meta.get("columns"))
+    diff_cols = projection or cols_list
+    lookup_sql = None
+    if projection:
+        util.message(
+            f"Updating columns {', '.join(projection)} only",
+            p_state="info",
+        )
+        key_types = get_col_type_names(conns[source_of_truth], l_schema, l_table)
+        lookup_sql = get_key_lookup_sql(
+            l_schema,
+            l_table,
+            key,
+            [key_types[col] for col in key.split(",")],
+            cols_list,
+        )
+
     simple_primary_key = True
     keys_list = []
 
@@ -1617,14 +7863,28 @@ def table_repair(
 
     total_upserted = {}
     total_deleted = {}
+    repair_jobs = {}
 
-    for node_pair in diff_json.keys():
+    for node_pair in node_pairs:
         node1, node2 = node_pair.split("/")
 
+        if repair_mode == "bulk":
+            # Every key in the pair's diff is made to match the source of truth
+            if source_of_truth in [node1, node2]:
+                divergent_node = node2 if node1 == source_of_truth else node1
+                repair_jobs[divergent_node] = {
+                    "mode": repair_mode,
+                    "ops": list(diff_keys[node_pair]),
+                    "update_sql": None,
+                    "delete_sql": None,
+                    "lookup_sql": None,
+                }
+            continue
+
         true_rows = (
             [
                 tuple(str(x) for x in entry.values())
-                for entry in diff_json[node_pair][source_of_truth]
+                for entry in diff_rows(node_pair, source_of_truth)
             ]
             if source_of_truth in [node1, node2]
             else true_rows
@@ -1636,13 +7896,13 @@ def table_repair(
         if node1 == source_of_truth:
             divergent_rows = [
                 tuple(str(x) for x in row.values())
-                for row in diff_json[node_pair][node2]
+                for row in diff_rows(node_pair, node2)
             ]
             divergent_node = node2
         elif node2 == source_of_truth:
             divergent_rows = [
                 tuple(str(x) for x in row.values())
-                for row in diff_json[node_pair][node1]
+                for row in diff_rows(node_pair, node1)
             ]
             divergent_node = node1
         else:
@@ -1664,9 +7924,9 @@ def table_repair(
         rows_to_delete_json = []
 
         if rows_to_upsert:
-            rows_to_upsert_json = [dict(zip(cols_list, row)) for row in rows_to_upsert]
+            rows_to_upsert_json = [dict(zip(diff_cols, row)) for row in rows_to_upsert]
         if rows_to_delete:
-            rows_to_delete_json = [dict(zip(cols_list, row)) for row in rows_to_delete]
+            rows_to_delete_json = [dict(zip(diff_cols, row)) for row in rows_to_delete]
 
         filtered_rows_to_delete = []
 
@@ -1693,12 +7953,6 @@ def table_repair(
 
             filtered_rows_to_delete.append(entry)
 
-        if divergent_node not in total_upserted:
-            total_upserted[divergent_node] = len(rows_to_upsert_json)
-
-        if divergent_node not in total_deleted:
-            total_deleted[divergent_node] = len(filtered_rows_to_delete)
-
         delete_keys = []
 
         if rows_to_delete:
@@ -1714,21 +7968,23 @@ def table_repair(
         Here we are constructing an UPSERT query from true_rows and
         applying it to all nodes
         """
+        insert_cols = ",".join(['"' + col + '"' for col in cols_list])
+
         if simple_primary_key:
             update_sql = f"""
-            INSERT INTO {table_name}
+            INSERT INTO {table_name} ({insert_cols})
             VALUES ({','.join(['%s'] * len(cols_list))})
             ON CONFLICT ("{key}") DO UPDATE SET
             """
         else:
             update_sql = f"""
-            INSERT INTO {table_name}
+            INSERT INTO {table_name} ({insert_cols})
             VALUES ({','.join(['%s'] * len(cols_list))})
             ON CONFLICT
             ({','.join(['"' + col + '"' for col in keys_list])}) DO UPDATE SET
             """
 
-        for col in cols_list:
+        for col in diff_cols:
             update_sql += f'"{col}" = EXCLUDED."{col}", '
 
         update_sql = update_sql[:-2] + ";"
@@ -1751,30 +8007,129 @@ def table_repair(
 
             delete_sql = delete_sql[:-3] + ";"
 
-        conn = conns[divergent_node]
-        cur = conn.cursor()
-        spock_version = get_spock_version(conn)
+        # With a projection, only the keys of the rows to upsert are kept,
+        # and their rows are fetched whole when their chunk is applied
+        if projection:
+            ops = [
+                ("upsert", tuple(row[col] for col in key.split(",")))
+                for row in rows_to_upsert_json
+            ]
+        else:
+            ops = [("upsert", tuple(row.values())) for row in rows_to_upsert_json]
+        ops += [("delete", row) for row in delete_keys]
+
+        repair_jobs[divergent_node] = {
+            "mode": repair_mode,
+            "ops": ops,
+            "update_sql": update_sql,
+            "delete_sql": delete_sql,
+            "lookup_sql": lookup_sql,
+        }
+
+    """
+    Divergent nodes are repaired concurrently, each in chunks that commit
+    separately. Progress is checkpointed next to the diff file after every
+    chunk, and removed once the whole repair has been applied.
+    """
+    checkpoint_file = f"{diff_file}.checkpoint"
+    checkpoint_params = {
+        "table": table_name,
+        "source_of_truth": source_of_truth,
+        "repair_mode": repair_mode,
+        "chunk_rows": chunk_rows,
+    }
+    checkpoint = {**checkpoint_params, "done": {}, "upserted": {}, "deleted": {}}
 
-        # FIXME: Do not use harcoded version numbers
-        # Read required version numbers from a config file
-        if spock_version >= 4.0:
-            cur.execute("SELECT spock.repair_mode(true);")
+    if resume:
+        if not os.path.exists(checkpoint_file):
+            util.exit_message(f"No repair checkpoint found for {diff_file}")
 
-        if rows_to_upsert:
-            upsert_tuples = [tuple(row.values()) for row in rows_to_upsert_json]
+        with open(checkpoint_file) as f:
+            checkpoint = json.load(f)
 
-            # Performing the upsert
-            cur.executemany(update_sql, upsert_tuples)
+        if any(checkpoint.get(k) != v for k, v in checkpoint_params.items()):
+            util.exit_message(
+                f"Repair checkpoint {checkpoint_file} was written with different "
+                "options. Please rerun with the same source of truth, repair "
+                "mode and chunk rows, or without --resume"
+            )
+    elif os.path.exists(checkpoint_file):
+        util.message(
+            f"Discarding repair checkpoint {checkpoint_file}",
+            p_state="warning",
+        )
 
-        if delete_keys:
-            # Performing the deletes
-            if len(delete_keys) > 0:
-                cur.executemany(delete_sql, delete_keys)
+    node_params = {nd["name"]: nd for nd in cluster_nodes}
 
-        if spock_version >= 4.0:
-            cur.execute("SELECT spock.repair_mode(false);")
+    governor = {
+        "conns": {},
+        "lock": threading.Lock(),
+        "max_lag_bytes": max_lag_bytes,
+        "max_active": max_active,
+        "check_lag": True,
+    }
 
-        conn.commit()
+    if max_lag_bytes or max_active:
+        try:
+            for nd in cluster_nodes:
+                governor["conns"][nd["name"]] = connect_node(nd, autocommit=True)
+        except Exception as e:
+            util.exit_message("Error in table_repair() Getting Connections:" + str(e), 1)
+
+    repair_objects = {
+        "schema_name": l_schema,
+        "table_name": l_table,
+        "cols_list": cols_list,
+        "update_cols": diff_cols,
+        "p_key": key,
+        "chunk_rows": chunk_rows,
+        "governor": governor,
+        "checkpoint": checkpoint,
+        "checkpoint_lock": threading.Lock(),
+        "checkpoint_file": checkpoint_file,
+    }
+
+    spock_version = None
+    repair_errors = []
+
+    with ThreadPoolExecutor(max_workers=max(1, len(repair_jobs))) as executor:
+        futures = {
+            executor.submit(
+                repair_node,
+                node_params[node],
+                node_params[source_of_truth],
+                job,
+                repair_objects,
+            ): node
+            for node, job in repair_jobs.items()
+        }
+
+        for future in futures:
+            node = futures[future]
+            try:
+                upserted, deleted, node_spock_version = future.result()
+            except Exception as e:
+                repair_errors.append(f"{node}: {e}")
+                continue
+
+            total_upserted[node] = upserted
+            total_deleted[node] = deleted
+            if spock_version is None or node_spock_version < spock_version:
+                spock_version = node_spock_version
+
+    for conn in governor["conns"].values():
+        conn.close()
+
+    if repair_errors:
+        util.exit_message(
+            "Error in table_repair():\n"
+            + "\n".join(repair_errors)
+            + f"\nCompleted chunks are recorded in {checkpoint_file}. "
+            "Rerun with --resume to continue the repair"
+        )
+
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
 
     run_time = util.round_timedelta(datetime.now() - start_time).total_seconds()
     run_time_str = f"{run_time:.2f}"
@@ -1809,7 +8164,7 @@ def table_repair(
 
     print()
 
-    if spock_version < 4.0:
+    if spock_version is not None and spock_version < 4.0:
         util.message(
             "WARNING: Unable to pause/resume replication during repair due to"
             "an older spock version. Please do a manual check as repair may"
@@ -1826,22 +8181,20 @@ def repset_diff(
     max_cpu_ratio=MAX_CPU_RATIO_DEFAULT,
     output="json",
     nodes="all",
+    target_block_ms=TARGET_BLOCK_MS_DEFAULT,
+    hash_mode=HASH_MODE_DEFAULT,
 ):
     """Loop thru a replication-sets tables and run table-diff on them"""
 
-    if type(block_rows) is str:
-        try:
-            block_rows = int(block_rows)
-        except Exception:
-            util.exit_message("Invalid values for ACE_BLOCK_ROWS or --block_rows")
-    elif type(block_rows) is not int:
-        util.exit_message("Invalid value type for ACE_BLOCK_ROWS or --block_rows")
-    
-    # Capping max block size here to prevent the hash function from taking forever
-    if block_rows > MAX_ALLOWED_BLOCK_SIZE:
-        util.exit_message(f"Block row size should be <= {MAX_ALLOWED_BLOCK_SIZE}")
-    if block_rows < MIN_ALLOWED_BLOCK_SIZE:
-        util.exit_message(f"Block row size should be >= {MIN_ALLOWED_BLOCK_SIZE}")
+    block_rows = check_block_rows(block_rows, hash_mode)
+
+    try:
+        target_block_ms = int(target_block_ms)
+    except Exception:
+        util.exit_message("Invalid values for ACE_TARGET_BLOCK_MS")
+
+    if target_block_ms < 1:
+        util.exit_message("Target block time should be >= 1 ms")
 
     if type(max_cpu_ratio) is int:
         max_cpu_ratio = float(max_cpu_ratio)
@@ -1856,9 +8209,9 @@ def repset_diff(
     if max_cpu_ratio > 1.0 or max_cpu_ratio < 0.0:
         util.exit_message("Invalid value range for ACE_MAX_CPU_RATIO or --max_cpu_ratio")
 
-    if output not in ["csv", "json"]:
+    if output not in DIFF_OUTPUTS:
         util.exit_message(
-            "Diff-tables currently supports only csv and json output formats"
+            "Diff-tables currently supports only csv, json and binary output formats"
         )
 
     node_list = []
@@ -1870,11 +8223,6 @@ def repset_diff(
                 E.g., --nodes="n1,n2". Error: {e}'
         )
 
-    if len(node_list) > 3:
-        util.exit_message(
-            "diff-tables currently supports up to a three-way table comparison"
-        )
-
     if nodes != "all" and len(node_list) == 1:
         util.exit_message("diff-tables needs at least two nodes to compare")
 
@@ -1910,6 +8258,7 @@ def repset_diff(
                 util.exit_message("Specified nodenames not present in cluster")
 
     conn_list = []
+    node_conns = {}
 
     try:
         for nd in cluster_nodes:
@@ -1923,8 +8272,10 @@ def repset_diff(
                     password=nd["password"],
                     host=nd["ip_address"],
                     port=nd.get("port", 5432),
+                    **get_session_params(),
                 )
                 conn_list.append(psql_conn)
+                node_conns[nd["name"]] = psql_conn
 
     except Exception as e:
         util.exit_message("Error in diff_tbls() Getting Connections:" + str(e), 1)
@@ -1956,13 +8307,34 @@ def repset_diff(
             "Repset may be empty",
             p_state="warning",
         )
+        return
 
     # Convert fetched rows into a list of strings
     tables = [table[0] for table in tables]
 
-    for table in tables:
-        util.message(f"\n\nCHECKING TABLE {table}...\n", p_state="info")
-        table_diff(cluster_name, table)
+    shared_objects = {
+        "cluster_name": cluster_name,
+        "database": database,
+        "node_list": node_list,
+        "hash_mode": hash_mode,
+        "bisect": False,
+        "bisect_factor": int(BISECT_FACTOR_DEFAULT),
+        "bisect_leaf_rows": int(BISECT_LEAF_ROWS_DEFAULT),
+        "max_inflight": int(MAX_INFLIGHT_DEFAULT),
+        "compare_engine": COMPARE_ENGINE_DEFAULT,
+        "fetch_mode": FETCH_MODE_DEFAULT,
+        "row_filter": None,
+    }
+
+    diff_tables(
+        shared_objects,
+        node_conns,
+        tables,
+        block_rows,
+        max_cpu_ratio,
+        output,
+        target_block_ms=target_block_ms,
+    )
 
 
 if __name__ == "__main__":
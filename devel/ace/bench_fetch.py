@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+#####################################################
+#  Copyright 2022-2024 PGEDGE  All rights reserved. #
+#####################################################
+
+"""
+Benchmarks how ACE fetches the rows of mismatched blocks: a regular SELECT
+with every value stringified for comparison (--fetch_mode=select) against a
+binary COPY whose rows are compared undecoded (--fetch_mode=copy).
+
+Creates a narrow and a wide table in a scratch schema of the given database,
+reports rows/sec for both paths and drops the schema again.
+
+    export MY_HOME=<cli install dir> MY_LITE=$MY_HOME/data/conf/db_local.db
+    python3 devel/ace/bench_fetch.py "host=localhost dbname=postgres" --rows 200000
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "cli", "scripts")
+)
+# ace.py needs the environment of a CLI install (see cli/scripts/sh/cli.sh)
+if not (os.getenv("MY_HOME") and os.getenv("MY_LITE")):
+    sys.exit("Please set MY_HOME and MY_LITE to those of a CLI install")
+
+import psycopg
+from psycopg import sql
+from ordered_set import OrderedSet
+
+import ace
+
+SCHEMA = "ace_bench_fetch"
+
+TABLES = {
+    "narrow": (
+        "id bigint PRIMARY KEY, val integer",
+        "SELECT g, g %% 1000 FROM generate_series(1, %(rows)s) g",
+    ),
+    "wide": (
+        "id bigint PRIMARY KEY, name text, amount numeric, created timestamptz,"
+        " tags integer[], doc jsonb, payload bytea",
+        "SELECT g, repeat(md5(g::text), 6), g * 1.25,"
+        " '2024-01-01'::timestamptz + g * interval '1 second',"
+        " ARRAY[g, g + 1, g + 2],"
+        " jsonb_build_object('id', g, 'name', md5(g::text), 'tags', ARRAY[1, 2, 3]),"
+        " decode(repeat(md5(g::text), 32), 'hex')"
+        " FROM generate_series(1, %(rows)s) g",
+    ),
+}
+
+
+async def fetch_select(conn, query):
+    rows = await ace.run_query_async(conn, query)
+    return OrderedSet(ace.stringify_row(row) for row in rows)
+
+
+async def fetch_copy(conn, query):
+    rows = await ace.copy_query_async(conn, query)
+    return OrderedSet(rows)
+
+
+async def bench(dsn, rows, rounds):
+    conn = await psycopg.AsyncConnection.connect(dsn, autocommit=True)
+
+    await conn.execute(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(sql.Identifier(SCHEMA)))
+    await conn.execute(sql.SQL("CREATE SCHEMA {}").format(sql.Identifier(SCHEMA)))
+
+    try:
+        for table, (columns, fill) in TABLES.items():
+            table_name = sql.SQL("{}.{}").format(sql.Identifier(SCHEMA), sql.Identifier(table))
+            await conn.execute(sql.SQL("CREATE TABLE {} (" + columns + ")").format(table_name))
+            await conn.execute(sql.SQL("INSERT INTO {} " + fill).format(table_name), {"rows": rows})
+            await conn.execute(sql.SQL("VACUUM ANALYZE {}").format(table_name))
+
+            query = ace.get_block_sql(SCHEMA, table, sql.SQL("TRUE"))
+
+            for mode, fetch in [("select", fetch_select), ("copy", fetch_copy)]:
+                # Warm the cache before timing
+                await fetch(conn, query)
+
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    fetched = await fetch(conn, query)
+                elapsed = (time.perf_counter() - start) / rounds
+
+                print(
+                    f"{table:>6} {mode:>6}: {len(fetched) / elapsed:12,.0f} rows/sec"
+                    f"  ({elapsed:.3f}s per {len(fetched)} rows)"
+                )
+    finally:
+        await conn.execute(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(sql.Identifier(SCHEMA)))
+        await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dsn", help="libpq connection string of the database to use")
+    parser.add_argument("--rows", type=int, default=100000, help="rows per table")
+    parser.add_argument("--rounds", type=int, default=3, help="timed fetches per table and mode")
+    args = parser.parse_args()
+
+    asyncio.run(bench(args.dsn, args.rows, args.rounds))
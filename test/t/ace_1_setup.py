@@ -42,6 +42,35 @@ for n in range(1,num_nodes+1):
     #INSERT data
     row = util_test.write_psql("INSERT INTO foo_nopk (employeeID,employeeName,employeeMail) VALUES(1,'Carol','carol@pgedge.com'),(2,'Bob','bob@pgedge.com')",host,dbname,port,pw,usr)
 
+    #CREATE table - diverged, and repaired by ace_7
+    row = util_test.write_psql("CREATE TABLE IF NOT EXISTS foo_repair (employeeID INT PRIMARY KEY,employeeName VARCHAR(40),employeeMail VARCHAR(40))",host,dbname,port,pw,usr)
+    #INSERT data
+    row = util_test.write_psql("INSERT INTO foo_repair (employeeID,employeeName,employeeMail) SELECT g,'name'||g,'mail'||g||'@pgedge.com' FROM generate_series(1,1000) g",host,dbname,port,pw,usr)
+
+    #CREATE table - 10 blocks of 1000 rows, 5 of them with a changed row on n2
+    row = util_test.write_psql("CREATE TABLE IF NOT EXISTS foo_diverged (employeeID INT PRIMARY KEY,employeeName VARCHAR(40),employeeMail VARCHAR(40))",host,dbname,port,pw,usr)
+    #INSERT data
+    row = util_test.write_psql("INSERT INTO foo_diverged (employeeID,employeeName,employeeMail) SELECT g,'name'||g,'mail'||g||'@pgedge.com' FROM generate_series(1,10000) g",host,dbname,port,pw,usr)
+    if n==2:
+        row = util_test.write_psql("UPDATE foo_diverged SET employeeName='changed' WHERE employeeID IN (1500,3500,5500,7500,9500)",host,dbname,port,pw,usr)
+
+    #CREATE table - partitioned, with a changed row in each partition on n2
+    row = util_test.write_psql("CREATE TABLE IF NOT EXISTS foo_part (employeeID INT PRIMARY KEY,employeeName VARCHAR(40),employeeMail VARCHAR(40)) PARTITION BY RANGE (employeeID)",host,dbname,port,pw,usr)
+    row = util_test.write_psql("CREATE TABLE IF NOT EXISTS foo_part_1 PARTITION OF foo_part FOR VALUES FROM (1) TO (5001)",host,dbname,port,pw,usr)
+    row = util_test.write_psql("CREATE TABLE IF NOT EXISTS foo_part_2 PARTITION OF foo_part FOR VALUES FROM (5001) TO (10001)",host,dbname,port,pw,usr)
+    #INSERT data
+    row = util_test.write_psql("INSERT INTO foo_part (employeeID,employeeName,employeeMail) SELECT g,'name'||g,'mail'||g||'@pgedge.com' FROM generate_series(1,10000) g",host,dbname,port,pw,usr)
+    if n==2:
+        row = util_test.write_psql("UPDATE foo_part SET employeeName='changed' WHERE employeeID IN (2500,7500)",host,dbname,port,pw,usr)
+
+    #CREATE table - no primary key, with duplicate rows: n2 has Alice in place of one of the Bobs
+    row = util_test.write_psql("CREATE TABLE IF NOT EXISTS foo_nopk_diff (employeeID INT ,employeeName VARCHAR(40),employeeMail VARCHAR(40))",host,dbname,port,pw,usr)
+    #INSERT data
+    if n==1:
+        row = util_test.write_psql("INSERT INTO foo_nopk_diff (employeeID,employeeName,employeeMail) VALUES(1,'Carol','carol@pgedge.com'),(2,'Bob','bob@pgedge.com'),(2,'Bob','bob@pgedge.com')",host,dbname,port,pw,usr)
+    else:
+        row = util_test.write_psql("INSERT INTO foo_nopk_diff (employeeID,employeeName,employeeMail) VALUES(1,'Carol','carol@pgedge.com'),(2,'Bob','bob@pgedge.com'),(3,'Alice','alice@pgedge.com')",host,dbname,port,pw,usr)
+
     print(f"Created tables on n{n}")
 
     cmd_node = f"spock repset-add-table default 'public.foo' {dbname}"
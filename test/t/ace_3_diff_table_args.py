@@ -1,4 +1,4 @@
-import os, util_test, subprocess, pathlib
+import os, re, json, util_test, subprocess, pathlib
 # Get environment variables
 
 ## Print Script
@@ -10,6 +10,32 @@ util_test.set_env()
 home_dir = os.getenv("NC_DIR")
 cluster = os.getenv("EDGE_CLUSTER")
 
+port=int(os.getenv("EDGE_START_PORT",6432))
+usr=os.getenv("EDGE_USERNAME","lcusr")
+pw=os.getenv("EDGE_PASSWORD","password")
+host=os.getenv("EDGE_HOST","localhost")
+dbname=os.getenv("EDGE_DB","lcdb")
+num_nodes=int(os.getenv("EDGE_NODES",2))
+
+## The rows of foo_diverged that differ on n2, one in each of 5 of its 10 blocks of 1000 rows
+diverged_ids = [1500,3500,5500,7500,9500]
+
+## Return the diffs between n1 and n2 from every diff file a table-diff wrote out
+def read_diffs(res):
+    diffs = []
+    for diff_file in re.findall(r"(diffs/\S+?/diff\.json)", res.stdout):
+        with open(os.path.join(home_dir, "pgedge", diff_file)) as f:
+            diffs.append(json.load(f)["n1/n2"])
+    return diffs
+
+## Return the employeeIDs of the diffs on each node, sorted
+def diff_ids(res):
+    ids = {"n1": [], "n2": []}
+    for diffs in read_diffs(res):
+        for node in ids:
+            ids[node] += [row["employeeid"] for row in diffs[node]]
+    return {node: sorted(node_ids) for node, node_ids in ids.items()}
+
 ## Test Additional Arguements for table diff
 
 cmd_node = f"ace table-diff {cluster} public.foo --block_rows=1001"
@@ -29,6 +55,247 @@ res=util_test.run_cmd("output in json form", cmd_node, f"{home_dir}")
 print(res)
 if res.returncode == 1 or "TABLES MATCH" not in res.stdout:
     util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Output JSON", 1)
+
+cmd_node = f"ace table-diff {cluster} public.foo --output=binary"
+res=util_test.run_cmd("output in binary form", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "TABLES MATCH" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Output Binary", 1)
+
+#plan the blocks with each of the range planners
+for planner in ["exact", "server", "stats"]:
+    cmd_node = f"ace table-diff {cluster} public.foo --range_planner={planner}"
+    res=util_test.run_cmd(f"range planner {planner}", cmd_node, f"{home_dir}")
+    print(res)
+    if res.returncode == 1 or "TABLES MATCH" not in res.stdout:
+        util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Range Planner {planner}", 1)
+
+#hash the blocks in streaming mode with a block size above the md5 cap
+cmd_node = f"ace table-diff {cluster} public.foo --hash_mode=stream --block_rows=1000000"
+res=util_test.run_cmd("stream hash mode", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "TABLES MATCH" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Stream Hash Mode", 1)
+
+#build the Merkle tree on the first run and reuse it on the second
+for attempt in ["build", "reuse"]:
+    cmd_node = f"ace table-diff {cluster} public.foo --use_mtree"
+    res=util_test.run_cmd(f"merkle tree {attempt}", cmd_node, f"{home_dir}")
+    print(res)
+    if res.returncode == 1 or "TABLES MATCH" not in res.stdout:
+        util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Merkle Tree {attempt}", 1)
+
+#no leaf is dirty when nothing has changed since the last run
+if "Re-hashed 0 of" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Merkle Tree Clean Leaves", 1)
+
+#bisect mismatched blocks before fetching their rows
+cmd_node = f"ace table-diff {cluster} public.foo --bisect --bisect_factor=2 --bisect_leaf_rows=100"
+res=util_test.run_cmd("bisect mismatched blocks", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "TABLES MATCH" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Bisect", 1)
+
+#bisect the mismatched blocks of a diverged table down to the changed rows
+cmd_node = f"ace table-diff {cluster} public.foo_diverged --block_rows=1000 --bisect --bisect_factor=2 --bisect_leaf_rows=100"
+res=util_test.run_cmd("bisect mismatched blocks with diffs", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "FOUND 5 DIFFS BETWEEN n1 AND n2" not in res.stdout or diff_ids(res) != {"n1": diverged_ids, "n2": diverged_ids}:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Bisect Diffs", 1)
+
+#bisect the blocks where two nodes diverge from n1 in different ways: their ranges overlap, and each row must be fetched once
+if num_nodes >= 3:
+    util_test.write_psql("UPDATE foo_diverged SET employeeName='changed3' WHERE employeeID IN (1500,3500)",host,dbname,port+2,pw,usr)
+    res=util_test.run_cmd("bisect two divergent nodes", f"{cmd_node} --compare_engine=columnar", f"{home_dir}")
+    print(res)
+    util_test.write_psql("UPDATE foo_diverged SET employeeName='name'||employeeID WHERE employeeID IN (1500,3500)",host,dbname,port+2,pw,usr)
+    diff_file = re.search(r"(diffs/\S+?/diff\.json)", res.stdout)
+    with open(os.path.join(home_dir, "pgedge", diff_file.group(1))) as f:
+        diffs = json.load(f)
+    n3_ids = sorted(row["employeeid"] for row in diffs["n1/n3"]["n3"])
+    if res.returncode == 1 or "FOUND 5 DIFFS BETWEEN n1 AND n2" not in res.stdout or "FOUND 2 DIFFS BETWEEN n1 AND n3" not in res.stdout or "FOUND 5 DIFFS BETWEEN n2 AND n3" not in res.stdout or n3_ids != [1500,3500]:
+        util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Bisect Two Divergent Nodes", 1)
+
+#pipeline one block hash query at a time, and many at a time, per node
+for inflight in [1, 32]:
+    cmd_node = f"ace table-diff {cluster} public.foo --max_inflight={inflight}"
+    res=util_test.run_cmd(f"max in-flight {inflight}", cmd_node, f"{home_dir}")
+    print(res)
+    if res.returncode == 1 or "TABLES MATCH" not in res.stdout:
+        util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Max In-flight {inflight}", 1)
+
+#compare the nodes at a common LSN fence and exported snapshots
+cmd_node = f"ace table-diff {cluster} public.foo --consistent"
+res=util_test.run_cmd("consistent snapshot", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "TABLES MATCH" not in res.stdout or "LSN fence" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Consistent", 1)
+
+#compare mismatched blocks with the columnar engine
+cmd_node = f"ace table-diff {cluster} public.foo --compare_engine=columnar"
+res=util_test.run_cmd("columnar compare engine", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "TABLES MATCH" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Columnar Engine", 1)
+
+#the columnar engine reports the same diffs, with the same values, as the text engine
+compared = {}
+for engine in ["text", "columnar"]:
+    cmd_node = f"ace table-diff {cluster} public.foo_diverged --block_rows=1000 --compare_engine={engine}"
+    res=util_test.run_cmd(f"{engine} compare engine with diffs", cmd_node, f"{home_dir}")
+    print(res)
+    if res.returncode == 1 or "FOUND 5 DIFFS BETWEEN n1 AND n2" not in res.stdout or diff_ids(res) != {"n1": diverged_ids, "n2": diverged_ids}:
+        util_test.exit_message(f"Fail - {os.path.basename(__file__)} - {engine} Engine Diffs", 1)
+    compared[engine] = read_diffs(res)
+if compared["text"] != compared["columnar"]:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Compare Engine Diff Values", 1)
+
+#fetch mismatched blocks with binary COPY
+cmd_node = f"ace table-diff {cluster} public.foo --fetch_mode=copy"
+res=util_test.run_cmd("copy fetch mode", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "TABLES MATCH" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Copy Fetch Mode", 1)
+
+#a mismatched row is reported with the same values in both fetch modes
+fetched = {}
+for mode in ["select", "copy"]:
+    cmd_node = f"ace table-diff {cluster} public.foo_diff_data --fetch_mode={mode}"
+    res=util_test.run_cmd(f"{mode} fetch mode with diffs", cmd_node, f"{home_dir}")
+    print(res)
+    diff_file = re.search(r"(diffs/\S+?/diff\.json)", res.stdout)
+    if res.returncode == 1 or "FOUND 2 DIFFS BETWEEN n1 AND n2" not in res.stdout or not diff_file:
+        util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Fetch Mode {mode} Diffs", 1)
+    with open(os.path.join(home_dir, "pgedge", diff_file.group(1))) as f:
+        fetched[mode] = json.load(f)["n1/n2"]
+if fetched["select"] != fetched["copy"]:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Fetch Mode Diff Values", 1)
+
+#calibrate the block size against the nodes and adapt it during the run
+cmd_node = f"ace table-diff {cluster} public.foo --block_rows=auto"
+res=util_test.run_cmd("adaptive block size", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "TABLES MATCH" not in res.stdout or "Calibrated block size" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Adaptive Block Size", 1)
+
+#resize the blocks of a diverged table during the run and still find every changed row
+cmd_node = f"ace table-diff {cluster} public.foo_diverged --block_rows=auto --target_block_ms=1"
+res=util_test.run_cmd("adaptive block size with diffs", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "FINAL BLOCK SIZE" not in res.stdout or "FOUND 5 DIFFS BETWEEN n1 AND n2" not in res.stdout or diff_ids(res) != {"n1": diverged_ids, "n2": diverged_ids}:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Adaptive Block Size Diffs", 1)
+
+#diff every table matching a glob in one scheduled run
+cmd_node = f"ace table-diff {cluster} 'public.foo*'"
+res=util_test.run_cmd("table glob", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "CHECKING TABLE public.foo" not in res.stdout or "TABLES CHECKED" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Table Glob", 1)
+
+#diff a partitioned table partition by partition: each partition has one changed row
+cmd_node = f"ace table-diff {cluster} public.foo_part"
+res=util_test.run_cmd("partitioned table", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "diffing its 2 partitions" not in res.stdout or res.stdout.count("FOUND 1 DIFFS BETWEEN n1 AND n2") != 2 or diff_ids(res) != {"n1": [2500,7500], "n2": [2500,7500]}:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Partitioned Table", 1)
+
+#compare only some of the columns, and only the rows matching a filter
+cmd_node = f"ace table-diff {cluster} public.foo --exclude_columns=employeemail --where='employeeid < 100'"
+res=util_test.run_cmd("column projection and row filter", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "TABLES MATCH" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Projection and Filter", 1)
+
+#diff the whole table first, then only the rows committed since
+for attempt in ["full", "incremental"]:
+    cmd_node = f"ace table-diff {cluster} public.foo --incremental"
+    res=util_test.run_cmd(f"{attempt} diff", cmd_node, f"{home_dir}")
+    print(res)
+    if res.returncode == 1 or "TABLES MATCH" not in res.stdout or "Watermark" not in res.stdout:
+        util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Incremental {attempt}", 1)
+
+#compare a seeded random sample of the blocks and estimate the divergence
+cmd_node = f"ace table-diff {cluster} public.foo --sample=0.5 --sample_seed=42"
+res=util_test.run_cmd("sampled diff", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "TABLES MATCH" not in res.stdout or "ESTIMATED DIVERGENT BLOCKS" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Sample", 1)
+
+#a sample reports the changed rows of the blocks it picks, and all of them when it picks every block
+for ratio in [0.5, 1]:
+    cmd_node = f"ace table-diff {cluster} public.foo_diverged --block_rows=1000 --sample={ratio} --sample_seed=42"
+    res=util_test.run_cmd(f"sampled diff of {ratio} with diffs", cmd_node, f"{home_dir}")
+    print(res)
+    mismatched = re.search(r"MISMATCHED BLOCKS IN SAMPLE = (\d+)", res.stdout)
+    ids = diff_ids(res)
+    if res.returncode == 1 or not mismatched or len(ids["n1"]) != int(mismatched.group(1)) or not set(ids["n1"]) <= set(diverged_ids) or ids["n1"] != ids["n2"]:
+        util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Sample {ratio} Diffs", 1)
+    if ratio == 1 and (ids["n1"] != diverged_ids or "ESTIMATED DIVERGENT ROWS = 5" not in res.stdout):
+        util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Sample {ratio} Diffs", 1)
+
+#retry failed blocks at most once
+cmd_node = f"ace table-diff {cluster} public.foo --block_retries=1"
+res=util_test.run_cmd("block retries", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "TABLES MATCH" not in res.stdout or "Journaling job" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Block Retries", 1)
+
+#fail the last block on n2, whose last row the filter divides by zero, then resume the job once the row is gone
+resume_args = "--block_rows=1000 --block_retries=0 --where='employeeID / (10001 - employeeID) >= 0'"
+util_test.write_psql("UPDATE foo_diverged SET employeeID=10001 WHERE employeeID=10000",host,dbname,port+1,pw,usr)
+cmd_node = f"ace table-diff {cluster} public.foo_diverged {resume_args}"
+res=util_test.run_cmd("diff with a failed block", cmd_node, f"{home_dir}")
+print(res)
+job_id = re.search(r"--resume=(job_\w+)", res.stdout)
+util_test.write_psql("UPDATE foo_diverged SET employeeID=10000 WHERE employeeID=10001",host,dbname,port+1,pw,usr)
+if not job_id:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Failed Block", 1)
+
+cmd_node = f"ace table-diff {cluster} public.foo_diverged {resume_args} --resume={job_id.group(1)}"
+res=util_test.run_cmd("resume after a failed block", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "Resuming job" not in res.stdout or "FOUND 5 DIFFS BETWEEN n1 AND n2" not in res.stdout or diff_ids(res) != {"n1": diverged_ids, "n2": diverged_ids}:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Resume", 1)
+
+#throttle the diff to keep the nodes under a load budget
+cmd_node = f"ace table-diff {cluster} public.foo --max_queries=4 --max_active=50"
+res=util_test.run_cmd("load governor", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "TABLES MATCH" not in res.stdout or "GOVERNOR THROTTLED" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Load Governor", 1)
+
+#skip the tables matching a glob that matched on the last run and have not been written to since
+for attempt in ["compare", "skip"]:
+    cmd_node = f"ace table-diff {cluster} 'public.foo*' --precheck"
+    res=util_test.run_cmd(f"table glob precheck {attempt}", cmd_node, f"{home_dir}")
+    print(res)
+    if res.returncode == 1 or "TABLES CHECKED" not in res.stdout:
+        util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Precheck {attempt}", 1)
+
+if "not written to since it last matched" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Precheck Skip", 1)
+
+#compare a table without a primary key as multisets of rows: n2 has Alice in place of one of two Bobs
+cmd_node = f"ace table-diff {cluster} public.foo_nopk_diff"
+res=util_test.run_cmd("keyless table with diffs", cmd_node, f"{home_dir}")
+print(res)
+keyless_diffs = read_diffs(res)
+if res.returncode == 1 or "FOUND 1 DIFFS BETWEEN n1 AND n2" not in res.stdout or keyless_diffs != [{
+    "n1": [{"employeeid": 2, "employeename": "Bob", "employeemail": "bob@pgedge.com"}],
+    "n2": [{"employeeid": 3, "employeename": "Alice", "employeemail": "alice@pgedge.com"}],
+}]:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Keyless Diffs", 1)
+
+#spock metadata columns differ by node, and are left out of keyless hashes and rows
+for n in range(num_nodes):
+    util_test.write_psql(f'ALTER TABLE foo_nopk_diff ADD COLUMN "_Spock_CommitTS_" int DEFAULT {n}',host,dbname,port+n,pw,usr)
+res=util_test.run_cmd("keyless table with spock columns", cmd_node, f"{home_dir}")
+print(res)
+for n in range(num_nodes):
+    util_test.write_psql('ALTER TABLE foo_nopk_diff DROP COLUMN "_Spock_CommitTS_"',host,dbname,port+n,pw,usr)
+if res.returncode == 1 or "FOUND 1 DIFFS BETWEEN n1 AND n2" not in res.stdout or read_diffs(res) != keyless_diffs:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Keyless Spock Columns", 1)
+
 ## TO DO - check for diff file
 #if not os.path.exists(f"{home_dir}/diffs"):
 ##	util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Failed to make JSON", 1)
@@ -25,4 +25,11 @@ print(res)
 if res.returncode == 1 or "SCHEMAS ARE THE SAME'" not in res.stdout:
     util_test.exit_message(f"Fail - {os.path.basename(__file__)} - spock-diff", 1) 
 
+#Compare the schemas again, reusing the cached catalog fingerprints
+cmd_node = f"ace schema-diff {cluster} all public --use_cache"
+res=util_test.run_cmd("schema-diff cache", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "SCHEMAS ARE THE SAME" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - schema-diff cache", 1) 
+
 util_test.exit_message(f"Pass - {os.path.basename(__file__)}", 0)
@@ -50,11 +50,67 @@ if res.returncode == 0 or "Invalid values for ACE_MAX_CPU_RATIO" not in res.stdo
     util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Max CPU Ratio", 1) 
 print("*" * 100)  
     
+##  Negative, use an unknown range planner
+cmd_node = f"ace table-diff demo public.foo --range_planner=guess"
+res=util_test.run_cmd("invalid range planner", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 0 or "Invalid range planner 'guess'" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Range Planner", 1)
+print("*" * 100)
+
+##  Negative, use an unknown hash mode
+cmd_node = f"ace table-diff demo public.foo --hash_mode=sha1"
+res=util_test.run_cmd("invalid hash mode", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 0 or "Invalid hash mode 'sha1'" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Hash Mode", 1)
+print("*" * 100)
+
+##  Negative, bisect each block into a single sub-range
+cmd_node = f"ace table-diff demo public.foo --bisect --bisect_factor=1"
+res=util_test.run_cmd("invalid bisect factor", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 0 or "Bisect factor should be >= 2" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Bisect Factor", 1)
+print("*" * 100)
+
+##  Negative, use an unknown compare engine
+cmd_node = f"ace table-diff demo public.foo --compare_engine=arrow"
+res=util_test.run_cmd("invalid compare engine", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 0 or "Invalid compare engine 'arrow'" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Compare Engine", 1)
+print("*" * 100)
+
+##  Negative, exclude a primary key column from the comparison
+cmd_node = f"ace table-diff demo public.foo --exclude_columns=employeeid"
+res=util_test.run_cmd("exclude key column", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 0 or "Primary key columns cannot be excluded" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Exclude Key Column", 1)
+print("*" * 100)
+
+##  Negative, resume a job that was never journaled
+cmd_node = f"ace table-diff demo public.foo --resume=nosuchjob"
+res=util_test.run_cmd("resume unknown job", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 0 or "No job 'nosuchjob' found in the journal" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Resume Unknown Job", 1)
+print("*" * 100)
+
+##  Negative, read from replicas at exported snapshots
+cmd_node = f"ace table-diff demo public.foo --use_replicas --consistent"
+res=util_test.run_cmd("replicas and consistent", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 0 or "--use_replicas cannot be combined with --consistent" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Replicas Consistent", 1)
+print("*" * 100)
+
 ##  Negative, set --output to html; confirm that an error is thrown
 cmd_node = f"ace table-diff demo public.foo --output=html"
 res=util_test.run_cmd("output in html format", cmd_node, f"{home_dir}")
 print(res)
-if res.returncode == 0 or "table-diff currently supports only csv and json output formats" not in res.stdout:
+if res.returncode == 0 or "table-diff currently supports only csv, json and binary output formats" not in res.stdout:
     util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Output HTML", 1) 
  
 util_test.exit_message(f"Pass - {os.path.basename(__file__)}", 0)    
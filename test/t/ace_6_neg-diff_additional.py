@@ -33,4 +33,13 @@ print(res)
 if res.returncode == 0 or "schema-diff needs at least two nodes to compare" not in res.stdout:
     util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Similar Node Names", 1) 
 
+print("*" * 100)
+
+## use an unknown schema-diff engine
+cmd_node = f"ace schema-diff demo all public --engine=text"
+res=util_test.run_cmd("schema-diff engine", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 0 or "Invalid schema-diff engine 'text'" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Invalid Engine", 1) 
+
 util_test.exit_message(f"Pass - {os.path.basename(__file__)}", 0)
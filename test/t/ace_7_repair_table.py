@@ -0,0 +1,142 @@
+import os, re, json, util_test, subprocess
+
+## Print Script
+print(f"Starting - {os.path.basename(__file__)}")
+
+## Get Test Settings
+util_test.set_env()
+
+home_dir = os.getenv("NC_DIR")
+cluster = os.getenv("EDGE_CLUSTER")
+
+port=int(os.getenv("EDGE_START_PORT",6432))
+usr=os.getenv("EDGE_USERNAME","lcusr")
+pw=os.getenv("EDGE_PASSWORD","password")
+host=os.getenv("EDGE_HOST","localhost")
+dbname=os.getenv("EDGE_DB","lcdb")
+
+## Make n2's copy of foo_repair diverge from n1's: 10 changed rows, 10 missing rows and one extra row
+def diverge_n2():
+    util_test.write_psql("UPDATE foo_repair SET employeeName='changed' WHERE employeeID <= 10",host,dbname,port+1,pw,usr)
+    util_test.write_psql("DELETE FROM foo_repair WHERE employeeID > 990",host,dbname,port+1,pw,usr)
+    util_test.write_psql("INSERT INTO foo_repair (employeeID,employeeName,employeeMail) VALUES(1001,'extra','extra@pgedge.com')",host,dbname,port+1,pw,usr)
+
+## Diff foo_repair, check that the diffs are found (20 rows on n1's side) and return the diff file
+def diff_diverged(msg, args=""):
+    cmd_node = f"ace table-diff {cluster} public.foo_repair {args}"
+    res=util_test.run_cmd(msg, cmd_node, f"{home_dir}")
+    print(res)
+    diff_file = re.search(r"(diffs/\S+?/diff\.json)", res.stdout)
+    if res.returncode == 1 or "FOUND 20 DIFFS BETWEEN n1 AND n2" not in res.stdout or not diff_file:
+        util_test.exit_message(f"Fail - {os.path.basename(__file__)} - {msg}", 1)
+    return diff_file.group(1)
+
+## Diff foo_repair and check that the nodes match again
+def diff_repaired(msg):
+    cmd_node = f"ace table-diff {cluster} public.foo_repair"
+    res=util_test.run_cmd(msg, cmd_node, f"{home_dir}")
+    print(res)
+    if res.returncode == 1 or "TABLES MATCH OK" not in res.stdout:
+        util_test.exit_message(f"Fail - {os.path.basename(__file__)} - {msg}", 1)
+
+
+#repair the diffs with the values recorded in the diff file (the default row mode)
+diverge_n2()
+diff_file = diff_diverged("diff before row repair")
+
+cmd_node = f"ace table-repair {cluster} {diff_file} n1 public.foo_repair"
+res=util_test.run_cmd("row repair", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "Successfully applied diffs" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Row Repair", 1)
+
+diff_repaired("diff after row repair")
+print("*" * 100)
+
+#repair the diffs by copying n1's rows into staging tables (bulk mode)
+diverge_n2()
+diff_file = diff_diverged("diff before bulk repair")
+
+cmd_node = f"ace table-repair {cluster} {diff_file} n1 public.foo_repair --repair_mode=bulk"
+res=util_test.run_cmd("bulk repair", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "Successfully applied diffs" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Bulk Repair", 1)
+
+diff_repaired("diff after bulk repair")
+print("*" * 100)
+
+#repair a diff of some of the columns in each mode: the rows missing on n2 are inserted whole,
+#so a diff of every column matches afterwards
+for mode in ["row", "bulk"]:
+    diverge_n2()
+    diff_file = diff_diverged(f"projected diff before {mode} repair", "--columns=employeename")
+
+    cmd_node = f"ace table-repair {cluster} {diff_file} n1 public.foo_repair --repair_mode={mode}"
+    res=util_test.run_cmd(f"{mode} repair of a projected diff", cmd_node, f"{home_dir}")
+    print(res)
+    if res.returncode == 1 or "Successfully applied diffs" not in res.stdout:
+        util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Projected {mode} Repair", 1)
+
+    diff_repaired(f"diff after {mode} repair of a projected diff")
+    print("*" * 100)
+
+#rerun the diff in small batches of keys: the diffs are still there, and are written to a new diff file
+diverge_n2()
+diff_file = diff_diverged("diff before batched rerun")
+
+cmd_node = f"ace table-rerun {cluster} {diff_file} public.foo_repair --batch_size=7"
+res=util_test.run_cmd("batched rerun", cmd_node, f"{home_dir}")
+print(res)
+rerun_file = re.search(r"(diffs/\S+?/diff\.json)", res.stdout)
+if res.returncode == 1 or "FOUND DIFFS BETWEEN NODES" not in res.stdout or not rerun_file:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Batched Rerun", 1)
+with open(os.path.join(home_dir, "pgedge", rerun_file.group(1))) as f:
+    rerun_diffs = json.load(f)["n1/n2"]
+if len(rerun_diffs["n1"]) != 20 or len(rerun_diffs["n2"]) != 11:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Batched Rerun Diffs", 1)
+
+#repair from the rerun's diff file, then rerun the first diff file: the diffs are gone
+cmd_node = f"ace table-repair {cluster} {rerun_file.group(1)} n1 public.foo_repair"
+res=util_test.run_cmd("repair from rerun", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "Successfully applied diffs" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Repair From Rerun", 1)
+
+cmd_node = f"ace table-rerun {cluster} {diff_file} public.foo_repair --batch_size=7"
+res=util_test.run_cmd("batched rerun after repair", cmd_node, f"{home_dir}")
+print(res)
+if res.returncode == 1 or "TABLES MATCH OK" not in res.stdout:
+    util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Batched Rerun After Repair", 1)
+
+diff_repaired("diff after repair from rerun")
+print("*" * 100)
+
+#repair in chunks of 5 rows, in each mode: n2 rejects row 995 in the third chunk, so the repair
+#stops with two chunks checkpointed, and resumes from the third once the row is accepted
+for mode in ["row", "bulk"]:
+    diverge_n2()
+    diff_file = diff_diverged(f"diff before chunked {mode} repair")
+
+    util_test.write_psql("ALTER TABLE foo_repair ADD CONSTRAINT foo_repair_no_995 CHECK (employeeID <> 995) NOT VALID",host,dbname,port+1,pw,usr)
+    cmd_node = f"ace table-repair {cluster} {diff_file} n1 public.foo_repair --repair_mode={mode} --chunk_rows=5"
+    res=util_test.run_cmd(f"chunked {mode} repair with a failed chunk", cmd_node, f"{home_dir}")
+    print(res)
+    util_test.write_psql("ALTER TABLE foo_repair DROP CONSTRAINT foo_repair_no_995",host,dbname,port+1,pw,usr)
+    checkpoint_file = os.path.join(home_dir, "pgedge", f"{diff_file}.checkpoint")
+    if "Rerun with --resume" not in res.stdout or not os.path.exists(checkpoint_file):
+        util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Chunked {mode} Repair Failure", 1)
+    with open(checkpoint_file) as f:
+        if json.load(f)["done"] != {"n2": 2}:
+            util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Chunked {mode} Repair Checkpoint", 1)
+
+    cmd_node = f"ace table-repair {cluster} {diff_file} n1 public.foo_repair --repair_mode={mode} --chunk_rows=5 --resume"
+    res=util_test.run_cmd(f"resume chunked {mode} repair", cmd_node, f"{home_dir}")
+    print(res)
+    if res.returncode == 1 or "Resuming repair of n2 at chunk 3" not in res.stdout or "Successfully applied diffs" not in res.stdout or os.path.exists(checkpoint_file):
+        util_test.exit_message(f"Fail - {os.path.basename(__file__)} - Resume Chunked {mode} Repair", 1)
+
+    diff_repaired(f"diff after resumed chunked {mode} repair")
+    print("*" * 100)
+
+util_test.exit_message(f"Pass - {os.path.basename(__file__)}", 0)
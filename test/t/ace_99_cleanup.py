@@ -26,6 +26,21 @@ for n in range(1,num_nodes+1):
     #DROP table - no primarykey
     row = util_test.write_psql("DROP TABLE foo_nopk CASCADE",host,dbname,port,pw,usr)
 
+    #DROP table - repaired
+    row = util_test.write_psql("DROP TABLE foo_repair CASCADE",host,dbname,port,pw,usr)
+
+    #DROP table - diverged
+    row = util_test.write_psql("DROP TABLE foo_diverged CASCADE",host,dbname,port,pw,usr)
+
+    #DROP table - partitioned
+    row = util_test.write_psql("DROP TABLE foo_part CASCADE",host,dbname,port,pw,usr)
+
+    #DROP table - no primary key, diverged
+    row = util_test.write_psql("DROP TABLE foo_nopk_diff CASCADE",host,dbname,port,pw,usr)
+
+    #DROP the change logs kept for the Merkle trees
+    row = util_test.write_psql("DROP SCHEMA ace_mtree CASCADE",host,dbname,port,pw,usr)
+
     print(f"Drop tables on n{n}")
     port = port + 1
 